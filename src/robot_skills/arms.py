@@ -1,17 +1,27 @@
 #! /usr/bin/env python
 
+import os
+from collections import namedtuple
+
+import numpy as np
 import rospy
 import std_msgs.msg
 import tf_server
 import visualization_msgs.msg
 from actionlib import SimpleActionClient, GoalStatus
-from control_msgs.msg import FollowJointTrajectoryGoal, FollowJointTrajectoryAction
-from diagnostic_msgs.msg import DiagnosticArray
+from control_msgs.msg import FollowJointTrajectoryGoal
+from sensor_msgs.msg import JointState
 from trajectory_msgs.msg import JointTrajectory, JointTrajectoryPoint
 from tue_manipulation_msgs.msg import GraspPrecomputeGoal, GraspPrecomputeAction
 from tue_manipulation_msgs.msg import GripperCommandGoal, GripperCommandAction
 from tue_msgs.msg import GripperCommand
 
+from .util import action_server_monitor
+from .util import hardware_status
+from .util import reachability_cache
+from .util import time_parameterization
+from .util import trajectory_dispatcher
+
 
 class ArmState:
     """Specifies a State either OPEN or CLOSE"""
@@ -19,6 +29,21 @@ class ArmState:
     CLOSE = "close"
 
 
+# Maximum time (in seconds) to wait for the first check of an action server by the monitor
+SERVER_TIMEOUT = 0.25
+
+# Time (in seconds) after sending at which a queued trajectory takes over from the executing one
+SPLICE_LOOKAHEAD = 0.1
+
+# Timed trajectory as sent to the controller: stamp (rospy.Time) of the start state, joint names and the positions
+# (N, J), times from stamp (N) and velocities (N, J) of the start state and the points
+TimedTrajectory = namedtuple("TimedTrajectory", ["stamp", "joint_names", "positions", "times", "velocities"])
+
+# Goal template of joint references: joint names, references and the untimed points for them. The points are shared by
+# all goals that are sent for the references, so they are never changed after compiling.
+CompiledReferences = namedtuple("CompiledReferences", ["joint_names", "positions", "points"])
+
+
 class Arm(object):
     """
     A single arm can be either left or right, extends Arms:
@@ -55,8 +80,26 @@ class Arm(object):
         self.default_configurations = self.load_param('skills/arm/default_configurations')
         self.default_trajectories   = self.load_param('skills/arm/default_trajectories')
 
+        # Goal templates (see CompiledReferences) of the default configurations and trajectories, compiled on first use
+        self._compiled_references = {}
+
+        # Outcomes of the grasp precompute goals (in base_link), optionally kept between runs
+        cache_directory = rospy.get_param('/' + self.robot_name + '/skills/arm/reachability_cache_directory', None)
+        self.reachability = reachability_cache.ReachabilityCache(
+            filename=os.path.join(cache_directory, 'reachability_' + self.side + '.json') if cache_directory else None)
+
+        # Velocity and acceleration limits (per joint) for the time parameterization of trajectories. Without limits,
+        # the timing of the trajectories is left to the controller.
+        self.joint_limits = self._load_joint_limits('skills/arm', self.joint_names)
+        self.joint_limits.update(self._load_joint_limits('skills/torso', self.torso_joint_names))
+
+        # The measured joint positions are the start state of the trajectories
+        self._joint_state = None
+        rospy.Subscriber("/" + robot_name + "/joint_states", JointState, self._receive_joint_state, queue_size=1)
+
         # listen to the hardware status to determine if the arm is available
-        rospy.Subscriber("/amigo/hardware_status", DiagnosticArray, self.cb_hardware_status)
+        self._hardware_status = hardware_status.get_dispatcher(robot_name)
+        self._hardware_status.register(self.side + '_arm', operational_changed=self._operational_changed)
 
         # Init gripper actionlib
         self._ac_gripper = SimpleActionClient(
@@ -66,22 +109,17 @@ class Arm(object):
         self._ac_grasp_precompute = SimpleActionClient(
             "/" + robot_name + "/" + self.side + "_arm/grasp_precompute", GraspPrecomputeAction)
 
-        # Init joint trajectory action server
-        self._ac_joint_traj = SimpleActionClient(
-            "/" + robot_name + "/body/joint_trajectory_action", FollowJointTrajectoryAction)
-
-        # ToDo: don't hardcode? // Comment from @reinzor, this always fails on
-        # startup of action server, why do we need this, who uses this info?
-        server_timeout = 0.25
-        self._ac_gripper_present = self._ac_gripper.wait_for_server(timeout=rospy.Duration(server_timeout))
-        if not self._ac_gripper_present:
-            rospy.loginfo("Cannot find gripper {0} server".format(self.side))
-        self._ac_grasp_precompute_present  = self._ac_grasp_precompute.wait_for_server(timeout=rospy.Duration(server_timeout))
-        if not self._ac_grasp_precompute_present:
-            rospy.loginfo("Cannot find grasp precompute {0} server".format(self.side))
-        self._ac_joint_traj_present = self._ac_joint_traj.wait_for_server(timeout=rospy.Duration(server_timeout))
-        if not self._ac_joint_traj_present:
-            rospy.loginfo("Cannot find joint trajectory action server {0}".format(self.side))
+        # Joint trajectory goals go through the dispatcher of the (shared) body joint trajectory action server
+        self._joint_traj_dispatcher = trajectory_dispatcher.get_dispatcher(robot_name)
+        self._joint_traj_goal = None
+        self._active_trajectory = None  # TimedTrajectory of the last timed goal
+
+        # The availability of the action servers is checked in the background by the monitor of the robot
+        monitor = action_server_monitor.get_monitor(robot_name)
+        self._gripper_server = monitor.register(self.side + "_arm/gripper", self._ac_gripper)
+        self._grasp_precompute_server = monitor.register(self.side + "_arm/grasp_precompute",
+                                                         self._ac_grasp_precompute)
+        self._joint_traj_server = monitor.register("body/joint_trajectory_action", self._joint_traj_dispatcher)
 
         # Init marker publisher
         self._marker_publisher = rospy.Publisher(
@@ -94,11 +132,94 @@ class Arm(object):
         '''
         return rospy.get_param('/' + self.robot_name + '/' + param_name)
 
+    def _load_joint_limits(self, namespace, joint_names):
+        '''
+        Loads the velocity_limits and acceleration_limits (lists in the order of joint_names) in namespace
+        :return: dict joint name --> (velocity limit, acceleration limit), empty if the limits are not available
+        '''
+        velocity_limits = rospy.get_param('/' + self.robot_name + '/' + namespace + '/velocity_limits', None)
+        acceleration_limits = rospy.get_param('/' + self.robot_name + '/' + namespace + '/acceleration_limits', None)
+        if not velocity_limits or not acceleration_limits:
+            return {}
+        if not len(velocity_limits) == len(acceleration_limits) == len(joint_names):
+            rospy.logwarn('{0}: expected {1} velocity and acceleration limits'.format(namespace, len(joint_names)))
+            return {}
+        return dict(zip(joint_names, zip(velocity_limits, acceleration_limits)))
+
+    def _receive_joint_state(self, msg):
+        self._joint_state = msg
+
+    def _get_joint_positions(self, joint_names):
+        '''
+        Returns the measured positions of joint_names, None if not all of them are measured
+        '''
+        msg = self._joint_state
+        if msg is None:
+            return None
+        positions = dict(zip(msg.name, msg.position))
+        try:
+            return [positions[name] for name in joint_names]
+        except KeyError:
+            return None
+
+    def _time_parameterize(self, joints_references, joint_names):
+        '''
+        Computes the times from start and the velocities of the joint references, from the measured joint positions to
+        the last reference, within the velocity and acceleration limits of the joints
+        :return: tuple (positions, times, velocities) including the start state, None if the limits or the start state
+            are unknown
+        '''
+        if not all(name in self.joint_limits for name in joint_names):
+            return None
+        start = self._get_joint_positions(joint_names)
+        if start is None:
+            rospy.logwarn('No joint state for all of {0}: timing is left to the controller'.format(joint_names))
+            return None
+        limits = np.array([self.joint_limits[name] for name in joint_names])
+        positions = np.vstack([start, joints_references])
+        times, velocities = time_parameterization.time_parameterize(positions, limits[:, 0], limits[:, 1])
+        return positions, times, velocities
+
+    def _splice_trajectory(self, joint_names, positions):
+        '''
+        Continues the executing trajectory from SPLICE_LOOKAHEAD seconds from now, with its remaining points followed by
+        the joint references in positions, without stopping in between
+        :return: tuple (positions, stamp, timing), None if no timed trajectory for the same joints is executing
+        '''
+        active = self._active_trajectory
+        joint_names = list(joint_names)
+        if active is None or active.joint_names != joint_names:
+            return None
+        if any(len(reference) != len(joint_names) for reference in positions):
+            return None
+        if self._joint_traj_goal and self._joint_traj_goal.done():
+            return None
+        t = (rospy.Time.now() - active.stamp).to_sec() + SPLICE_LOOKAHEAD
+        if t >= active.times[-1]:
+            return None
+
+        if not all(name in self.joint_limits for name in joint_names):
+            return None
+        limits = np.array([self.joint_limits[name] for name in joint_names])
+        timing = time_parameterization.splice(active.positions, active.times, active.velocities, t, positions,
+                                              limits[:, 0], limits[:, 1])
+        return timing[0][1:].tolist(), active.stamp + rospy.Duration(t), timing
+
     def cancel_goals(self):
-        """ Cancels the currently active grasp-precompute and joint-trajectory-action goals
+        """ Cancels the currently active grasp-precompute and joint-trajectory-action goals. If the joint trajectory goal
+        has been merged with a goal of another arm or the torso, the motion of that part is cancelled as well.
         """
         self._ac_grasp_precompute.cancel_all_goals()
-        self._ac_joint_traj.cancel_all_goals()
+        if self._joint_traj_goal:
+            if self._joint_traj_goal.merged and not self._joint_traj_goal.done():
+                rospy.logwarn("{0} arm goal was merged with the goal of another body part: cancelling both".format(
+                    self.side))
+            self._joint_traj_goal.cancel()
+
+    def cancel_gripper_goals(self):
+        """ Cancels the currently active gripper goals
+        """
+        self._ac_gripper.cancel_all_goals()
 
     def close(self):
         try:
@@ -108,7 +229,8 @@ class Arm(object):
 
         self._ac_gripper.cancel_all_goals()
         self._ac_grasp_precompute.cancel_all_goals()
-        self._ac_joint_traj.cancel_all_goals()
+        self._joint_traj_dispatcher.cancel_all_goals()
+        self.reachability.save()
 
     @property
     def operational(self):
@@ -117,42 +239,30 @@ class Arm(object):
         '''
         return self._operational
 
-    def cb_hardware_status(self, msg):
+    def _operational_changed(self, operational):
         '''
-        hardware_status callback to determine if the arms are operational
+        hardware_status callback, called when the arm becomes (not) operational
         '''
-        diags = [diag for diag in msg.status if diag.name == self.side + '_arm']
-
-        if len(diags) == 0:
-            rospy.logwarn('no diagnostic msg received for the %s arm' % self.side)
-        elif len(diags) != 1:
-            rospy.logwarn('multiple diagnostic msgs received for the %s arm' % self.side)
-        else:
-            level = diags[0].level
-
-            # 0. Stale
-            # 1. Idle
-            # 2. Operational
-            # 3. Homing
-            # 4. Error
-            if level != 2:
-                self._operational = False
-            else:
-                self._operational = True
+        if not operational:
+            rospy.logwarn('{0} arm is not operational (hardware status level {1})'.format(
+                self.side, self._hardware_status.get_level(self.side + '_arm')))
+        self._operational = operational
 
     def send_goal(self, px, py, pz, roll, pitch, yaw,
                   timeout=30,
                   pre_grasp=False,
                   frame_id='/base_link',
                   first_joint_pos_only=False,
-                  allowed_touch_objects=[]):
+                  allowed_touch_objects=[],
+                  skip_if_unreachable=False):
         """
         Send a arm to a goal:
 
         Using a position px, py, pz and orientation roll, pitch, yaw. A time
         out time_out. pre_grasp means go to an offset that is normally needed
         for things such as grasping. You can also specify the frame_id which
-        defaults to base_link """
+        defaults to base_link. If skip_if_unreachable, goals that failed
+        before (for targets in base_link) fail immediately """
 
         # save the arguments for debugging later
         myargs = locals()
@@ -162,6 +272,15 @@ class Arm(object):
             frame_id = "/"+self.robot_name+frame_id
             rospy.loginfo("Grasp precompute frame id = {0}".format(frame_id))
 
+        # Only targets in base_link are in the reachability cache
+        cache_key = None
+        if frame_id.endswith('/base_link') and not first_joint_pos_only:
+            cache_key = ((px, py, pz, roll, pitch, yaw), (bool(pre_grasp),))
+            if skip_if_unreachable and not self.reachability.likely_reachable(*cache_key):
+                rospy.logwarn('Skipping grasp precompute goal, target is probably not reachable for the {0} arm'
+                              .format(self.side))
+                return False
+
         # Create goal:
         grasp_precompute_goal = GraspPrecomputeGoal()
         grasp_precompute_goal.goal.header.frame_id = frame_id
@@ -206,6 +325,10 @@ class Arm(object):
 
         # Send goal:
 
+        if not self._grasp_precompute_server.wait(SERVER_TIMEOUT):
+            rospy.logwarn('Grasp precompute {0} server is not present: goal not sent'.format(self.side))
+            return False
+
         if timeout == 0.0:
             self._ac_grasp_precompute.send_goal(grasp_precompute_goal)
             return True
@@ -214,6 +337,10 @@ class Arm(object):
                 grasp_precompute_goal,
                 execute_timeout=rospy.Duration(timeout)
             )
+            # Only a succeeded or aborted/rejected goal says something about the reachability of the target, not a
+            # timeout or preemption
+            if cache_key and result in (GoalStatus.SUCCEEDED, GoalStatus.ABORTED, GoalStatus.REJECTED):
+                self.reachability.record(cache_key[0], result == GoalStatus.SUCCEEDED, cache_key[1])
             if result == GoalStatus.SUCCEEDED:
                 return True
             else:
@@ -221,14 +348,21 @@ class Arm(object):
                 rospy.logerr('grasp precompute goal failed: \n%s', repr(myargs))
                 return False
 
+    def grasp_reachability(self, px, py, pz, roll, pitch, yaw, pre_grasp=False):
+        """
+        Returns the estimated probability (0.5 if unknown) that a target in base_link is reachable for this arm, based
+        on the outcomes of earlier grasp precompute goals
+        """
+        return self.reachability.reachability((px, py, pz, roll, pitch, yaw), (bool(pre_grasp),))
+
     def send_joint_goal(self, configuration, timeout=5.0):
         '''
         Send a named joint goal (pose) defined in the parameter default_configurations to the arm
         '''
         if configuration in self.default_configurations:
-            return self._send_joint_trajectory(
-                [self.default_configurations[configuration]]
-                , timeout=rospy.Duration(timeout))
+            references = self._get_compiled_references(('configuration', configuration),
+                                                       [self.default_configurations[configuration]])
+            return self._send_joint_trajectory_goal(references, timeout=rospy.Duration(timeout))
         else:
             rospy.logwarn('Default configuration {0} does not exist'.format(configuration))
             return False
@@ -239,11 +373,38 @@ class Arm(object):
         the arm
         '''
         if configuration in self.default_trajectories:
-            return self._send_joint_trajectory(self.default_trajectories[configuration], timeout=rospy.Duration(timeout))
+            references = self._get_compiled_references(('trajectory', configuration),
+                                                       self.default_trajectories[configuration])
+            return self._send_joint_trajectory_goal(references, timeout=rospy.Duration(timeout))
         else:
             rospy.logwarn('Default trajectories {0} does not exist'.format(configuration))
             return False
 
+    def queue_joint_trajectory(self, joints_references, timeout=0.0, joint_names=None):
+        '''
+        Appends an array of joint references to the trajectory that is executing: the arm continues from its current
+        motion through the remaining points of that trajectory into the new references, without stopping in between.
+        If no trajectory is executing, this is the same as sending the references.
+
+        Blending needs the velocity and acceleration limits of the joints and references for the same joints as the
+        executing trajectory. Otherwise the references are sent after the executing trajectory finished. That is waited
+        for at most timeout seconds (SERVER_TIMEOUT if timeout is zero), after which the references are not sent and
+        False is returned. If timeout is not zero, it waits for the combined trajectory.
+        '''
+        references = self._compile_joint_references(joints_references, joint_names)
+        return self._send_joint_trajectory_goal(references, rospy.Duration(timeout), append=True)
+
+    def queue_joint_goal(self, configuration, timeout=0.0):
+        '''
+        Appends a named joint goal (pose) defined in the parameter default_configurations to the trajectory that is
+        executing, see queue_joint_trajectory
+        '''
+        if configuration in self.default_configurations:
+            return self.queue_joint_trajectory([self.default_configurations[configuration]], timeout=timeout)
+        else:
+            rospy.logwarn('Default configuration {0} does not exist'.format(configuration))
+            return False
+
     def reset(self, timeout=0.0):
         '''
         Put the arm into the 'reset' pose
@@ -275,6 +436,10 @@ class Arm(object):
             rospy.logerr('State shoulde be open or close, now it is {0}'.format(state))
             return False
 
+        if not self._gripper_server.wait(SERVER_TIMEOUT):
+            rospy.logwarn('Gripper {0} server is not present: goal not sent'.format(self.side))
+            return False
+
         self._ac_gripper.send_goal(goal)
 
         if state == 'open':
@@ -341,20 +506,33 @@ class Arm(object):
         '''
         Low level method that sends a array of joint references to the arm.
 
-        If timeout is defined, it will wait for timeout*len(joints_reference) seconds for the
-        completion of the actionlib goal. It will return True as soon as possible when the goal
+        The references are timed as fast as the velocity and acceleration limits of the joints
+        allow. If timeout is defined, it will wait for the duration of the trajectory plus timeout
+        seconds for the completion of the actionlib goal (timeout*len(joints_reference) seconds if
+        the trajectory can not be timed). It will return True as soon as possible when the goal
         succeeded. On timeout, it will return False.
         '''
-        # First: check if the actionlib is available
-        if not self._ac_joint_traj_present:
-            self._ac_joint_traj_present = self._ac_joint_traj.wait_for_server(timeout=rospy.Duration(0.25))
-        # If still not available: return false
-        if not self._ac_joint_traj_present:
-            rospy.logwarn('Joint trajectory action is not present: joint goal not reached')
-            return False
+        references = self._compile_joint_references(joints_references, joint_names)
+        return self._send_joint_trajectory_goal(references, timeout)
 
+    def _get_compiled_references(self, key, joints_references):
+        '''
+        Returns the goal template of a named configuration or trajectory, compiled on first use
+        :param key: tuple ('configuration' or 'trajectory', name)
+        '''
+        if key not in self._compiled_references:
+            self._compiled_references[key] = self._compile_joint_references(joints_references)
+        return self._compiled_references[key]
+
+    def _compile_joint_references(self, joints_references, joint_names=None):
+        '''
+        Determines the joint names of an array of joint references, checks their lengths and builds the untimed points.
+        The result can be cached: every send only fills in a new header and the timing (see CompiledReferences).
+        :return: CompiledReferences, None if there are no references
+        '''
         if not joints_references:
-            return
+            rospy.logwarn('No joint references given for the {0} arm'.format(self.side))
+            return None
 
         if not joint_names:
             if len(joints_references[0]) == len(self.joint_names) + len(self.torso_joint_names):
@@ -362,34 +540,77 @@ class Arm(object):
             else:
                 joint_names = self.joint_names
 
-        time_from_start = rospy.Duration()
-        ps = []
         for joints_reference in joints_references:
             if len(joints_reference) != len(joint_names):
                 rospy.logwarn('Please use the correct %d number of joint references (current = %d'
                               % (len(joint_names), len(joints_references)))
 
-            ps.append(JointTrajectoryPoint(
-                positions=joints_reference,
-                time_from_start=time_from_start))
+        positions = tuple(tuple(joints_reference) for joints_reference in joints_references)
+        points = tuple(JointTrajectoryPoint(positions=list(reference), time_from_start=rospy.Duration())
+                       for reference in positions)
+        return CompiledReferences(tuple(joint_names), positions, points)
+
+    def _send_joint_trajectory_goal(self, references, timeout, append=False):
+        '''
+        Fills in a new goal with a header and timing for compiled joint references (see _compile_joint_references) and
+        sends it, see _send_joint_trajectory and queue_joint_trajectory
+        '''
+        # First: check if the actionlib is available (fails immediately if the monitor found it absent)
+        if not self._joint_traj_server.wait(SERVER_TIMEOUT):
+            rospy.logwarn('Joint trajectory action is not present: joint goal not reached')
+            return False
+
+        if references is None:
+            return False
+        joint_names, positions, points = references
+
+        timing = None
+        stamp = rospy.Time()  # Zero: start the trajectory when it is received
+        if append:
+            spliced = self._splice_trajectory(joint_names, positions)
+            if spliced:
+                positions, stamp, timing = spliced
+                points = [JointTrajectoryPoint(positions=reference) for reference in positions]
+            elif self._joint_traj_goal and not self._joint_traj_goal.done():
+                # The executing trajectory can not be continued (it is not timed, or it is for other joints), so it can
+                # only be appended to after it finished: a queued goal never preempts it. Wait at most timeout
+                # (SERVER_TIMEOUT if the caller does not wait) for that.
+                wait = timeout if timeout != rospy.Duration(0) else rospy.Duration(SERVER_TIMEOUT)
+                if not self._joint_traj_goal.wait_for_result(wait):
+                    rospy.logwarn('{0} arm is still executing a trajectory that can not be continued: joint goal not '
+                                  'queued'.format(self.side))
+                    return False
+
+        if timing is None and all(len(reference) == len(joint_names) for reference in positions):
+            timing = self._time_parameterize(positions, joint_names)
+
+        if timing:
+            # The template points are shared: a timed goal gets its own points, with the same positions
+            ps = [JointTrajectoryPoint(positions=point.positions, velocities=timing[2][i + 1].tolist(),
+                                       time_from_start=rospy.Duration(float(timing[1][i + 1])))
+                  for i, point in enumerate(points)]
+        else:
+            ps = list(points)
 
-        joint_trajectory = JointTrajectory(joint_names=joint_names,
-                                           points=ps)
-        goal = FollowJointTrajectoryGoal(trajectory=joint_trajectory, goal_time_tolerance=timeout)
+        goal = FollowJointTrajectoryGoal(trajectory=JointTrajectory(joint_names=list(joint_names), points=ps),
+                                         goal_time_tolerance=timeout)
+        goal.trajectory.header.stamp = stamp
 
         rospy.logdebug("Send {0} arm to jointcoords \n{1}".format(self.side, ps))
 
-        import time; time.sleep(0.001)  # This is necessary: the rtt_actionlib in the hardware seems
-                                        # to only have a queue size of 1 and runs at 1000 hz. This
-                                        # means that if two goals are send approximately at the same
-                                        # time (e.g. an arm goal and a torso goal), one of the two
-                                        # goals probably won't make it. This sleep makes sure the
-                                        # goals will always arrive in different update hooks in the
-                                        # hardware TrajectoryActionLib server.
+        # The dispatcher spaces (and merges) the goals of the arms and the torso for the hardware action server
+        self._joint_traj_goal = self._joint_traj_dispatcher.send_goal(goal, timing)
+        self._active_trajectory = None
+        if timing:
+            start = rospy.Time.now() if stamp.is_zero() else stamp
+            self._active_trajectory = TimedTrajectory(start, list(joint_names), *timing)
 
-        self._ac_joint_traj.send_goal(goal)
         if timeout != rospy.Duration(0):
-            done = self._ac_joint_traj.wait_for_result(timeout*len(joints_references))
+            if timing:
+                done = self._joint_traj_goal.wait_for_result(
+                    rospy.Duration(float(timing[1][-1]) + SPLICE_LOOKAHEAD) + timeout)
+            else:
+                done = self._joint_traj_goal.wait_for_result(timeout*len(ps))
             if not done:
                 rospy.logwarn("Cannot reach joint goal {0}".format(goal))
             return done
@@ -399,8 +620,8 @@ class Arm(object):
     def wait_for_motion_done(self, timeout=10.0):
         # rospy.loginfo('Waiting for ac_joint_traj')
         starttime = rospy.Time.now()
-        if self._ac_joint_traj.gh:
-            self._ac_joint_traj.wait_for_result(rospy.Duration(10.0))
+        if self._joint_traj_goal:
+            self._joint_traj_goal.wait_for_result(rospy.Duration(10.0))
 
         passed_time = (rospy.Time.now() - starttime).to_sec()
         if passed_time > timeout:
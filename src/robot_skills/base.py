@@ -5,19 +5,192 @@
 #  October '14
 #
 
-import math
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
 
 import geometry_msgs.msg
+import numpy as np
 import rospy
 import tf
-from actionlib import SimpleActionClient
+from actionlib import SimpleActionClient, GoalStatus
 from cb_planner_msgs_srvs.msg import LocalPlannerAction, OrientationConstraint, PositionConstraint, LocalPlannerGoal
 from cb_planner_msgs_srvs.srv import GetPlan, CheckPlan
 
+from .util import action_server_monitor
+from .util import hardware_status
 from .util import nav_analyzer
+from .util import path_util
+from .util import plan_cost_estimator
 from .util import transformations
 
 
+###########################################################################################################################
+
+class NavigationHandle(object):
+    """
+    Handle to a single goal of the local planner. It is updated from the local planner callbacks, so callers can wait
+    for events (arrived, blocked, cancelled, aborted) instead of polling LocalPlanner.getStatus.
+    """
+    ARRIVED = "arrived"
+    BLOCKED = "blocked"
+    CANCELLED = "cancelled"
+    ABORTED = "aborted"
+    TERMINAL = (ARRIVED, CANCELLED, ABORTED)
+
+    def __init__(self, local_planner, plan):
+        self.plan = plan
+        self._local_planner = local_planner
+        self._condition = threading.Condition()
+        self._status = "controlling"
+        self._history = []  # All statuses this goal went through, so short-lived events are not missed by waiters
+        self._done_callbacks = []
+
+    @property
+    def status(self):
+        return self._status
+
+    def done(self):
+        return self._status in self.TERMINAL
+
+    def wait(self, timeout=None):
+        """
+        Waits until the goal is finished
+        :param timeout: maximum time to wait in seconds, None waits forever
+        :return: the final status (arrived, cancelled or aborted) or None on timeout
+        """
+        return self.wait_for_any(self.TERMINAL, timeout)
+
+    def wait_for_any(self, events, timeout=None):
+        """
+        Waits until the first of events (e.g. [NavigationHandle.ARRIVED, NavigationHandle.BLOCKED]) happens. Events that
+        happened before this call only count if they are the current status.
+        :param events: list of statuses to wait for
+        :param timeout: maximum time to wait in seconds, None waits forever
+        :return: the event that happened, or None on timeout or when the goal finished with an event not in events
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            if self._status in events:
+                return self._status
+
+            seen = len(self._history)
+            while True:
+                for status in self._history[seen:]:
+                    if status in events:
+                        return status
+                seen = len(self._history)
+
+                if self.done():
+                    return None
+
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._condition.wait(remaining)
+
+    def add_done_callback(self, callback):
+        """
+        Registers callback(handle), which is called once when the goal is finished (immediately if it already is)
+        """
+        with self._condition:
+            if not self.done():
+                self._done_callbacks.append(callback)
+                return
+        callback(self)
+
+    def cancel(self):
+        """
+        Cancels the goal if it is still the current goal of the local planner
+        """
+        if self._local_planner.getNavigationHandle() is self:
+            self._local_planner.cancelCurrentPlan()
+        self._set_status(self.CANCELLED)
+
+    def _set_status(self, status):
+        with self._condition:
+            if self.done() or (status == self._status and status not in self.TERMINAL):
+                return
+            self._status = status
+            self._history.append(status)
+            self._condition.notify_all()
+
+            callbacks = self._done_callbacks if self.done() else []
+            self._done_callbacks = []
+
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                rospy.logerr("Error in navigation done callback: {0}".format(e))
+
+###########################################################################################################################
+
+class ProgressEstimator(object):
+    """
+    Keeps a bounded time series of distance-to-goal samples of the current goal and estimates the velocity at which the
+    robot approaches the goal (least squares fit over a time window) and the resulting time of arrival.
+    """
+    def __init__(self, max_samples=100, window=2.0, min_velocity=0.01):
+        """
+        :param max_samples: maximum number of samples that is kept
+        :param window: time window (in seconds) of the samples used for the velocity estimate
+        :param min_velocity: below this approach velocity (in m/s), no ETA is estimated
+        """
+        self.window = window
+        self.min_velocity = min_velocity
+        self._samples = deque(maxlen=max_samples)  # (stamp, dtg)
+        self._lock = threading.Lock()  # Samples are added by the feedback callback and read by other threads
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+    def add_sample(self, stamp, dtg):
+        with self._lock:
+            self._samples.append((stamp, dtg))
+
+    def get_samples(self):
+        """ Returns a list with (stamp, distance to goal) tuples, oldest first """
+        with self._lock:
+            return list(self._samples)
+
+    def get_velocity(self):
+        """
+        Returns the smoothed velocity (in m/s) at which the distance to goal decreases, or None if there are too few
+        samples
+        """
+        return self._velocity(self.get_samples())
+
+    def get_eta(self):
+        """
+        Returns the estimated time (in seconds) until arrival, or None if the robot is not approaching its goal
+        """
+        samples = self.get_samples()
+        velocity = self._velocity(samples)
+        if velocity is None or velocity < self.min_velocity:
+            return None
+        return max(0.0, samples[-1][1] / velocity)
+
+    def _velocity(self, samples):
+        """ Least squares approach velocity over the window of a snapshot of the samples """
+        if len(samples) < 2:
+            return None
+
+        samples = np.array(samples)
+        samples = samples[samples[:, 0] >= samples[-1, 0] - self.window]
+        if len(samples) < 2:
+            return None
+
+        t = samples[:, 0] - samples[:, 0].mean()
+        denominator = np.dot(t, t)
+        if denominator <= 0:
+            return None
+        return -float(np.dot(t, samples[:, 1] - samples[:, 1].mean()) / denominator)
+
 ###########################################################################################################################
 
 class LocalPlanner():
@@ -26,6 +199,8 @@ class LocalPlanner():
         self._robot_name = robot_name
         self._tf_listener = tf_listener
         self._action_client = SimpleActionClient('/'+ robot_name +'/local_planner/action_server', LocalPlannerAction)
+        self._server = action_server_monitor.get_monitor(robot_name).register("local_planner/action_server",
+                                                                              self._action_client)
 
         # Public members!
         self._status = "idle" # idle, controlling, blocked, arrived
@@ -33,13 +208,64 @@ class LocalPlanner():
         self._dtg = None
         self._plan = None
         self._goal_handle = None
+        self._navigation_handle = None
+        self._position_constraint = None
+        self._orientation_constraint = None
+
+        # Distance to goal history of the current goal and 'ETA below threshold' callbacks: [threshold, callback]
+        self._progress = ProgressEstimator()
+        self._eta_callbacks = []
+        self._eta_lock = threading.Lock()
+
+        # If > 0, plans are simplified (Douglas-Peucker) with this tolerance (in meters) before they are sent
+        self.simplify_tolerance = 0.0
 
     def setPlan(self, plan, position_constraint, orientation_constraint):
-        goal = LocalPlannerGoal()
-        goal.plan = plan
-        goal.orientation_constraint = orientation_constraint
+        """
+        Sends a plan to the local planner
+        :return: NavigationHandle for this goal
+        """
+        # The previous goal (if any) is replaced by this one
+        if self._navigation_handle:
+            self._navigation_handle._set_status(NavigationHandle.CANCELLED)
+        navigation_handle = NavigationHandle(self, plan)
+        self._navigation_handle = navigation_handle
+        self._progress.reset()
+        with self._eta_lock:
+            self._eta_callbacks = []
+
+        self._position_constraint = position_constraint
         self._orientation_constraint = orientation_constraint
         #self.analyzer.count_plan(plan[0], plan[-1], 0.0, computePathLength(plan))
+        self.__sendGoal(plan)
+
+        return navigation_handle
+
+    def replacePlan(self, plan):
+        """
+        Replaces the plan of the current goal (e.g. after replanning) with the same orientation constraint. Unlike
+        setPlan, the current NavigationHandle, ETA estimate and ETA callbacks are kept.
+        """
+        self.__sendGoal(plan)
+
+    def __sendGoal(self, plan):
+        if self.simplify_tolerance > 0:
+            simplified_plan = path_util.simplify_plan(plan, self.simplify_tolerance)
+            rospy.logdebug("Simplified plan from {0} to {1} poses".format(len(plan), len(simplified_plan)))
+            plan = simplified_plan
+
+        if self._navigation_handle:
+            self._navigation_handle.plan = plan
+
+        if not self._server.wait(0.25):
+            rospy.logwarn("Local planner action server is not present: plan not sent")
+            if self._navigation_handle:
+                self._navigation_handle._set_status(NavigationHandle.ABORTED)
+            return
+
+        goal = LocalPlannerGoal()
+        goal.plan = plan
+        goal.orientation_constraint = self._orientation_constraint
         self._action_client.send_goal(goal, done_cb = self.__doneCallback, feedback_cb = self.__feedbackCallback)
         self._goal_handle = self._action_client.gh
         rospy.loginfo("Goal handle = {0}".format(self._goal_handle))
@@ -51,21 +277,49 @@ class LocalPlanner():
         if state ==0 or state == 1:
             self._action_client.cancel_goal()
             self.__setState("idle")
+            if self._navigation_handle:
+                self._navigation_handle._set_status(NavigationHandle.CANCELLED)
 
     def getGoalHandle(self):
         return self._goal_handle
 
+    def getNavigationHandle(self):
+        return self._navigation_handle
+
     def getStatus(self):
         return self._status
 
     def getDistanceToGoal(self):
         return self._dtg
 
+    def getDistanceToGoalHistory(self):
+        """ Returns a list with (stamp, distance to goal) tuples of the current goal """
+        return self._progress.get_samples()
+
+    def getApproachVelocity(self):
+        """ Returns the smoothed velocity (m/s) with which the distance to goal decreases, or None """
+        return self._progress.get_velocity()
+
+    def getEta(self):
+        """ Returns the estimated time of arrival (in seconds from now) at the current goal, or None """
+        return self._progress.get_eta()
+
+    def addEtaCallback(self, seconds, callback):
+        """
+        Calls callback(eta) once as soon as the estimated time of arrival at the current goal drops below seconds,
+        e.g. to start raising the torso during the final approach. Callbacks are discarded when a new plan is set.
+        """
+        with self._eta_lock:
+            self._eta_callbacks.append([seconds, callback])
+
     def getObstaclePoint(self):
         return self._obstacle_point
 
     def getPlan(self):
-        return plan
+        return self._plan
+
+    def getCurrentPositionConstraint(self):
+        return self._position_constraint
 
     def getCurrentOrientationConstraint(self):
         return self._orientation_constraint
@@ -76,9 +330,40 @@ class LocalPlanner():
         else:
             self.__setState("controlling", None, feedback.dtg, self._plan)
 
+        if self._navigation_handle:
+            self._navigation_handle._set_status(NavigationHandle.BLOCKED if feedback.blocked else "controlling")
+
+        self._progress.add_sample(rospy.get_time(), feedback.dtg)
+        self.__checkEtaCallbacks()
+
     def __doneCallback(self, terminal_state, result):
         self.__setState("arrived")
 
+        if self._navigation_handle:
+            if terminal_state == GoalStatus.SUCCEEDED:
+                self._navigation_handle._set_status(NavigationHandle.ARRIVED)
+            elif terminal_state in (GoalStatus.PREEMPTED, GoalStatus.RECALLED):
+                self._navigation_handle._set_status(NavigationHandle.CANCELLED)
+            else:
+                self._navigation_handle._set_status(NavigationHandle.ABORTED)
+
+    def __checkEtaCallbacks(self):
+        if not self._eta_callbacks:
+            return
+
+        eta = self._progress.get_eta()
+        if eta is None:
+            return
+
+        with self._eta_lock:
+            triggered = [cb for cb in self._eta_callbacks if eta <= cb[0]]
+            self._eta_callbacks = [cb for cb in self._eta_callbacks if eta > cb[0]]
+        for _, callback in triggered:
+            try:
+                callback(eta)
+            except Exception as e:
+                rospy.logerr("Error in ETA callback: {0}".format(e))
+
     def __setState(self, status, obstacle_point=None, dtg=None, plan=None):
         self._status = status
         self._obstacle_point = obstacle_point
@@ -87,43 +372,286 @@ class LocalPlanner():
 
 ###########################################################################################################################
 
+class PlanCache(object):
+    """
+    LRU cache of global plans, keyed by the position constraint and the quantized start position of the robot.
+    Cached plans are validated (e.g. with GlobalPlanner.checkPlan) before they are reused.
+    """
+    def __init__(self, max_size=20, resolution=0.1):
+        """
+        :param max_size: maximum number of plans in the cache
+        :param resolution: quantization step (in meters) of the start position
+        """
+        self.max_size = max_size
+        self.resolution = resolution
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def key(self, position_constraint, start_pose):
+        """
+        Returns the cache key for planning to position_constraint from start_pose (PoseStamped). Only the start
+        position is used: a global plan does not depend on the start orientation.
+        """
+        p = start_pose.pose.position
+        return (position_constraint.frame, position_constraint.constraint,
+                int(round(p.x / self.resolution)), int(round(p.y / self.resolution)))
+
+    def get(self, key, is_valid):
+        """
+        Returns the cached plan for key if it is still valid according to is_valid(plan), otherwise None.
+        Invalid plans are removed from the cache.
+        """
+        with self._lock:
+            plan = self._plans.pop(key, None)
+
+        if plan is not None:
+            if is_valid(plan):
+                self.put(key, plan)  # Re-insert as most recently used
+                with self._lock:
+                    self.hits += 1
+                return plan
+
+        with self._lock:
+            if plan is not None:
+                self.invalidations += 1
+            self.misses += 1
+        return None
+
+    def put(self, key, plan):
+        with self._lock:
+            self._plans.pop(key, None)
+            self._plans[key] = plan
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    @property
+    def hit_rate(self):
+        with self._lock:
+            hits, total = self.hits, self.hits + self.misses
+        return float(hits) / total if total else 0.0
+
+###########################################################################################################################
+
+class PlanRequest(object):
+    """
+    Handle to a global planner request that runs on a worker thread. It can be waited for with a deadline or abandoned
+    (the service call itself cannot be interrupted, but its result is ignored).
+    """
+    def __init__(self, position_constraint):
+        self.position_constraint = position_constraint
+        self.plan = None
+        self.plan_time = None  # Duration of the service call in seconds
+        self._done = threading.Event()
+        self._cancelled = False
+
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def wait(self, timeout=None):
+        """
+        Waits for the plan
+        :param timeout: maximum time to wait in seconds, None waits forever
+        :return: the plan, or None if planning failed, the request was cancelled or the timeout expired
+        """
+        self._done.wait(timeout)
+        if self._cancelled:
+            return None
+        return self.plan
+
+    def cancel(self):
+        """
+        Abandons the request: waiters return None and the plan is discarded
+        """
+        self._cancelled = True
+        self._done.set()
+
+    def _set_result(self, plan, plan_time):
+        if not self._cancelled:
+            self.plan = plan
+            self.plan_time = plan_time
+        self._done.set()
+
+###########################################################################################################################
+
+# index: position of the position constraint in the list that was planned for
+PlanCandidate = namedtuple("PlanCandidate", "position_constraint plan length index")
+
 class GlobalPlanner():
-    def __init__(self, robot_name, tf_listener, analyzer):
+    def __init__(self, robot_name, tf_listener, analyzer, get_pose=None):
         self.analyzer = analyzer
         self._robot_name = robot_name
         self._tf_listener = tf_listener
+        # Callable returning the current robot pose (only used for the plan cache)
+        self._get_pose = get_pose or (lambda: get_location(robot_name, tf_listener))
         self._get_plan_client = rospy.ServiceProxy("/" + robot_name + "/global_planner/get_plan_srv", GetPlan)
         self._check_plan_client = rospy.ServiceProxy("/" + robot_name +"/global_planner/check_plan_srv", CheckPlan)
         rospy.loginfo("Waiting for the global planner services ...")
 
-    def getPlan(self, position_constraint):
+        self.plan_cache = PlanCache()
+
+        # Learns path lengths from every plan, to rank candidates without planning
+        self.cost_estimator = plan_cost_estimator.PlanCostEstimator()
+
+        # Durations (in seconds) of the most recent get_plan service calls
+        self.plan_times = deque(maxlen=100)
+
+    def getPlan(self, position_constraint, use_cache=False, timeout=None):
+        """
+        Plans a path from the current robot pose to the position constraint
+        :param position_constraint: PositionConstraint
+        :param use_cache: if True, a cached plan from (approximately) the same start position to the same constraint
+            is reused if it is still valid according to checkPlan
+        :param timeout: if not None, give up planning after this many seconds
+        :return: list of PoseStamped or None if planning failed
+        """
+        if timeout is not None:
+            request = self.getPlanAsync(position_constraint, use_cache=use_cache)
+            plan = request.wait(timeout)
+            if not request.done():
+                rospy.logerr("Global planner did not return a plan within {0} seconds".format(timeout))
+                request.cancel()
+            return plan
 
         self.position_constraint = position_constraint
 
-        pcs = [position_constraint]
+        plan, _ = self._plan(position_constraint, use_cache, self._get_plan_client)
+        return plan
 
+    def getPlanAsync(self, position_constraint, use_cache=False):
+        """
+        Same as getPlan, but the planning runs on a worker thread
+        :return: PlanRequest
+        """
+        self.position_constraint = position_constraint
+
+        request = PlanRequest(position_constraint)
+
+        def worker():
+            # Every worker uses its own service proxy
+            client = rospy.ServiceProxy("/" + self._robot_name + "/global_planner/get_plan_srv", GetPlan)
+            plan, plan_time = None, None
+            try:
+                plan, plan_time = self._plan(position_constraint, use_cache, client)
+            finally:
+                # Never leave waiters hanging
+                request._set_result(plan, plan_time)
+
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        return request
+
+    def getPlans(self, position_constraints, use_cache=False, timeout=None):
+        """
+        Plans paths to several candidate position constraints concurrently, so this takes about as long as a single
+        getPlan call.
+        :param position_constraints: list of PositionConstraints
+        :param use_cache: see getPlan
+        :param timeout: if not None, candidates that are not planned within this many seconds are dropped
+        :return: list of PlanCandidates (position_constraint, plan, length, index) for the candidates that could be
+            planned, ranked by path length (shortest first)
+        """
+        requests = [self.getPlanAsync(pc, use_cache=use_cache) for pc in position_constraints]
+
+        deadline = None if timeout is None else time.time() + timeout
+        candidates = []
+        for i, request in enumerate(requests):
+            plan = request.wait(None if deadline is None else max(0.0, deadline - time.time()))
+            if not request.done():
+                request.cancel()
+            if plan:
+                candidates.append(PlanCandidate(request.position_constraint, plan, self.computePathLength(plan), i))
+
+        return sorted(candidates, key=lambda candidate: candidate.length)
+
+    def estimateCosts(self, positions):
+        """
+        Estimates the path lengths from the current robot pose to positions without calling the global planner
+        :param positions: list with (x, y) positions (in map)
+        :return: array with the estimated path length per position
+        """
+        p = self._get_pose().pose.position
+        return self.cost_estimator.estimate_many((p.x, p.y), positions)
+
+    def getBestPlans(self, position_constraints, positions, max_plans=3, use_cache=False, timeout=None):
+        """
+        Pre-ranks candidates with the cost estimator and only plans to the max_plans most promising ones
+        :param position_constraints: list of PositionConstraints
+        :param positions: list with an (x, y) position (in map) per position constraint, e.g. the center of the area
+        :param max_plans: maximum number of candidates that are planned
+        :param use_cache: see getPlan
+        :param timeout: see getPlans
+        :return: list of PlanCandidates, ranked by real path length (shortest first)
+        """
+        if not position_constraints:
+            return []
+        order = np.argsort(self.estimateCosts(positions), kind="mergesort")[:max_plans]
+        candidates = self.getPlans([position_constraints[i] for i in order], use_cache=use_cache, timeout=timeout)
+        return [candidate._replace(index=int(order[candidate.index])) for candidate in candidates]
+
+    def getLastPlanTime(self):
+        """ Returns the duration (in seconds) of the last get_plan service call, or None """
+        return self.plan_times[-1] if self.plan_times else None
+
+    def _plan(self, position_constraint, use_cache, client):
+        """
+        Looks up the plan in the cache (if use_cache) or requests it via client
+        :return: tuple (plan or None, duration of the service call or None)
+        """
+        cache_key = None
+        if use_cache:
+            cache_key = self.plan_cache.key(position_constraint, self._get_pose())
+            plan = self.plan_cache.get(cache_key, self.checkPlan)
+            if plan is not None:
+                rospy.loginfo("Reusing cached global plan (hit rate {0:.2f})".format(self.plan_cache.hit_rate))
+                return plan, None
+
+        plan, plan_time = self._requestPlan([position_constraint], client)
+
+        if plan is not None and cache_key is not None:
+            self.plan_cache.put(cache_key, plan)
+
+        return plan, plan_time
+
+    def _requestPlan(self, pcs, client):
         start_time = rospy.Time.now()
 
         try:
-            resp = self._get_plan_client(pcs)
+            resp = client(pcs)
         except Exception as e:
             rospy.logerr("Could not get plan from global planner via service call, is the global planner running?")
             rospy.logerr(e)
-            return None
-
-        if not resp.succes:
-            rospy.logerr("Global planner couldn't plan a path to the specified constraints. Are the constraints you specified valid?")
-            return None
+            return None, None
 
         end_time = rospy.Time.now()
         plan_time = (end_time-start_time).to_sec()
+        self.plan_times.append(plan_time)
+
+        if not resp.succes:
+            rospy.logerr("Global planner couldn't plan a path to the specified constraints. Are the constraints you specified valid?")
+            return None, plan_time
 
         path_length = self.computePathLength(resp.plan)
 
-        #if path_length > 0:
-        #    self.analyzer.count_plan(resp.plan[0], resp.plan[-1], plan_time, path_length)
+        if path_length > 0:
+            start, goal = resp.plan[0].pose.position, resp.plan[-1].pose.position
+            self.cost_estimator.update((start.x, start.y), (goal.x, goal.y), path_length)
+            # Runs on the planning threads, NavAnalyzer.count_plan is thread safe
+            self.analyzer.count_plan(resp.plan[0], resp.plan[-1], plan_time, path_length)
 
-        return resp.plan
+        return resp.plan, plan_time
 
     def checkPlan(self, plan):
         try:
@@ -139,13 +667,298 @@ class GlobalPlanner():
 
     def computePathLength(self, path):
         #rospy.logwarn("Please use the other computepathlength")
-        distance = 0.0
-        for index, pose in enumerate(path):
-            if not index == 0:
-                dx = path[index].pose.position.x - path[index-1].pose.position.x
-                dy = path[index].pose.position.y - path[index-1].pose.position.y
-                distance += math.sqrt( dx*dx + dy*dy)
-        return distance
+        return computePathLength(path)
+
+###########################################################################################################################
+
+class PlanMonitor(object):
+    """
+    Periodically checks (GlobalPlanner.checkPlan) whether the part of the current plan that the robot still has to drive
+    is valid. If not, it replans and hands the new plan to the local planner, often before the local planner reports
+    that it is blocked.
+    """
+    def __init__(self, global_planner, local_planner, get_pose, rate=1.0):
+        """
+        :param global_planner: GlobalPlanner
+        :param local_planner: LocalPlanner
+        :param get_pose: callable returning the current robot pose (PoseStamped in map)
+        :param rate: check rate in Hz
+        """
+        self._global_planner = global_planner
+        self._local_planner = local_planner
+        self._get_pose = get_pose
+        self.rate = rate
+        self._timer = None
+        self._plan_points = (None, None)  # (plan, array with its points)
+
+        self.checks = 0
+        self.invalid_plans = 0
+        self.replans = 0
+        self.replans_failed = 0
+        self.replans_before_blocked = 0  # Replans done while the local planner was not (yet) blocked
+
+    def start(self):
+        if self._timer is None:
+            self._timer = rospy.Timer(rospy.Duration(1.0 / self.rate), self._check)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.shutdown()
+            self._timer = None
+
+    @property
+    def active(self):
+        return self._timer is not None
+
+    def get_statistics(self):
+        return {"checks": self.checks,
+                "invalid_plans": self.invalid_plans,
+                "replans": self.replans,
+                "replans_failed": self.replans_failed,
+                "replans_before_blocked": self.replans_before_blocked}
+
+    def _check(self, event=None):
+        handle = self._local_planner.getNavigationHandle()
+        if handle is None or handle.done():
+            return
+
+        plan = handle.plan
+        if not plan:
+            return
+
+        # Only check the part of the plan the robot still has to drive
+        if self._plan_points[0] is not plan:
+            self._plan_points = (plan, path_util.path_to_array(plan))
+        position = self._get_pose().pose.position
+        index, _, _ = path_util.project_onto_path(self._plan_points[1], (position.x, position.y))
+
+        self.checks += 1
+        if self._global_planner.checkPlan(plan[index:]):
+            return
+
+        self.invalid_plans += 1
+        was_blocked = handle.status == NavigationHandle.BLOCKED
+        rospy.loginfo("Remaining plan is no longer valid, replanning")
+
+        new_plan = self._global_planner.getPlan(self._local_planner.getCurrentPositionConstraint())
+        if handle is not self._local_planner.getNavigationHandle() or handle.done():
+            return  # The goal changed while planning
+
+        if not new_plan:
+            self.replans_failed += 1
+            return
+
+        self._local_planner.replacePlan(new_plan)
+        self.replans += 1
+        if not was_blocked:
+            self.replans_before_blocked += 1
+
+###########################################################################################################################
+
+class PoseProvider(object):
+    """
+    Keeps the latest available map --> base_link transform in memory, so the robot pose can be queried without waiting
+    for the next TF message. The transform is refreshed by a timer; queries specify how old the pose may be and fall
+    back to a blocking lookup if the cached pose is older.
+    """
+    def __init__(self, robot_name, tf_listener, rate=20.0):
+        self._robot_name = robot_name
+        self._tf_listener = tf_listener
+        self._base_link = "/" + robot_name + "/base_link"
+        self._latest = None  # (stamp, translation, rotation)
+        self._timer = rospy.Timer(rospy.Duration(1.0 / rate), self._update)
+
+    def close(self):
+        self._timer.shutdown()
+
+    def get_pose(self, max_age=0.5):
+        """
+        Returns the robot pose (PoseStamped in map)
+        :param max_age: maximum age (in seconds) of the returned pose. If the cached pose is older, the pose is looked
+            up blocking (see get_location)
+        """
+        latest = self._latest
+        if latest is not None:
+            stamp, translation, rotation = latest
+            if (rospy.Time.now() - stamp).to_sec() <= max_age:
+                return _pose_stamped(translation, rotation, stamp)
+
+        rospy.logdebug("No robot pose of at most {0} seconds old available, waiting for TF".format(max_age))
+        return get_location(self._robot_name, self._tf_listener)
+
+    def _update(self, event=None):
+        try:
+            stamp = self._tf_listener.getLatestCommonTime("/map", self._base_link)
+            translation, rotation = self._tf_listener.lookupTransform("/map", self._base_link, stamp)
+        except (tf.LookupException, tf.ConnectivityException, tf.ExtrapolationException, tf.Exception):
+            return
+        self._latest = (stamp, translation, rotation)
+
+###########################################################################################################################
+
+class VelocityProfile(object):
+    """
+    Trapezoidal (acceleration limited) scaling of a velocity command over time: the command is scaled with a factor
+    that ramps linearly from 0 to 1 in ramp_time, stays at 1 and ramps back to 0 at the end of the duration. If the
+    duration is too short to reach full speed, the profile is triangular.
+    """
+    def __init__(self, duration, ramp_time):
+        """
+        :param duration: total duration (in seconds) of the profile
+        :param ramp_time: time (in seconds) needed to accelerate from standstill to full speed, 0 for a step profile
+        """
+        self.duration = max(0.0, duration)
+        self.ramp_time = max(0.0, ramp_time)
+        if self.ramp_time > 0 and self.duration < 2 * self.ramp_time:
+            self.peak = self.duration / (2 * self.ramp_time)
+        else:
+            self.peak = 1.0
+        self._t_ramp = self.peak * self.ramp_time  # Duration of the acceleration and the deceleration phase
+
+    @classmethod
+    def for_distance(cls, distance, speed, ramp_time):
+        """
+        Returns the profile that covers distance when the full speed is speed
+        """
+        if speed <= 0:
+            return cls(0.0, ramp_time)
+        if ramp_time <= 0 or distance >= speed * ramp_time:
+            return cls(distance / speed + ramp_time, ramp_time)
+        # Triangular profile: distance = speed * peak^2 * ramp_time
+        peak = float(np.sqrt(distance / (speed * ramp_time)))
+        return cls(2 * peak * ramp_time, ramp_time)
+
+    def integral(self, t):
+        """
+        Returns the integral of the scale factor from 0 to t, i.e. the fraction of the full speed distance covered
+        """
+        t = min(max(t, 0.0), self.duration)
+        t_ramp = self._t_ramp
+        if t_ramp == 0:
+            return self.peak * t
+        if t < t_ramp:
+            return t * t / (2 * self.ramp_time)
+        if t > self.duration - t_ramp:
+            return self.peak * (self.duration - t_ramp) - (self.duration - t) ** 2 / (2 * self.ramp_time)
+        return t_ramp * t_ramp / (2 * self.ramp_time) + self.peak * (t - t_ramp)
+
+    def average(self, t0, t1):
+        """
+        Returns the average scale factor between t0 and t1, so that a constant command over this interval covers
+        exactly the same distance as the profile
+        """
+        if t1 <= t0:
+            return 0.0
+        return (self.integral(t1) - self.integral(t0)) / (t1 - t0)
+
+###########################################################################################################################
+
+class VelocityStreamer(object):
+    """
+    Publishes velocity commands at a fixed rate. Publish times are absolute deadlines (start + k / rate), so processing
+    time does not make the rate drift, and the final stop command is published exactly at the end of the profile.
+    Every command is the average of the velocity profile over its period, so the commanded distance is exact.
+    """
+    def __init__(self, publisher, rate=20.0):
+        """
+        :param publisher: rospy.Publisher for geometry_msgs/Twist
+        :param rate: publish rate in Hz
+        """
+        self._publisher = publisher
+        self.rate = rate
+        self._stop = threading.Event()
+        self._statistics = {}
+
+    def stream(self, vx, vy, vth, duration=None, distance=None, linear_acceleration=None, angular_acceleration=None):
+        """
+        Drives with velocity (vx, vy, vth) and stops after duration or after driving distance, whichever comes first.
+        Blocks until the robot has been commanded to stop.
+        :param vx, vy: linear velocity (m/s)
+        :param vth: angular velocity (rad/s)
+        :param duration: maximum duration in seconds
+        :param distance: distance (in meters) to drive, only used if the linear velocity is nonzero
+        :param linear_acceleration: if not None, accelerate and decelerate with at most this acceleration (m/s^2)
+        :param angular_acceleration: if not None, accelerate and decelerate with at most this acceleration (rad/s^2)
+        :return: True if the full profile has been streamed, False if it was stopped
+        """
+        speed = float(np.hypot(vx, vy))
+
+        # All velocity components are scaled together, so the ramp is determined by the most limiting one
+        ramp_time = 0.0
+        if linear_acceleration:
+            ramp_time = max(ramp_time, speed / linear_acceleration)
+        if angular_acceleration:
+            ramp_time = max(ramp_time, abs(vth) / angular_acceleration)
+
+        if distance is not None and speed > 0:
+            profile = VelocityProfile.for_distance(distance, speed, ramp_time)
+            if duration is not None and duration < profile.duration:
+                profile = VelocityProfile(duration, ramp_time)
+        elif duration is not None:
+            profile = VelocityProfile(duration, ramp_time)
+        else:
+            rospy.logerr("VelocityStreamer: specify a duration and/or a (linear) distance")
+            return False
+
+        self._stop.clear()
+        period = 1.0 / self.rate
+        jitter = []
+        start = rospy.Time.now().to_sec()
+        end = start + profile.duration
+        k = 0
+        deadline = start
+        while deadline < end and not self._stop.is_set() and not rospy.is_shutdown():
+            self._sleep_until(deadline)
+            now = rospy.Time.now().to_sec()
+            jitter.append(now - deadline)
+
+            t0 = deadline - start
+            scale = profile.average(t0, min(t0 + period, profile.duration))
+            self._publish(scale * vx, scale * vy, scale * vth)
+
+            # Skip deadlines that have already passed instead of publishing a burst
+            k = max(k + 1, int(np.floor((now - start) / period)) + 1)
+            deadline = start + k * period
+
+        completed = not self._stop.is_set() and not rospy.is_shutdown()
+        if completed:
+            self._sleep_until(end)
+        self._publish(0.0, 0.0, 0.0)
+        stop_time = rospy.Time.now().to_sec()
+
+        jitter = np.array(jitter)
+        self._statistics = {"published": len(jitter),
+                            "duration": stop_time - start,
+                            "overshoot": stop_time - end,
+                            "rate": (len(jitter) / (stop_time - start)) if stop_time > start else 0.0,
+                            "mean_jitter": float(np.mean(jitter)) if len(jitter) else 0.0,
+                            "max_jitter": float(np.max(jitter)) if len(jitter) else 0.0}
+        return completed
+
+    def stop(self):
+        """ Stops a running stream (from another thread) """
+        self._stop.set()
+
+    def get_statistics(self):
+        """
+        Returns a dict with statistics of the last stream: number of published commands, duration, overshoot of the
+        duration (s), achieved rate (Hz) and mean and maximum delay (s) of the publish times w.r.t. the deadlines
+        """
+        return dict(self._statistics)
+
+    def _sleep_until(self, deadline):
+        # Waits on the stop event (so stop() interrupts the sleep) until the ROS time reaches the deadline
+        remaining = deadline - rospy.Time.now().to_sec()
+        while remaining > 0 and not self._stop.is_set() and not rospy.is_shutdown():
+            self._stop.wait(remaining)
+            remaining = deadline - rospy.Time.now().to_sec()
+
+    def _publish(self, vx, vy, vth):
+        v = geometry_msgs.msg.Twist()
+        v.linear.x = vx
+        v.linear.y = vy
+        v.angular.z = vth
+        self._publisher.publish(v)
 
 ###########################################################################################################################
 
@@ -158,15 +971,48 @@ class Base(object):
 
         self.analyzer = nav_analyzer.NavAnalyzer(self._robot_name)
 
+        # Cached robot pose
+        self.pose_provider = PoseProvider(self._robot_name, self._tf_listener)
+
         # The plannners
-        self.global_planner = GlobalPlanner(self._robot_name, self._tf_listener, self.analyzer)
+        self.global_planner = GlobalPlanner(self._robot_name, self._tf_listener, self.analyzer, get_pose=self.pose_provider.get_pose)
         self.local_planner = LocalPlanner(self._robot_name, self._tf_listener, self.analyzer)
 
-    def move(self, position_constraint_string, frame):
+        # Optional background check of the remaining plan, use plan_monitor.start() to enable
+        self.plan_monitor = PlanMonitor(self.global_planner, self.local_planner, self.pose_provider.get_pose)
+
+        # Fixed rate streaming of velocity references (force_drive)
+        self.velocity_streamer = VelocityStreamer(
+            self._cmd_vel, rate=rospy.get_param('/' + self._robot_name + '/skills/base/force_drive_rate', 20.0))
+
+        # Hardware status, to determine if the base is available
+        self._operational = True  # In simulation, there will be no hardware cb
+        self._hardware_status_name = rospy.get_param('/' + self._robot_name + '/skills/base/hardware_status_name',
+                                                     'base')
+        self._hardware_status = hardware_status.get_dispatcher(self._robot_name)
+        self._hardware_status.register(self._hardware_status_name, operational_changed=self._operational_changed)
+
+    def close(self):
+        self.plan_monitor.stop()
+        self.pose_provider.close()
+
+    @property
+    def operational(self):
+        """ Whether the hardware status of the base is operational """
+        return self._operational
+
+    def _operational_changed(self, operational):
+        """ hardware_status callback, called when the base becomes (not) operational """
+        if not operational:
+            rospy.logwarn("Base is not operational (hardware status level {0})".format(
+                self._hardware_status.get_level(self._hardware_status_name)))
+        self._operational = operational
+
+    def move(self, position_constraint_string, frame, timeout=None):
         p = PositionConstraint()
         p.constraint = position_constraint_string
         p.frame = frame
-        plan = self.global_planner.getPlan(p)
+        plan = self.global_planner.getPlan(p, use_cache=True, timeout=timeout)
         if plan:
             o = OrientationConstraint()
             o.frame = frame
@@ -174,35 +1020,49 @@ class Base(object):
 
         return plan
 
-    def force_drive(self, vx, vy, vth, timeout):
+    def move_async(self, position_constraint_string, frame, timeout=None):
+        """
+        Same as move, but returns a NavigationHandle to wait for (or get callbacks on) arrival, blocking or
+        cancellation of the goal instead of polling the local planner.
+        :param timeout: if not None, give up planning after this many seconds
+        :return: NavigationHandle or None if no plan was found
+        """
+        p = PositionConstraint()
+        p.constraint = position_constraint_string
+        p.frame = frame
+        plan = self.global_planner.getPlan(p, use_cache=True, timeout=timeout)
+        if not plan:
+            return None
+
+        o = OrientationConstraint()
+        o.frame = frame
+        return self.local_planner.setPlan(plan, p, o)
 
+    def force_drive(self, vx, vy, vth, timeout, distance=None, linear_acceleration=None, angular_acceleration=None):
+        """
+        Drives open loop with velocity (vx, vy, vth), bypassing the planners
+        :param timeout: drive duration in seconds
+        :param distance: if not None, stop after driving this distance (in meters), or after timeout if that is earlier
+        :param linear_acceleration: if not None, ramp the velocity up and down with at most this acceleration (m/s^2)
+        :param angular_acceleration: if not None, ramp the velocity up and down with at most this acceleration (rad/s^2)
+        :return: True if the drive was completed, False if it was interrupted
+        """
         # Cancel the local planner goal
         self.local_planner.cancelCurrentPlan()
 
-        v = geometry_msgs.msg.Twist()        # Initialize velocity
-        t_start = rospy.Time.now()
+        return self.velocity_streamer.stream(vx, vy, vth, duration=timeout, distance=distance,
+                                             linear_acceleration=linear_acceleration,
+                                             angular_acceleration=angular_acceleration)
 
-        # Drive
-        v.linear.x = vx
-        v.linear.y = vy
-        v.angular.z= vth
-        while (rospy.Time.now() - t_start) < rospy.Duration(timeout):
-            self._cmd_vel.publish(v)
-            rospy.sleep(0.1)
-
-        # Stop driving
-        v.linear.x = 0.0
-        v.linear.y = 0.0
-        v.angular.z= 0.0
-        self._cmd_vel.publish(v)
-
-        return True
-
-    def get_location(self):
+    def get_location(self, max_age=None):
         """ Returns a PoseStamped with the robot pose
+        :param max_age: if None (default), wait for the transform at the current time (blocking). Otherwise, the cached
+            pose of the pose provider is returned if it is at most max_age seconds old
         :return: PoseStamped with robot pose
         """
-        return get_location(self._robot_name, self._tf_listener)
+        if max_age is None:
+            return get_location(self._robot_name, self._tf_listener)
+        return self.pose_provider.get_pose(max_age=max_age)
 
     def set_initial_pose(self, x, y, phi):
 
@@ -250,32 +1110,29 @@ def get_location(robot_name, tf_listener):
         tf_listener.waitForTransform("/map", "/" + robot_name + "/base_link", time, rospy.Duration(20.0))
         (ro_trans, ro_rot) = tf_listener.lookupTransform("/map", "/" + robot_name + "/base_link", time)
 
-        position = geometry_msgs.msg.Point()
-        orientation = geometry_msgs.msg.Quaternion()
-
-        position.x = ro_trans[0]
-        position.y = ro_trans[1]
-        orientation.x = ro_rot[0]
-        orientation.y = ro_rot[1]
-        orientation.z = ro_rot[2]
-        orientation.w = ro_rot[3]
-
-        target_pose =  geometry_msgs.msg.PoseStamped(pose=geometry_msgs.msg.Pose(position=position, orientation=orientation))
-        target_pose.header.frame_id = "/map"
-        target_pose.header.stamp = time
-        return target_pose
+        return _pose_stamped(ro_trans, ro_rot, time)
 
     except (tf.LookupException, tf.ConnectivityException):
         rospy.logerr("tf request failed!!!")
-        target_pose =  geometry_msgs.msg.PoseStamped(pose=geometry_msgs.msg.Pose(position=position, orientation=orientation))
+        target_pose =  geometry_msgs.msg.PoseStamped()
         target_pose.header.frame_id = "/map"
         return target_pose
 
+def _pose_stamped(ro_trans, ro_rot, stamp):
+    position = geometry_msgs.msg.Point()
+    orientation = geometry_msgs.msg.Quaternion()
+
+    position.x = ro_trans[0]
+    position.y = ro_trans[1]
+    orientation.x = ro_rot[0]
+    orientation.y = ro_rot[1]
+    orientation.z = ro_rot[2]
+    orientation.w = ro_rot[3]
+
+    target_pose =  geometry_msgs.msg.PoseStamped(pose=geometry_msgs.msg.Pose(position=position, orientation=orientation))
+    target_pose.header.frame_id = "/map"
+    target_pose.header.stamp = stamp
+    return target_pose
+
 def computePathLength(path):
-    distance = 0.0
-    for index, pose in enumerate(path):
-        if not index == 0:
-            dx = path[index].pose.position.x - path[index-1].pose.position.x
-            dy = path[index].pose.position.y - path[index-1].pose.position.y
-            distance += math.sqrt( dx*dx + dy*dy)
-    return distance
+    return path_util.path_length(path_util.path_to_array(path))
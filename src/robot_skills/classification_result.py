@@ -1,4 +1,160 @@
 __author__ = 'loy'
 
 from collections import namedtuple
+
+import numpy as np
+
 ClassificationResult = namedtuple("ClassificationResult", "id type probability distribution") #Generates a class with id, type and probability.
+
+
+class ClassificationMatrix(object):
+    """
+    Dense form of a batch of classification posteriors: probabilities[i, j] is the probability that entity ids[i] is of
+    type labels[j]. All entities share the same label vocabulary, so selections over the whole batch are vectorized.
+    The expected type per entity is the one given by the classifier; if that is not given, the most likely label (None
+    for an entity without posterior).
+
+    >>> m = ClassificationMatrix.from_posteriors(["a", "b", "c"],
+    ...                                          [(["coke", "fanta"], [0.9, 0.1]), (["fanta"], [0.6]), ([], [])])
+    >>> m.labels
+    ['coke', 'fanta']
+    >>> m.expected_types()
+    ['coke', 'fanta', None]
+    >>> m.filter_types(["fanta"]).ids
+    ['b']
+    >>> m.top_k(1)
+    [[('coke', 0.9)], [('fanta', 0.6)], []]
+    """
+    def __init__(self, ids, labels, probabilities, expected_values=None, expected_value_probabilities=None):
+        """
+        :param ids: list with entity ids (rows)
+        :param labels: list with type labels (columns)
+        :param probabilities: numpy array of shape (len(ids), len(labels))
+        :param expected_values: optional expected type per entity (e.g. from the classifier). If None, the most likely
+        label is used
+        :param expected_value_probabilities: optional probability of the expected type per entity
+        """
+        self.ids = list(ids)
+        self.labels = list(labels)
+        self.label_index = {label: j for j, label in enumerate(self.labels)}
+        self.probabilities = np.asarray(probabilities, dtype=float).reshape(len(self.ids), len(self.labels))
+
+        if expected_values is None:
+            expected_values, expected_value_probabilities = self._most_likely()
+        elif expected_value_probabilities is None:
+            expected_value_probabilities = [self.probabilities[i, self.label_index[value]]
+                                            if value in self.label_index else 0.0
+                                            for i, value in enumerate(expected_values)]
+        self._expected_values = list(expected_values)
+        self._expected_value_probabilities = np.asarray(expected_value_probabilities, dtype=float)
+
+    @classmethod
+    def from_posteriors(cls, ids, posteriors, labels=None, expected_values=None, expected_value_probabilities=None):
+        """
+        Builds the matrix from per-entity posteriors
+        :param ids: list with entity ids
+        :param posteriors: list with a (values, probabilities) pair per entity
+        :param labels: optional fixed label vocabulary. If None, the union of all values is used (in order of appearance)
+        :param expected_values: optional expected type per entity, see __init__
+        :param expected_value_probabilities: optional probability of the expected type per entity
+        """
+        if labels is None:
+            labels = []
+            seen = set()
+            for values, _ in posteriors:
+                for value in values:
+                    if value not in seen:
+                        seen.add(value)
+                        labels.append(value)
+
+        label_index = {label: j for j, label in enumerate(labels)}
+
+        rows, cols, data = [], [], []
+        for i, (values, probabilities) in enumerate(posteriors):
+            for value, probability in zip(values, probabilities):
+                j = label_index.get(value)
+                if j is not None:
+                    rows.append(i)
+                    cols.append(j)
+                    data.append(probability)
+
+        matrix = np.zeros((len(ids), len(labels)))
+        matrix[rows, cols] = data
+        return cls(ids, labels, matrix, expected_values, expected_value_probabilities)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def column(self, label):
+        """ Returns the probabilities of all entities for a single label (zeros if the label is unknown) """
+        j = self.label_index.get(label)
+        if j is None:
+            return np.zeros(len(self.ids))
+        return self.probabilities[:, j]
+
+    def expected_types(self):
+        """ Returns the expected type per entity """
+        return list(self._expected_values)
+
+    def expected_probabilities(self):
+        """ Returns the probability of the expected type per entity """
+        return self._expected_value_probabilities.copy()
+
+    def top_k(self, k):
+        """
+        Returns per entity a list with the (at most) k most likely (label, probability) pairs, most likely first. Labels
+        with probability zero are left out.
+        """
+        k = min(k, len(self.labels))
+        if k <= 0:
+            return [[] for _ in self.ids]
+
+        # argpartition selects the k largest in O(n) per row, only those are sorted
+        idx = np.argpartition(-self.probabilities, k - 1, axis=1)[:, :k]
+        rows = np.arange(len(self.ids))[:, None]
+        order = np.argsort(-self.probabilities[rows, idx], axis=1)
+        idx = idx[rows, order]
+        probs = self.probabilities[rows, idx]
+        return [[(self.labels[j], float(p)) for j, p in zip(idx_row, prob_row) if p > 0]
+                for idx_row, prob_row in zip(idx, probs)]
+
+    def threshold(self, min_probability):
+        """
+        Returns a copy of the matrix containing only the entities of which the expected type has a probability of at
+        least min_probability
+        """
+        return self._select_rows(self.expected_probabilities() >= min_probability)
+
+    def filter_types(self, types):
+        """
+        Returns a copy of the matrix containing only the entities of which the expected type is in types
+        """
+        types = set(types)
+        return self._select_rows(np.array([value in types for value in self._expected_values], dtype=bool))
+
+    def to_results(self):
+        """
+        Converts the matrix to a list of ClassificationResults (the form returned by ED.classify)
+        """
+        results = []
+        for i, _id in enumerate(self.ids):
+            nonzero = np.flatnonzero(self.probabilities[i])
+            distribution = {self.labels[j]: float(self.probabilities[i, j]) for j in nonzero}
+            results.append(ClassificationResult(_id, self._expected_values[i],
+                                                float(self._expected_value_probabilities[i]), distribution))
+        return results
+
+    def _most_likely(self):
+        """ Returns the most likely label and its probability per entity, None and 0 for entities without posterior """
+        if not self.labels:
+            return [None] * len(self.ids), np.zeros(len(self.ids))
+        best = np.argmax(self.probabilities, axis=1)
+        probabilities = self.probabilities[np.arange(len(self.ids)), best]
+        return [self.labels[j] if p > 0 else None for j, p in zip(best, probabilities)], probabilities
+
+    def _select_rows(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+        return ClassificationMatrix([_id for _id, keep in zip(self.ids, mask) if keep], self.labels,
+                                    self.probabilities[mask],
+                                    [value for value, keep in zip(self._expected_values, mask) if keep],
+                                    self._expected_value_probabilities[mask])
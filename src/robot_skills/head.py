@@ -4,6 +4,7 @@ from actionlib import SimpleActionClient
 from geometry_msgs.msg import PointStamped
 from head_ref.msg import HeadReferenceAction, HeadReferenceGoal
 
+from .util import action_server_monitor
 from .util import msg_constructors as msgs
 
 
@@ -11,8 +12,11 @@ class Head():
     def __init__(self, robot_name):
         self._robot_name = robot_name
         self._ac_head_ref_action = SimpleActionClient("/"+robot_name+"/head_ref/action_server",  HeadReferenceAction)
+        self._server = action_server_monitor.get_monitor(robot_name).register("head_ref/action_server",
+                                                                              self._ac_head_ref_action)
         self._goal = None
         self._at_setpoint = False
+        self._last_target = None
 
     def close(self):
         self._ac_head_ref_action.cancel_all_goals()
@@ -99,6 +103,12 @@ class Head():
     def look_at_point(self, point_stamped, end_time=0, pan_vel=1.0, tilt_vel=1.0, timeout=0):
         self._setHeadReferenceGoal(0, pan_vel, tilt_vel, end_time, point_stamped, timeout=timeout)
 
+    def get_current_target(self):
+        """
+        Returns the PointStamped of the last look-at goal that was sent (also after it has finished), or None
+        """
+        return self._last_target
+
     def cancel_goal(self):
         self._ac_head_ref_action.cancel_goal()
         self._goal = None
@@ -119,6 +129,10 @@ class Head():
     # ---- INTERFACING THE NODE ---
 
     def _setHeadReferenceGoal(self, goal_type, pan_vel, tilt_vel, end_time, point_stamped=PointStamped(), pan=0, tilt=0, timeout=0):
+        if not self._server.wait(0.25):
+            rospy.logwarn("Head reference action server is not present: head goal not sent")
+            return False
+
         self.cancel_goal()
 
         self._goal = HeadReferenceGoal()
@@ -130,6 +144,7 @@ class Head():
         self._goal.pan = pan
         self._goal.tilt = tilt
         self._goal.end_time = end_time
+        self._last_target = point_stamped
         self._ac_head_ref_action.send_goal(self._goal, done_cb = self.__doneCallback, feedback_cb = self.__feedbackCallback)
 
         start = rospy.Time.now()
@@ -14,7 +14,7 @@ from ed_sensor_integration.srv import UpdateResponse
 
 import arms
 from robot_skills import robot
-from robot_skills.classification_result import ClassificationResult
+from robot_skills.classification_result import ClassificationResult, ClassificationMatrix
 import robot_skills.util.msg_constructors as msgs
 
 
@@ -32,11 +32,17 @@ class Arm(arms.Arm):
         self.configuration = mock.MagicMock()
         self.default_configurations = mock.MagicMock()
         self.send_joint_trajectory = mock.MagicMock()
+        self.queue_joint_trajectory = mock.MagicMock()
+        self.queue_joint_goal = mock.MagicMock()
         self.configuration = mock.MagicMock()
         self.self = mock.MagicMock()
         self.reset = mock.MagicMock()
         self.send_gripper_goal = mock.MagicMock()
+        self.cancel_gripper_goals = mock.MagicMock()
         self._send_joint_trajectory = mock.MagicMock()
+        self.joint_limits = mock.MagicMock()
+        self.reachability = mock.MagicMock()
+        self.grasp_reachability = mock.MagicMock(return_value=0.5)
         self._publish_marker = mock.MagicMock()
         self.occupied_by = None
         self._operational = True
@@ -44,7 +50,9 @@ class Arm(arms.Arm):
 
 class Base(object):
     def __init__(self, *args, **kwargs):
+        self.operational = True
         self.move = mock.MagicMock()
+        self.move_async = mock.MagicMock()
         self.force_drive = mock.MagicMock()
         self.get_location = mock.MagicMock()
         self.set_initial_pose = mock.MagicMock()
@@ -54,6 +62,10 @@ class Base(object):
         self.analyzer = mock.MagicMock()
         self.global_planner = mock.MagicMock()
         self.local_planner = mock.MagicMock()
+        self.plan_monitor = mock.MagicMock()
+        self.pose_provider = mock.MagicMock()
+        self.velocity_streamer = mock.MagicMock()
+        self.close = mock.MagicMock()
         self.local_planner.getStatus = mock.MagicMock(return_value="arrived") #always arrive for now
         self.global_planner.getPlan = mock.MagicMock(return_value=["dummy_plan"]) #always arrive for now
 
@@ -103,6 +115,8 @@ class Head(object):
         self.atGoal = mock.MagicMock()
         self.look_at_standing_person = mock.MagicMock()
         self.look_at_point = mock.MagicMock()
+        self.look_down = mock.MagicMock()
+        self.get_current_target = mock.MagicMock()
         self.look_at_ground_in_front_of_robot = mock.MagicMock() #TODO: Must return a EntityInfo
         self.setPanTiltGoal = mock.MagicMock()
         self.setLookAtGoal = mock.MagicMock()
@@ -136,6 +150,7 @@ class Speech(object):
 
 class Torso(object):
     def __init__(self, *args, **kwargs):
+        self.operational = True
         self.close = mock.MagicMock()
         self.send_goal = mock.MagicMock()
         self._send_goal = mock.MagicMock()
@@ -202,6 +217,13 @@ class ED(object):
         entities = [self._entities[_id] for _id in ids if _id in self._entities]
         return [ClassificationResult(e.id, e.type, random.uniform(0,1)) for e in entities]
 
+    def classify_matrix(self, ids, types=None, labels=None):
+        entities = [self._entities[_id] for _id in ids if _id in self._entities]
+        matrix = ClassificationMatrix.from_posteriors([e.id for e in entities],
+                                                      [([e.type], [random.uniform(0,1)]) for e in entities],
+                                                      labels=labels)
+        return matrix.filter_types(types) if types is not None else matrix
+
 class Mockbot(robot.Robot):
     """
     Interface to all parts of Mockbot. When initializing Mockbot, you can choose a list of components
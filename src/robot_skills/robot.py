@@ -24,6 +24,8 @@ import world_model_ed
 import geometry_msgs
 from collections import OrderedDict
 
+from util import motion_group
+
 
 class Robot(object):
     """
@@ -55,6 +57,7 @@ class Robot(object):
 
         # Reasoning/world modeling
         self.ed = world_model_ed.ED(self.robot_name, self.tf_listener, wait_service=wait_services)
+        self.ed.get_viewpoint = self.get_viewpoint
 
         # Miscellaneous
         self.pub_target = rospy.Publisher("/target_location", geometry_msgs.msg.Pose2D, queue_size=10)
@@ -64,17 +67,60 @@ class Robot(object):
         #TODO: Don't hardcode, load from parameter server to make robot independent.
         self.grasp_offset = geometry_msgs.msg.Point(0.5, 0.2, 0.0)
 
-    def standby(self):
+    def standby(self, timeout=10.0):
+        """
+        Moves the arms, grippers, head and torso to the standby pose at once. This blocks until all body parts are done,
+        including the arm resets, but at most timeout seconds: body parts that are not done by then are cancelled.
+        :param timeout: seconds to wait for all body parts together (the grippers wait at most 5 seconds)
+        :return: OrderedDict body part --> MotionResult
+        """
         if not self.robot_name == 'amigo':
             rospy.logerr('Standby only works for amigo')
             return
-        self.leftArm.reset()
-        self.rightArm.reset()
-        self.leftArm.send_gripper_goal('close')
-        self.rightArm.send_gripper_goal('close')
-        self.head.look_down()
-        self.torso.low()
+        group = self.motion_group(timeout)
+        group.add("left_arm", self.leftArm.reset, timeout, cancel=self.leftArm.cancel_goals)
+        group.add("right_arm", self.rightArm.reset, timeout, cancel=self.rightArm.cancel_goals)
+        group.add("left_gripper", self.leftArm.send_gripper_goal, 'close', cancel=self.leftArm.cancel_gripper_goals)
+        group.add("right_gripper", self.rightArm.send_gripper_goal, 'close', cancel=self.rightArm.cancel_gripper_goals)
+        group.add("head", self._look_down, timeout, cancel=self.head.cancel_goal)
+        group.add("torso", self.torso.low, timeout, cancel=self.torso.cancel_goal)
+        results = group.execute()
         self.lights.set_color(0, 0, 0)
+        return results
+
+    def _look_down(self, timeout):
+        """
+        Points the head down and waits until it is there, at most timeout seconds (see standby)
+        """
+        if self.head.look_down() is False:
+            return False
+        return self.head.wait_for_motion_done(timeout)
+
+    def motion_group(self, timeout=10.0):
+        """
+        Returns a MotionGroup to issue goals to several body parts at once and wait for all of them under one shared
+        deadline, e.g.:
+
+        >>> group = robot.motion_group(timeout=5.0)
+        >>> group.add("left_arm", robot.leftArm.send_joint_goal, 'carrying_pose', 5.0, cancel=robot.leftArm.cancel_goals)
+        >>> group.add("torso", robot.torso.send_goal, 'reset', 5.0, cancel=robot.torso.cancel_goal)
+        >>> results = group.execute()  # {"left_arm": MotionResult, "torso": MotionResult}
+
+        :param timeout: seconds until the shared deadline
+        """
+        return motion_group.MotionGroup(timeout)
+
+    def get_viewpoint(self):
+        """
+        Returns the current viewpoint of the robot's head camera as a tuple (base_pose, torso_position, head_target).
+        Parts that are not available are None
+        """
+        try:
+            torso_position = self.torso.get_position()
+        except AttributeError:  # No torso measurement received yet
+            torso_position = None
+
+        return self.base.get_location(max_age=0.5), torso_position, self.head.get_current_target()
 
     def publish_target(self, x, y):
         self.pub_target.publish(geometry_msgs.msg.Pose2D(x, y, 0))
@@ -114,6 +160,17 @@ class Robot(object):
         backup_side = backup_obj_dict[preferred_side]
         return preferred_side, backup_side
 
+    def get_arms_by_reachability(self, px, py, pz, roll=0, pitch=0, yaw=0, side=None, pre_grasp=False):
+        """
+        Returns the arms ordered by the estimated reachability of a target in base_link, most likely reachable first.
+        Arms with the same reachability keep the order of get_arm(side) (or of robot.arms if side is None).
+        """
+        if side is None:
+            candidates = list(self.arms.values())
+        else:
+            candidates = list(self.get_arm(side))
+        return sorted(candidates, key=lambda arm: -arm.grasp_reachability(px, py, pz, roll, pitch, yaw, pre_grasp))
+
     def get_left_gripper_pose_map(self):
         """ Gets the pose of the left gripper in map frame"""
         (x, y, z), (rx, ry, rz, rw) = self.tf_listener.lookupTransform("/map", "amigo/grippoint_left")
@@ -1,14 +1,18 @@
 #! /usr/bin/env python
 import threading
 
-import actionlib
 import control_msgs.msg
+import numpy as np
 import rospy
 import trajectory_msgs.msg
 from actionlib_msgs.msg import GoalStatus
 from sensor_msgs.msg import JointState
 
+from .util import action_server_monitor
 from .util import concurrent_util
+from .util import hardware_status
+from .util import time_parameterization
+from .util import trajectory_dispatcher
 
 
 class Torso(object):
@@ -20,17 +24,48 @@ class Torso(object):
         self.default_tolerance = rospy.get_param('/'+self.robot_name+'/skills/torso/default_tolerance')
         self.lower_limit = self.default_configurations['lower_limit']
         self.upper_limit = self.default_configurations['upper_limit']
+        # Optional velocity and acceleration limits: goals are timed like the arm goals, so the dispatcher can merge
+        # them with the goal of an arm. Without limits, the timing is left to the controller.
+        self.velocity_limits = rospy.get_param('/'+self.robot_name+'/skills/torso/velocity_limits', None)
+        self.acceleration_limits = rospy.get_param('/'+self.robot_name+'/skills/torso/acceleration_limits', None)
+        self.current_position = None
 
-        # Init action client
+        # Goals go through the dispatcher of the (shared) body joint trajectory action server
         #self.ac_move_torso = actionlib.SimpleActionClient('/'+self.robot_name+'/torso_server', control_msgs.msg.FollowJointTrajectoryAction)
-        self.ac_move_torso = actionlib.SimpleActionClient('/'+self.robot_name+'/body/joint_trajectory_action', control_msgs.msg.FollowJointTrajectoryAction)
+        self._dispatcher = trajectory_dispatcher.get_dispatcher(self.robot_name)
+        self._goal = None
+        self._server = action_server_monitor.get_monitor(self.robot_name).register("body/joint_trajectory_action",
+                                                                                  self._dispatcher)
+
+        # listen to the hardware status to determine if the torso is available
+        self._operational = True  # In simulation, there will be no hardware cb
+        self._hardware_status_name = rospy.get_param('/'+self.robot_name+'/skills/torso/hardware_status_name',
+                                                     'spindle')
+        self._hardware_status = hardware_status.get_dispatcher(self.robot_name)
+        self._hardware_status.register(self._hardware_status_name, operational_changed=self._operational_changed)
 
         # Init joint measurement subscriber
         self.torso_sub = rospy.Subscriber('/'+self.robot_name+'/sergio/torso/measurements', JointState, self._receive_torso_measurement)
 
     def close(self):
         rospy.loginfo("Torso cancelling all goals on close")
-        self.ac_move_torso.cancel_all_goals()
+        self._dispatcher.cancel_all_goals()
+
+    @property
+    def operational(self):
+        '''
+        The 'operational' property reflects the current hardware status of the torso.
+        '''
+        return self._operational
+
+    def _operational_changed(self, operational):
+        '''
+        hardware_status callback, called when the torso becomes (not) operational
+        '''
+        if not operational:
+            rospy.logwarn('Torso is not operational (hardware status level {0})'.format(
+                self._hardware_status.get_level(self._hardware_status_name)))
+        self._operational = operational
 
     def send_goal(self, configuration, timeout=0.0, tolerance = []):
         if configuration in self.default_configurations:
@@ -56,6 +91,10 @@ class Torso(object):
         torso_goal_point = trajectory_msgs.msg.JointTrajectoryPoint()
         torso_goal.trajectory.joint_names = self.joint_names
         torso_goal_point.positions = torso_pos
+        timing = self._time_parameterize(torso_pos)
+        if timing:
+            torso_goal_point.velocities = timing[2][-1].tolist()
+            torso_goal_point.time_from_start = rospy.Duration(float(timing[1][-1]))
         torso_goal.trajectory.points.append(torso_goal_point)
 
         for i in range(0,len(self.joint_names)):
@@ -69,45 +108,64 @@ class Torso(object):
 
         rospy.logdebug("Sending torso_goal: {0}".format(torso_goal))
 
-        import time; time.sleep(0.001)  # This is necessary: the rtt_actionlib in the hardware seems
-                                        # to only have a queue size of 1 and runs at 1000 hz. This
-                                        # means that if two goals are send approximately at the same
-                                        # time (e.g. an arm goal and a torso goal), one of the two
-                                        # goals probably won't make it. This sleep makes sure the
-                                        # goals will always arrive in different update hooks in the
-                                        # hardware TrajectoryActionLib server.
+        if not self._server.wait(0.25):
+            rospy.logwarn("Joint trajectory action is not present: torso goal not sent")
+            return False
 
-        self.ac_move_torso.send_goal(torso_goal)
+        # The dispatcher spaces (and merges) the goals of the arms and the torso for the hardware action server
+        self._goal = self._dispatcher.send_goal(torso_goal, timing)
 
         if timeout == 0.0:
             return True
         else:
-            return self.wait(timeout)
-
-    def high(self):
-        return self._send_goal(self.upper_limit)
-
-    def medium(self):
+            return self.wait_for_motion_done(timeout)
+
+    def _time_parameterize(self, torso_pos):
+        '''
+        Computes the time from start of a goal from the measured position to torso_pos within the limits of the joints
+        :return: tuple (positions, times, velocities) including the start state, None if the limits or the start state
+            are unknown
+        '''
+        joints = len(self.joint_names)
+        if not self.velocity_limits or not self.acceleration_limits or \
+                not len(self.velocity_limits) == len(self.acceleration_limits) == joints:
+            return None
+        current_position = self.current_position
+        if current_position is None or len(current_position.position) != joints:
+            return None
+        positions = np.array([current_position.position, torso_pos], dtype=float)
+        times, velocities = time_parameterization.time_parameterize(positions, self.velocity_limits,
+                                                                    self.acceleration_limits)
+        return positions, times, velocities
+
+    def high(self, timeout=0.0):
+        return self._send_goal(self.upper_limit, timeout=timeout)
+
+    def medium(self, timeout=0.0):
         goal = []
         # ToDo: make nice
         for i in range(0, len(self.joint_names)):
             goal.append(self.lower_limit[i]+(self.upper_limit[i]-self.lower_limit[i])/2)
-        return self._send_goal(goal)
+        return self._send_goal(goal, timeout=timeout)
 
-    def low(self):
-        return self._send_goal(self.lower_limit)
+    def low(self, timeout=0.0):
+        return self._send_goal(self.lower_limit, timeout=timeout)
 
     def reset(self):
         return self.send_goal('reset')
 
     def cancel_goal(self):
-        self.ac_move_torso.cancel_goal()
+        """ Cancels the torso goal. If it has been merged with an arm goal, the arm motion is cancelled as well. """
+        if self._goal:
+            if self._goal.merged and not self._goal.done():
+                rospy.logwarn("Torso goal was merged with the goal of an arm: cancelling both")
+            self._goal.cancel()
         #return True
 
     def wait_for_motion_done(self, timeout=10):
-        if self.ac_move_torso.gh:
-            self.ac_move_torso.wait_for_result(rospy.Duration(timeout))
-            if self.ac_move_torso.get_state() == GoalStatus.SUCCEEDED:
+        if self._goal:
+            self._goal.wait_for_result(rospy.Duration(timeout))
+            if self._goal.get_state() == GoalStatus.SUCCEEDED:
                 rospy.logdebug("Torso target reached")
                 return True
             else:
@@ -117,7 +175,7 @@ class Torso(object):
     def wait(self, timeout=10):
         import warnings
         warnings.warn("Please use wait_for_motion_done instead", Warning)
-        self.wait_for_motion_done(timeout)
+        return self.wait_for_motion_done(timeout)
 
     _lock = threading.RLock()
 
@@ -0,0 +1,137 @@
+#! /usr/bin/env python
+"""
+Background monitor of the availability of action servers, so calls can check (or wait for) the readiness of their
+server without blocking on wait_for_server themselves.
+"""
+
+import threading
+from collections import OrderedDict
+
+import rospy
+
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+
+def get_monitor(robot_name):
+    """
+    Returns the (single) ActionServerMonitor of a robot
+    """
+    with _monitors_lock:
+        if robot_name not in _monitors:
+            _monitors[robot_name] = ActionServerMonitor()
+        return _monitors[robot_name]
+
+
+class ServerStatus(object):
+    """
+    Availability of one action server, as determined by the monitor
+    """
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self._ready = threading.Event()
+        self._checked = threading.Event()  # Set after the first check of the monitor
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Returns whether the server is ready. Only waits (at most timeout seconds) as long as the monitor has not checked
+        the server yet: a server that is known to be absent fails immediately. Until the first check of the monitor,
+        which probes the servers one after another, the server is waited for directly. Without a timeout, this waits for
+        the first check of the monitor, which takes at most probe_timeout per registered server.
+        """
+        if timeout is None:
+            # wait_for_server with a zero timeout would wait forever for an absent server
+            while not self._checked.wait(0.1) and not rospy.is_shutdown():
+                pass
+        elif not self._checked.is_set() and timeout > 0:
+            try:
+                ready = self.client.wait_for_server(rospy.Duration(timeout))
+            except Exception as e:
+                rospy.logdebug("Waiting for action server {0} failed: {1}".format(self.name, e))
+                ready = False
+            if ready and self._update(True):
+                rospy.loginfo("Action server {0} is available".format(self.name))
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout=None):
+        """ Waits until the server becomes ready, returns False if it is not ready within timeout seconds """
+        return self._ready.wait(timeout)
+
+    def _update(self, ready):
+        """ :return: True if the readiness changed """
+        changed = ready != self._ready.is_set() or not self._checked.is_set()
+        if ready:
+            self._ready.set()
+        else:
+            self._ready.clear()
+        self._checked.set()
+        return changed
+
+
+class ActionServerMonitor(object):
+    """
+    Checks all registered action clients in a background thread: often while a server is absent, less often to detect
+    that a server disappears.
+    """
+    def __init__(self, absent_interval=0.2, ready_interval=2.0, probe_timeout=0.05):
+        """
+        :param absent_interval: seconds between the checks if a server is absent
+        :param ready_interval: seconds between the checks if all servers are ready
+        :param probe_timeout: timeout of wait_for_server per check
+        """
+        self.absent_interval = absent_interval
+        self.ready_interval = ready_interval
+        self.probe_timeout = probe_timeout
+
+        self._statuses = OrderedDict()  # name --> ServerStatus
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def register(self, name, client):
+        """
+        Adds an action client to the monitor. A client that is registered again under the same name is monitored once.
+        :param name: name of the action server
+        :param client: object with a wait_for_server(timeout) method (e.g. a SimpleActionClient)
+        :return: ServerStatus
+        """
+        with self._lock:
+            status = self._statuses.get(name)
+            if status is None:
+                status = ServerStatus(name, client)
+                self._statuses[name] = status
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="action_server_monitor")
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup.set()
+        return status
+
+    def get_status(self, name):
+        return self._statuses.get(name)
+
+    def _run(self):
+        while not rospy.is_shutdown():
+            self._wakeup.clear()
+            with self._lock:
+                statuses = list(self._statuses.values())
+
+            for status in statuses:
+                try:
+                    ready = status.client.wait_for_server(rospy.Duration(self.probe_timeout))
+                except Exception as e:
+                    rospy.logdebug("Checking action server {0} failed: {1}".format(status.name, e))
+                    ready = False
+                if status._update(ready):
+                    if ready:
+                        rospy.loginfo("Action server {0} is available".format(status.name))
+                    else:
+                        rospy.logwarn("Action server {0} is not available".format(status.name))
+
+            all_ready = all(status.ready for status in statuses)
+            self._wakeup.wait(self.ready_interval if all_ready else self.absent_interval)
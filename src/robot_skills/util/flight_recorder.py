@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+"""
+In-process flight recorder: keeps the serialized messages of a set of topics of the last seconds in memory and writes
+them to a bag file only when asked to (e.g. when a navigation goal fails).
+
+Messages are subscribed with rospy.AnyMsg, so they are never deserialized, and written to the bag raw.
+"""
+
+import threading
+from collections import deque
+
+import rosbag
+import rospy
+
+
+class FlightRecorder(object):
+    """
+    Ring buffer of the messages of the last duration seconds on topics, bounded by max_bytes of serialized data
+    """
+    def __init__(self, topics, duration=30.0, max_bytes=256 * 1024 * 1024):
+        """
+        :param topics: list with topic names
+        :param duration: seconds of history that is kept
+        :param max_bytes: maximum size of the kept messages. If exceeded, the oldest messages are dropped, so the
+            history can be shorter than duration when high bandwidth topics are recorded
+        """
+        self.topics = list(topics)
+        self.duration = duration
+        self.max_bytes = max_bytes
+
+        self._messages = deque()  # (stamp, topic, AnyMsg)
+        self._bytes = 0
+        self._types = {}  # (datatype, md5sum) --> class with the attributes rosbag needs for raw writes
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def start(self):
+        if self._subscribers:
+            return
+        for topic in self.topics:
+            self._subscribers.append(rospy.Subscriber(topic, rospy.AnyMsg, self._callback, callback_args=topic,
+                                                      queue_size=100))
+        rospy.loginfo("Flight recorder: recording {0} topics, last {1} seconds".format(len(self.topics), self.duration))
+
+    def stop(self):
+        for subscriber in self._subscribers:
+            subscriber.unregister()
+        self._subscribers = []
+
+    @property
+    def active(self):
+        return bool(self._subscribers)
+
+    def clear(self):
+        with self._lock:
+            self._messages.clear()
+            self._bytes = 0
+
+    def get_statistics(self):
+        """ Returns a dict with the number of buffered messages, their size in bytes and the time span they cover """
+        with self._lock:
+            span = self._messages[-1][0].to_sec() - self._messages[0][0].to_sec() if self._messages else 0.0
+            return {"messages": len(self._messages), "bytes": self._bytes, "seconds": span}
+
+    def dump(self, filename, duration=None, wait=False):
+        """
+        Writes the buffered messages to a bag file. The buffer is copied, the (slow) writing is done in a separate
+        thread unless wait is True.
+        :param filename: filename of the bag
+        :param duration: if not None, only write the messages of the last duration seconds
+        :param wait: if True, return after the bag has been written
+        :return: number of messages that are written
+        """
+        with self._lock:
+            messages = list(self._messages)
+        if duration is not None and messages:
+            oldest = messages[-1][0].to_sec() - duration
+            messages = [m for m in messages if m[0].to_sec() >= oldest]
+
+        thread = threading.Thread(target=self._write, args=(filename, messages))
+        thread.start()
+        if wait:
+            thread.join()
+        return len(messages)
+
+    def _write(self, filename, messages):
+        try:
+            bag = rosbag.Bag(filename, 'w')
+            try:
+                for stamp, topic, msg in messages:
+                    header = msg._connection_header
+                    pytype = self._pytype(header)
+                    bag.write(topic, (header['type'], msg._buff, header['md5sum'], pytype), stamp, raw=True)
+            finally:
+                bag.close()
+        except Exception as e:
+            rospy.logerr("Flight recorder: could not write {0}: {1}".format(filename, e))
+            return
+        rospy.loginfo("Flight recorder: wrote {0} messages to {1}".format(len(messages), filename))
+
+    def _pytype(self, header):
+        key = (header['type'], header['md5sum'])
+        pytype = self._types.get(key)
+        if pytype is None:
+            pytype = type("RawMessage", (object,), {"_type": header['type'],
+                                                    "_md5sum": header['md5sum'],
+                                                    "_full_text": header.get('message_definition', "")})
+            self._types[key] = pytype
+        return pytype
+
+    def _callback(self, msg, topic):
+        now = rospy.Time.now()
+        size = len(msg._buff)
+        with self._lock:
+            self._messages.append((now, topic, msg))
+            self._bytes += size
+
+            oldest = now.to_sec() - self.duration
+            while self._messages and (self._messages[0][0].to_sec() < oldest or self._bytes > self.max_bytes):
+                self._bytes -= len(self._messages.popleft()[2]._buff)
@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+"""
+Robot-wide dispatcher of the hardware diagnostics on /<robot_name>/hardware_status.
+
+The DiagnosticArray is indexed by component name once per message, and level changes of the registered components
+(arms, torso, base) are pushed to their callbacks. Warnings about missing or duplicate statuses are rate limited.
+"""
+
+import threading
+import time
+
+import rospy
+from diagnostic_msgs.msg import DiagnosticArray
+
+# Levels of the hardware status
+STALE = 0
+IDLE = 1
+OPERATIONAL = 2
+HOMING = 3
+ERROR = 4
+
+_dispatchers = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_dispatcher(robot_name):
+    """
+    Returns the (single) HardwareStatusDispatcher of a robot
+    """
+    with _dispatchers_lock:
+        if robot_name not in _dispatchers:
+            _dispatchers[robot_name] = HardwareStatusDispatcher(robot_name)
+        return _dispatchers[robot_name]
+
+
+class HardwareStatusDispatcher(object):
+    """
+    Pushes the hardware status levels of components to callbacks
+    """
+    def __init__(self, robot_name, warning_interval=30.0):
+        """
+        :param robot_name: name of the robot
+        :param warning_interval: minimum time (in seconds) between two warnings about the same component
+        """
+        self.warning_interval = warning_interval
+
+        self._levels = {}  # component name --> last level
+        self._level_callbacks = {}  # component name --> list of callbacks(level)
+        self._operational_callbacks = {}  # component name --> list of callbacks(operational)
+        self._last_warnings = {}  # (component name, warning) --> time of the last warning
+        self._lock = threading.Lock()
+
+        self._subscriber = rospy.Subscriber("/" + robot_name + "/hardware_status", DiagnosticArray, self._callback,
+                                            queue_size=1)
+
+    def register(self, name, level_changed=None, operational_changed=None):
+        """
+        Registers a component
+        :param name: name of the component in the diagnostics (e.g. 'left_arm')
+        :param level_changed: called with the new level if the level of the component changes
+        :param operational_changed: called with True or False if the component becomes (not) operational
+        """
+        with self._lock:
+            if level_changed:
+                self._level_callbacks.setdefault(name, []).append(level_changed)
+            if operational_changed:
+                self._operational_callbacks.setdefault(name, []).append(operational_changed)
+
+    def unregister(self, name):
+        with self._lock:
+            self._level_callbacks.pop(name, None)
+            self._operational_callbacks.pop(name, None)
+
+    def get_level(self, name):
+        """ Returns the last level of a component, None if it has not been received """
+        with self._lock:
+            return self._levels.get(name)
+
+    def is_operational(self, name):
+        """ Returns whether the last level of a component is OPERATIONAL, None if it has not been received """
+        level = self.get_level(name)
+        return None if level is None else level == OPERATIONAL
+
+    def _callback(self, msg):
+        statuses = {}
+        duplicates = set()
+        for status in msg.status:
+            if status.name in statuses:
+                duplicates.add(status.name)
+            statuses[status.name] = status
+
+        with self._lock:
+            names = set(self._level_callbacks) | set(self._operational_callbacks)
+            level_callbacks = {name: list(self._level_callbacks.get(name, [])) for name in names}
+            operational_callbacks = {name: list(self._operational_callbacks.get(name, [])) for name in names}
+
+        for name in names:
+            status = statuses.get(name)
+            if status is None:
+                self._warn(name, "no diagnostic msg received for {0}".format(name))
+                continue
+            if name in duplicates:
+                self._warn(name, "multiple diagnostic msgs received for {0}".format(name))
+                continue
+
+            with self._lock:
+                previous = self._levels.get(name)
+                self._levels[name] = status.level
+            if status.level == previous:
+                continue
+
+            for callback in level_callbacks[name]:
+                callback(status.level)
+            operational = status.level == OPERATIONAL
+            if previous is None or operational != (previous == OPERATIONAL):
+                for callback in operational_callbacks[name]:
+                    callback(operational)
+
+    def _warn(self, name, message):
+        now = time.time()
+        key = (name, message)
+        if now - self._last_warnings.get(key, 0.0) >= self.warning_interval:
+            self._last_warnings[key] = now
+            rospy.logwarn(message)
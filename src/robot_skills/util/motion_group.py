@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+"""
+Concurrent execution of the (blocking) motion commands of several body parts under one shared deadline, so a whole-body
+motion takes the time of the slowest part instead of the sum of all parts.
+"""
+
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+import rospy
+
+
+class MotionResult(namedtuple("MotionResult", ["status", "value", "duration"])):
+    """
+    Result of a component of a motion group
+    :param status: MotionResult.DONE, MotionResult.TIMEOUT or MotionResult.ERROR
+    :param value: return value of the command (DONE) or the exception it raised (ERROR)
+    :param duration: seconds the command took, up to the deadline
+    """
+    DONE = "done"
+    TIMEOUT = "timeout"
+    ERROR = "error"
+
+    @property
+    def succeeded(self):
+        """ True if the command finished in time and did not return False """
+        return self.status == MotionResult.DONE and self.value is not False
+
+
+class MotionGroup(object):
+    """
+    Runs the commands of several components at once, each in its own thread, and waits for all of them until a shared
+    deadline. Commands that are still running at the deadline are cancelled with their cancel function (if any).
+
+    >>> group = MotionGroup(timeout=1.0)
+    >>> group.add("left", lambda: True)
+    >>> group.add("right", lambda timeout: time.sleep(timeout), 5.0)
+    >>> results = group.execute()
+    >>> [(name, result.status) for name, result in results.items()]
+    [('left', 'done'), ('right', 'timeout')]
+    """
+    def __init__(self, timeout=10.0):
+        """
+        :param timeout: seconds from the start of execute until the deadline
+        """
+        self.timeout = timeout
+        self._components = OrderedDict()  # name --> (function, args, kwargs, cancel)
+
+    def add(self, name, function, *args, **kwargs):
+        """
+        Adds a component command, which is called as function(*args, **kwargs) by execute
+        :param name: name of the component, key of the result
+        :param cancel: (keyword only) function without arguments that cancels the command
+        """
+        cancel = kwargs.pop("cancel", None)
+        self._components[name] = (function, args, kwargs, cancel)
+
+    def execute(self):
+        """
+        Starts all commands and waits for them until the deadline
+        :return: OrderedDict name --> MotionResult, in the order the components were added
+        """
+        start = time.time()
+        deadline = start + self.timeout
+        results = {}
+
+        def run(name, function, args, kwargs):
+            try:
+                value = function(*args, **kwargs)
+                results[name] = MotionResult(MotionResult.DONE, value, time.time() - start)
+            except Exception as e:
+                rospy.logerr("Motion group: {0} failed: {1}".format(name, e))
+                results[name] = MotionResult(MotionResult.ERROR, e, time.time() - start)
+
+        threads = []
+        for name, (function, args, kwargs, _) in self._components.items():
+            thread = threading.Thread(target=run, args=(name, function, args, kwargs), name="motion_group_" + name)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.time()))
+
+        ordered = OrderedDict()
+        for name, (_, _, _, cancel) in self._components.items():
+            result = results.get(name)
+            if result is None:
+                rospy.logwarn("Motion group: {0} did not finish within {1} seconds".format(name, self.timeout))
+                if cancel is not None:
+                    cancel()
+                result = MotionResult(MotionResult.TIMEOUT, None, self.timeout)
+            ordered[name] = result
+        return ordered
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
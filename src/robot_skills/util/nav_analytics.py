@@ -0,0 +1,297 @@
+#! /usr/bin/env python
+"""
+Offline analytics over the navigation logs written by NavAnalyzer: the NDJSON logs (navigation.ndjson) and the legacy
+XML fragments (Summary.xml) in the per-day directories.
+
+All logs are streamed record by record and every group keeps constant size statistics, so memory use does not depend
+on the amount of logs. Usage:
+
+    python -m robot_skills.util.nav_analytics [--group-by day|region] [--output report.json] [log directory]
+"""
+
+import argparse
+import json
+import os
+import warnings
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+import nav_metrics
+
+DEFAULT_LOG_DIRECTORY = os.path.join(os.environ.get("HOME", ""), "ros/data/private/recorded/rosbags/nav_data")
+
+FIELDS = ["duration", "distance", "speed", "nr_plans", "nr_clears", "nr_resets"]
+
+
+class StreamingStats(object):
+    """
+    Count, mean, standard deviation, minimum and maximum (exact) and quantiles (estimated from a fixed size reservoir
+    sample) of a stream of values. Values are buffered and merged into the statistics in chunks with NumPy.
+
+    >>> s = StreamingStats()
+    >>> for value in [1.0, 2.0, 3.0, 4.0]:
+    ...     s.add(value)
+    >>> s.count, s.mean, s.min, s.max, s.quantile(0.5)
+    (4, 2.5, 1.0, 4.0, 2.5)
+    """
+    def __init__(self, reservoir_size=1000, chunk_size=4096, seed=0):
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._min = np.inf
+        self._max = -np.inf
+        self._reservoir = np.empty(reservoir_size)
+        self._chunk_size = chunk_size
+        self._pending = []
+        self._rng = np.random.RandomState(seed)
+
+    def add(self, value):
+        self._pending.append(value)
+        if len(self._pending) >= self._chunk_size:
+            self._merge()
+
+    @property
+    def count(self):
+        self._merge()
+        return self._count
+
+    @property
+    def mean(self):
+        self._merge()
+        return self._mean
+
+    @property
+    def std(self):
+        self._merge()
+        return float(np.sqrt(self._m2 / (self._count - 1))) if self._count > 1 else 0.0
+
+    @property
+    def min(self):
+        self._merge()
+        return float(self._min) if self._count else None
+
+    @property
+    def max(self):
+        self._merge()
+        return float(self._max) if self._count else None
+
+    def quantile(self, q):
+        """ Returns the (linearly interpolated) q-quantile, 0 <= q <= 1 """
+        self._merge()
+        if not self._count:
+            return None
+        return float(np.percentile(self._reservoir[:min(self._count, len(self._reservoir))], 100.0 * q))
+
+    def summary(self, digits=3):
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count,
+                "mean": round(self.mean, digits),
+                "std": round(self.std, digits),
+                "min": round(self.min, digits),
+                "p50": round(self.quantile(0.5), digits),
+                "p90": round(self.quantile(0.9), digits),
+                "max": round(self.max, digits)}
+
+    def _merge(self):
+        if not self._pending:
+            return
+        values = np.array(self._pending, dtype=float)
+        self._pending = []
+
+        # Combine mean and sum of squared deviations of the chunk with the current ones (Chan et al.)
+        n, m = self._count, len(values)
+        chunk_mean = values.mean()
+        delta = chunk_mean - self._mean
+        self._mean += delta * m / (n + m)
+        self._m2 += np.sum((values - chunk_mean) ** 2) + delta * delta * n * m / (n + m)
+        self._min = min(self._min, values.min())
+        self._max = max(self._max, values.max())
+
+        # Reservoir sampling: fill the reservoir, then the i-th value replaces a random element with probability k / i
+        k = len(self._reservoir)
+        fill = max(0, min(k - n, m))
+        self._reservoir[n:n + fill] = values[:fill]
+        if fill < m:
+            positions = np.arange(n + fill + 1, n + m + 1)
+            accepted = self._rng.random_sample(len(positions)) * positions < k
+            slots = self._rng.randint(0, k, size=len(positions))
+            self._reservoir[slots[accepted]] = values[fill:][accepted]
+        self._count = n + m
+
+
+class GroupStats(object):
+    """ Statistics of the navigation goals of a group (e.g. a day or a map region) """
+    def __init__(self):
+        self.goals = 0
+        self.successes = 0
+        self.results = {}
+        self.fields = {field: StreamingStats() for field in FIELDS}
+
+    def add(self, record, success_results):
+        self.goals += 1
+        result = record.get("result")
+        self.results[result] = self.results.get(result, 0) + 1
+        if result in success_results:
+            self.successes += 1
+        for field in FIELDS:
+            value = record.get(field)
+            if isinstance(value, (int, long, float)):
+                self.fields[field].add(float(value))
+
+    def summary(self):
+        return {"goals": self.goals,
+                "success_rate": round(float(self.successes) / self.goals, 3) if self.goals else None,
+                "results": self.results,
+                "fields": {field: stats.summary() for field, stats in self.fields.items()}}
+
+
+class _WrappedFile(object):
+    """
+    File-like object that surrounds the contents of a file with a root element, because Summary.xml is a sequence of
+    <item> fragments instead of a single XML document
+    """
+    def __init__(self, f):
+        self._parts = ["<log>", None, "</log>"]
+        self._file = f
+
+    def read(self, size=-1):
+        while self._parts:
+            if self._parts[0] is None:
+                data = self._file.read(size)
+                if data:
+                    return data
+                self._parts.pop(0)
+            else:
+                return self._parts.pop(0)
+        return ""
+
+
+def _legacy_pose(item, tag, prefix, record):
+    pose = item.find(tag)
+    if pose is not None:
+        for key in ["x", "y", "phi"]:
+            if key in pose.attrib:
+                record[prefix + key] = float(pose.attrib[key])
+
+
+def read_legacy_records(filename):
+    """
+    Yields the goals in a legacy Summary.xml as records in the format of the NDJSON logs, parsing incrementally. If
+    the file is incomplete, a warning is issued and the goals up to the error are yielded.
+    """
+    with open(filename) as f:
+        context = ET.iterparse(_WrappedFile(f), events=("start", "end"))
+        _, root = next(context)
+        try:
+            for event, element in context:
+                if event != "end" or element.tag != "item":
+                    continue
+                record = {"stamp": element.get("stamp"), "result": element.get("result")}
+                for key in ["duration", "distance"]:
+                    try:
+                        record[key] = float(element.get(key))
+                    except (TypeError, ValueError):
+                        pass
+                for key, tag in [("nr_plans", "plans"), ("nr_clears", "clears"), ("nr_resets", "resets")]:
+                    child = element.find(tag)
+                    record[key] = len(child) if child is not None else 0
+                _legacy_pose(element, "startpose", "start_", record)
+                _legacy_pose(element, "endpose", "end_", record)
+                root.clear()  # Only keep the current item in memory
+                yield record
+        except ET.ParseError as e:
+            # E.g. a fragment that was not written completely
+            warnings.warn("Stopped parsing {0}: {1}".format(filename, e))
+
+
+def find_logs(directory):
+    """ Returns the NDJSON logs and the legacy XML logs in directory and its subdirectories """
+    ndjson, legacy = [], []
+    for dirpath, _, filenames in sorted(os.walk(directory)):
+        for filename in sorted(filenames):
+            if filename.endswith(".ndjson"):
+                ndjson.append(os.path.join(dirpath, filename))
+            elif filename == "Summary.xml":
+                legacy.append(os.path.join(dirpath, filename))
+    return ndjson, legacy
+
+
+def read_all_records(directory):
+    """ Yields the records of all logs in directory """
+    ndjson, legacy = find_logs(directory)
+    for record in nav_metrics.read_records(ndjson):
+        yield record
+    for filename in legacy:
+        for record in read_legacy_records(filename):
+            yield record
+
+
+def group_key(record, group_by, cell_size):
+    """
+    Returns the group of a record: the day (YYYYMMDD, from the stamp) or the map region (cell_size x cell_size cell of
+    the goal, i.e. the end pose)
+    """
+    if group_by == "day":
+        return (record.get("stamp") or "unknown")[:8]
+    if "end_x" not in record or "end_y" not in record:
+        return "unknown"
+    return "{0},{1}".format(int(record["end_x"] // cell_size), int(record["end_y"] // cell_size))
+
+
+def analyze(records, group_by="day", cell_size=5.0, success_results=("succeeded", "arrived")):
+    """
+    Computes the statistics per group and over all records
+    :return: report (dict)
+    """
+    groups = {}
+    total = GroupStats()
+    for record in records:
+        if "distance" in record and "duration" in record and "speed" not in record and record["duration"] > 0:
+            record["speed"] = record["distance"] / record["duration"]
+        key = group_key(record, group_by, cell_size)
+        if key not in groups:
+            groups[key] = GroupStats()
+        groups[key].add(record, success_results)
+        total.add(record, success_results)
+
+    return {"group_by": group_by,
+            "cell_size": cell_size if group_by == "region" else None,
+            "total": total.summary(),
+            "groups": {key: stats.summary() for key, stats in sorted(groups.items())}}
+
+
+def format_report(report):
+    """ Returns a compact text table with per group the number of goals, the success rate and median values """
+    columns = ["goals", "success"] + ["{0} p50".format(field) for field in FIELDS]
+    lines = ["{0:>12} ".format(report["group_by"]) + " ".join("{0:>14}".format(c) for c in columns)]
+    rows = sorted(report["groups"].items()) + [("total", report["total"])]
+    for key, summary in rows:
+        values = [summary["goals"], summary["success_rate"]]
+        values += [summary["fields"][field].get("p50") for field in FIELDS]
+        lines.append("{0:>12} ".format(key) + " ".join("{0:>14}".format("-" if v is None else v) for v in values))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Statistics of the navigation goals recorded by NavAnalyzer")
+    parser.add_argument("directory", nargs="?", default=DEFAULT_LOG_DIRECTORY,
+                        help="directory with the (per day) navigation logs")
+    parser.add_argument("--group-by", choices=["day", "region"], default="day")
+    parser.add_argument("--cell-size", type=float, default=5.0, help="size (m) of the map regions")
+    parser.add_argument("--success", default="succeeded,arrived", help="comma separated results that count as success")
+    parser.add_argument("--output", help="write the full report as JSON to this file")
+    args = parser.parse_args()
+
+    report = analyze(read_all_records(args.directory), group_by=args.group_by, cell_size=args.cell_size,
+                     success_results=args.success.split(","))
+
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,30 +5,95 @@ import rospy
 # Date and time stamping
 import datetime
 
-# XML
-import xml.etree.ElementTree as ET
-
-# Rosbagging with systemcalls
 import os
-import signal
-import subprocess
 
 import math
 
+import threading
+
+import numpy as np
+
 # Messages
 import nav_msgs.msg
-import geometry_msgs.msg
 
 # Robot skills
+import flight_recorder
+import nav_metrics
 import transformations
 
 
+class TrajectoryBuffer(object):
+    """
+    Preallocated ring buffer with downsampled (stamp, x, y, linear speed, angular speed) samples of a trajectory. If
+    the buffer is full, the oldest samples are overwritten.
+
+    >>> b = TrajectoryBuffer(capacity=3, min_interval=0.5)
+    >>> for t in [0.0, 0.2, 0.5, 1.0, 1.5]:
+    ...     b.add(t, t, 0.0, 1.0, 0.0)
+    >>> b.get()[:, 0].tolist()
+    [0.5, 1.0, 1.5]
+    """
+    def __init__(self, capacity=3000, min_interval=0.1):
+        """
+        :param capacity: maximum number of samples
+        :param min_interval: minimum time (in seconds) between samples, more frequent samples are dropped
+        """
+        self.min_interval = min_interval
+        self._data = np.empty((capacity, 5))
+        self._index = 0
+        self._count = 0
+        self._last_stamp = None
+
+    def clear(self):
+        self._index = 0
+        self._count = 0
+        self._last_stamp = None
+
+    def add(self, stamp, x, y, v, w):
+        if self._last_stamp is not None and stamp - self._last_stamp < self.min_interval:
+            return
+        self._last_stamp = stamp
+        self._data[self._index] = (stamp, x, y, v, w)
+        self._index = (self._index + 1) % len(self._data)
+        self._count = min(self._count + 1, len(self._data))
+
+    def get(self):
+        """ Returns a (N, 5) array with the samples (stamp, x, y, v, w), oldest first """
+        if self._count < len(self._data):
+            return self._data[:self._count].copy()
+        return np.roll(self._data, -self._index, axis=0)
+
+
+def count_stops(stamps, speeds, stop_speed=0.05, min_duration=0.5):
+    """
+    Counts the times the robot stood still (speed below stop_speed for at least min_duration) in between driving
+
+    >>> count_stops([0, 1, 2, 3, 4, 5, 6], [0.0, 0.5, 0.0, 0.0, 0.5, 0.01, 0.0])
+    1
+    """
+    stopped = np.asarray(speeds) < stop_speed
+    if len(stopped) < 3:
+        return 0
+    # Indices where stopped periods start and end
+    edges = np.flatnonzero(np.diff(stopped.astype(int)))
+    starts = edges[stopped[edges + 1]] + 1
+    ends = edges[~stopped[edges + 1]] + 1
+    # Only stops that are followed by driving again
+    stamps = np.asarray(stamps, dtype=float)
+    stops = 0
+    for start in starts:
+        following = ends[ends > start]
+        if len(following) and stamps[following[0]] - stamps[start] >= min_duration:
+            stops += 1
+    return stops
+
+
 class NavAnalyzer:
 
     def __init__(self, robot_name):
 
         self._robot_name = robot_name
-        self.rosbag = False
+        self.rosbag = rospy.get_param("/"+self._robot_name+"/skills/nav_analyzer/record", False)
         rospy.loginfo("Nav_analyser: Bagging = {0}".format(self.rosbag))
 
         ''' Path '''
@@ -46,143 +111,122 @@ class NavAnalyzer:
         if not os.path.isdir(self.path):
             os.makedirs(self.path)
 
-        self.filename = self.path+'/Summary.xml'
+        ''' Metrics log: one record per goal '''
+        self.filename = self.path+'/navigation.ndjson'
+        self.metrics = nav_metrics.NavMetricsWriter(self.filename)
+        rospy.on_shutdown(self.metrics.close)
+
+        ''' Odometry subscriber, only subscribed during a measurement '''
+        self.odom_sub = None
 
-        ''' Odometry subscriber '''
-        self.odom_sub = rospy.Subscriber("/"+self._robot_name+"/base/measurements", nav_msgs.msg.Odometry, self.odomCallback)
+        ''' Downsampled trajectory of the current measurement '''
+        self.trajectory = TrajectoryBuffer()
 
         ''' Indicates whether measuring or not '''
         self.active = False
 
-        ''' Bag topics '''
+        ''' Flight recorder: keeps the last seconds of these topics in memory and writes them to a bag when a goal fails '''
+        self.recorder = None
+        self.success_results = ["succeeded", "arrived"]
         if self.rosbag:
-            topics = ["/tf",
-                      "/"+self._robot_name+"/base/references",
-                      "/"+self._robot_name+"/base/measurements",
-                      "/"+self._robot_name+"/initialpose",
-                      "/"+self._robot_name+"/joint_states",
-                      "/amcl_pose",
-                      "/"+self._robot_name+"/base_laser/scan",
-                      "/"+self._robot_name+"/base_laser/scan_raw",
-                      "/"+self._robot_name+"/torso_laser/scan",
-                      "/"+self._robot_name+"/torso_laser/scan_raw",
-                      "/"+self._robot_name+"/top_kinect/rgbd",
-                      "/ed/gui/entities",
-                      "/ed/profile/ed",
-                      "/cb_base_navigation/local_planner_interface/visualization/markers/goal_pose_marker",
-                      "/cb_base_navigation/global_planner_interface/visualization/markers/global_plan",
-                      "/cb_base_navigation/local_planner_interface/DWAPlannerROS/local_traj",
-                      "/cb_base_navigation/local_planner_interface/dwa_planner/cost_cloud",
-                      "/cb_base_navigation/local_planner_interface/action_server/goal"]
-
-            #plantopic = "/move_base"
-            #if os.environ["AMIGO_NAV"] == "3d":
-            #    plantopic += "_3d"
-            #plantopic += "/AStarPlannerROS/plan"
-            #topics.append(plantopic)
-
-            self.base_cmd = "rosbag record "
-            for topic in topics:
-                self.base_cmd += (topic + " ")
+            default_topics = ["/tf",
+                              "/"+self._robot_name+"/base/references",
+                              "/"+self._robot_name+"/base/measurements",
+                              "/"+self._robot_name+"/initialpose",
+                              "/"+self._robot_name+"/joint_states",
+                              "/amcl_pose",
+                              "/"+self._robot_name+"/base_laser/scan",
+                              "/"+self._robot_name+"/base_laser/scan_raw",
+                              "/"+self._robot_name+"/torso_laser/scan",
+                              "/"+self._robot_name+"/torso_laser/scan_raw",
+                              "/"+self._robot_name+"/top_kinect/rgbd",
+                              "/ed/gui/entities",
+                              "/ed/profile/ed",
+                              "/cb_base_navigation/local_planner_interface/visualization/markers/goal_pose_marker",
+                              "/cb_base_navigation/global_planner_interface/visualization/markers/global_plan",
+                              "/cb_base_navigation/local_planner_interface/DWAPlannerROS/local_traj",
+                              "/cb_base_navigation/local_planner_interface/dwa_planner/cost_cloud",
+                              "/cb_base_navigation/local_planner_interface/action_server/goal"]
+
+            topics = rospy.get_param("/"+self._robot_name+"/skills/nav_analyzer/record_topics", default_topics)
+            duration = rospy.get_param("/"+self._robot_name+"/skills/nav_analyzer/record_duration", 30.0)
+            self.recorder = flight_recorder.FlightRecorder(topics, duration=duration)
+            self.recorder.start()
 
         ''' Initialize variables '''
-        self.previous_position = geometry_msgs.msg.Point()
-        self.previous_position.x = 0.0
-        self.previous_position.y = 0.0
+        self.previous_position   = None
         self.distance_traveled   = 0.0
         self.nr_plan             = 0
         self.nr_clear_costmap    = 0
         self.nr_reset_costmap    = 0
         self.starttime = rospy.Time.now()
+        self.record = None
+
+        ''' Plans are counted from the planning threads of the global planner '''
+        self._lock = threading.Lock()
 
     def start_measurement(self, startpose):
 
         ''' The distance traveled concerns this specific goal '''
+        self.previous_position = None
         self.distance_traveled = 0.0
-        self.nr_plan             = 0
-        self.nr_clear_costmap    = 0
-        self.nr_reset_costmap    = 0
+        self.trajectory.clear()
 
         ''' Set time stamp '''
         self.starttime = rospy.Time.now()
         stamp          = self.getTimeStamp()
 
-        ''' Initialize XML element '''
-        self.logitem = ET.Element("item")
-        self.logitem.set("stamp", stamp)
-        self.planitems = ET.SubElement(self.logitem, "plans")
-        self.clearitems= ET.SubElement(self.logitem, "clears")
-        self.resetitems= ET.SubElement(self.logitem, "resets")
+        ''' Initialize record '''
+        record = {"stamp": stamp,
+                  "start_time": self.starttime.to_sec(),
+                  "plans": [],
+                  "clears": [],
+                  "resets": []}
 
         ''' Log startpose '''
-        startposeitem = ET.SubElement(self.logitem, "startpose")
-        self.poseStampedToSubElement(startpose, startposeitem)
+        self.poseStampedToRecord(startpose, record, "start_")
 
-        ''' Start bagging '''
-        # The os.setsid() is passed in the argument preexec_fn so
-        # it's run after the fork() and before  exec() to run the shell.
-        #cmd = self.base_cmd + "-O ~/ros/data/recorded/rosbags/nav_data/" + "{0}".format(stamp)
-        if self.rosbag:
-            cmd = self.base_cmd + "-O " + self.path + "/" + stamp
-            self.pro = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True, preexec_fn=os.setsid)
-            rospy.logwarn("Logging with PID {0}".format(self.pro.pid))
+        with self._lock:
+            self.nr_plan             = 0
+            self.nr_clear_costmap    = 0
+            self.nr_reset_costmap    = 0
+            self.record = record
 
         ''' Make active '''
         self.active = True
+        self.subscribeOdometry()
 
     def stop_measurement(self, endpose, result):
 
-        ''' Stop rosbagging '''
-        if self.rosbag:
-            os.killpg(self.pro.pid, signal.SIGINT)  # Send the signal to all the process groups
-
         ''' Compute duration '''
         endtime = rospy.Time.now()
         duration = endtime.to_sec() - self.starttime.to_sec()
 
-        ''' Log endpose '''
-        endposeitem = ET.SubElement(self.logitem, "endpose")
-        self.poseStampedToSubElement(endpose, endposeitem)
-
         ''' Make inactive '''
         self.active = False
+        self.unsubscribeOdometry()
+
+        with self._lock:
+            record, self.record = self.record, None
+            record["nr_plans"] = self.nr_plan
+            record["nr_clears"] = self.nr_clear_costmap
+            record["nr_resets"] = self.nr_reset_costmap
+
+        ''' Log endpose '''
+        self.poseStampedToRecord(endpose, record, "end_")
+
+        ''' Trajectory statistics '''
+        self.trajectoryToRecord(record)
 
         ''' Write data to file '''
-        datafile = open(self.filename, 'a')
-
-        ''' With data string '''
-        #datastring = "{0}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\n".format(self.stamp,
-        #                                                       duration,
-        #                                                        self.distance_traveled,
-        #                                                        result,
-        #                                                        self.nr_plan,
-        #                                                        self.nr_clear_costmap,
-        #                                                        self.nr_reset_costmap)
-        #datafile.write(datastring)
-
-        ''' Alternative: xml '''
-        self.logitem.set("duration", "{0}".format(duration))
-        #duritem = ET.SubElement(self.logitem, "duration")
-        #duritem.text = "{0}".format(duration)
-
-        self.logitem.set("distance", "{0}".format(self.distance_traveled))
-        #distitem = ET.SubElement(self.logitem, "distance")
-        #distitem.text = "{0}".format(self.distance_traveled)
-
-        self.logitem.set("result", "{0}".format(result))
-        #resultitem = ET.SubElement(self.logitem, "result")
-        #resultitem.text = "{0}".format(result)
-
-        self.indent(self.logitem)
-        #tree = ET.ElementTree(self.logitem)
-        #tree.write(self.filename)
-
-        ''' Writing is not done using tree.write: this will overwrite this. It is also possible to
-        load the tree from the datafile and put this item in the tree, but this will probably become inefficient
-        if the file grows '''
-        datafile.write(ET.tostring(self.logitem, 'utf-8', method="xml"))
-        #open(self.filename, 'a') as output
-        #output.write(tree)
+        record["duration"] = duration
+        record["distance"] = self.distance_traveled
+        record["result"] = "{0}".format(result)
+        self.metrics.write(record)
+
+        ''' Store what happened during a failed goal '''
+        if record["result"] not in self.success_results:
+            self.dump_recording(record["stamp"], duration)
 
         ''' Display results '''
         rospy.loginfo("\n\nNavigation summary:\nCovered {0} meters in {1} seconds ({2}) m/s avg.\nResult = {3} with {4} plans, {5} clears and {6} resets\n\n".format(self.distance_traveled,
@@ -193,66 +237,113 @@ class NavAnalyzer:
         self.nr_clear_costmap,
         self.nr_reset_costmap))
 
-        datafile.close()
+    def dump_recording(self, name, duration=None):
+        """
+        Writes the flight recorder contents to <path>/<name>.bag (if recording is enabled)
+        :param duration: if not None, only the last duration seconds are written
+        """
+        if self.recorder is None:
+            return
+        filename = self.path + "/" + name + ".bag"
+        rospy.logwarn("Nav_analyser: writing recording to {0}".format(filename))
+        self.recorder.dump(filename, duration=duration)
 
     def abort_measurement(self):
         self.active = False
+        self.unsubscribeOdometry()
+        with self._lock:
+            self.record = None
 
     def count_plan(self, robot_pose, target_pose, plantime, distance):
-        self.nr_plan +=1
-        stamp    = self.getTimeStamp()
-        planitem = ET.SubElement(self.planitems, "plan")
-        planitem.set("id", "{0}".format(self.nr_plan))
-        planitem.set("stamp", stamp)
-        planitem.set("planning_time", "{0}".format(plantime))
-        planitem.set("planning_distance", "{0}".format(distance))
-        robotposeitem = ET.SubElement(planitem, "robot_pose")
-        self.poseStampedToSubElement(robot_pose, robotposeitem)
-        goalposeitem = ET.SubElement(planitem, "goal_pose")
-        self.poseStampedToSubElement(target_pose, goalposeitem)
+        ''' Plans are only counted during a measurement (called from the planning threads) '''
+        entry = {"stamp": self.getTimeStamp(),
+                 "planning_time": plantime,
+                 "planning_distance": distance,
+                 "robot_pose": self.poseStampedToList(robot_pose),
+                 "goal_pose": self.poseStampedToList(target_pose)}
+        with self._lock:
+            if self.record is None:
+                return
+            self.nr_plan +=1
+            entry["id"] = self.nr_plan
+            self.record["plans"].append(entry)
 
     def count_reset(self, pose):
-        self.nr_reset_costmap +=1
-        stamp    = self.getTimeStamp()
-        resetitem = ET.SubElement(self.resetitems, "reset")
-        resetitem.set("id", "{0}".format(self.nr_reset_costmap))
-        resetitem.set("stamp", stamp)
-        poseitem = ET.SubElement(resetitem, "pose")
-        self.poseStampedToSubElement(pose, poseitem)
+        with self._lock:
+            if self.record is None:
+                return
+            self.nr_reset_costmap +=1
+            self.record["resets"].append({"id": self.nr_reset_costmap,
+                                          "stamp": self.getTimeStamp(),
+                                          "pose": self.poseStampedToList(pose)})
 
     def count_clear(self, pose):
-        self.nr_clear_costmap +=1
-        stamp    = self.getTimeStamp()
-        clearitem = ET.SubElement(self.clearitems, "clear")
-        clearitem.set("id", "{0}".format(self.nr_clear_costmap))
-        clearitem.set("stamp", stamp)
-        poseitem = ET.SubElement(clearitem, "pose")
-        self.poseStampedToSubElement(pose, poseitem)
+        with self._lock:
+            if self.record is None:
+                return
+            self.nr_clear_costmap +=1
+            self.record["clears"].append({"id": self.nr_clear_costmap,
+                                          "stamp": self.getTimeStamp(),
+                                          "pose": self.poseStampedToList(pose)})
+
+    def subscribeOdometry(self):
+        if self.odom_sub is None:
+            self.odom_sub = rospy.Subscriber("/"+self._robot_name+"/base/measurements", nav_msgs.msg.Odometry, self.odomCallback, queue_size=10)
+
+    def unsubscribeOdometry(self):
+        if self.odom_sub is not None:
+            self.odom_sub.unregister()
+            self.odom_sub = None
 
     def odomCallback(self, odom_msg):
+        if not self.active:
+            return
 
         current_position = odom_msg.pose.pose.position
-        if self.active:
+        if self.previous_position is not None:
             dx = current_position.x - self.previous_position.x
             dy = current_position.y - self.previous_position.y
             self.distance_traveled += math.sqrt( dx*dx + dy*dy)
 
         self.previous_position = current_position
 
-    def poseStampedToSubElement(self, pose_stamped, element):
+        twist = odom_msg.twist.twist
+        self.trajectory.add(odom_msg.header.stamp.to_sec(), current_position.x, current_position.y,
+                            math.hypot(twist.linear.x, twist.linear.y), twist.angular.z)
+
+    def trajectoryToRecord(self, record, profile_interval=1.0):
+        """
+        Adds the speed statistics, the number of stops, the path efficiency (planned / travelled distance) and a speed
+        profile (the speed every profile_interval seconds) of the current measurement to record
+        """
+        samples = self.trajectory.get()
+        if len(samples):
+            speeds = samples[:, 3]
+            record["mean_speed"] = float(np.mean(speeds))
+            record["max_speed"] = float(np.max(speeds))
+            record["max_angular_speed"] = float(np.max(np.abs(samples[:, 4])))
+            record["nr_stops"] = count_stops(samples[:, 0], speeds)
+            profile_stamps = np.arange(samples[0, 0], samples[-1, 0] + 1e-6, profile_interval)
+            record["speed_profile"] = np.round(np.interp(profile_stamps, samples[:, 0], speeds), 3).tolist()
+
+        if record["plans"]:
+            planned = record["plans"][0]["planning_distance"]
+            record["planned_distance"] = planned
+            if self.distance_traveled > 0:
+                record["path_efficiency"] = planned / self.distance_traveled
+
+    def poseStampedToList(self, pose_stamped):
         x   = pose_stamped.pose.position.x
         y   = pose_stamped.pose.position.y
         phi = transformations.euler_z_from_quaternion(pose_stamped.pose.orientation)
-        element.set("x", "{0}".format(x))
-        element.set("y", "{0}".format(y))
-        element.set("phi", "{0}".format(phi))
+        return [x, y, phi]
 
-        #xitem = ET.SubElement(element, "x")
-        #xitem.text = "{0}".format(x)
-        #yitem = ET.SubElement(element, "y")
-        #yitem.text = "{0}".format(y)
-        #phiitem = ET.SubElement(element, "phi")
-        #phiitem.text = "{0}".format(phi)
+    def poseStampedToRecord(self, pose_stamped, record, prefix):
+        """ Stores the pose as flat fields (e.g. start_x, start_y, start_phi), so it can be loaded as columns """
+        x, y, phi = self.poseStampedToList(pose_stamped)
+        record[prefix + "x"] = x
+        record[prefix + "y"] = y
+        record[prefix + "phi"] = phi
 
     def getTimeStamp(self):
         stamp = datetime.datetime.now()
@@ -273,19 +364,3 @@ class NavAnalyzer:
             datestr += "0"
         datestr += "{0}_{1}".format(stamp.second, stamp.microsecond)
         return datestr
-
-    def indent(self, elem, level=0):
-        i = "\n" + level*"  "
-        if len(elem):
-            if not elem.text or not elem.text.strip():
-                elem.text = i + "  "
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = i
-            for elem in elem:
-                self.indent(elem, level+1)
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = i
-        else:
-            if level and (not elem.tail or not elem.tail.strip()):
-                elem.tail = i
-
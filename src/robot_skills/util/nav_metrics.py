@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+"""
+Compact navigation metrics log: one JSON object per line (NDJSON), appended with buffered writes.
+
+Every line is a complete record, so a log can be appended to by several runs, read while it is being written and a
+crash can at most truncate the last line (which the reader skips).
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class NavMetricsWriter(object):
+    """
+    Appends records (dicts with JSON serializable values) to an NDJSON file. Records are buffered in memory and written
+    when max_buffered records are buffered or flush_interval seconds have passed since the last write. The file is
+    fsynced at most every fsync_interval seconds.
+    """
+    def __init__(self, filename, max_buffered=10, flush_interval=5.0, fsync_interval=60.0):
+        self.filename = filename
+        self.max_buffered = max_buffered
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._file = open(filename, 'a')
+        self._last_flush = time.time()
+        self._last_fsync = time.time()
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':'), sort_keys=True)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.max_buffered or time.time() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self, fsync=False):
+        """
+        Writes all buffered records to the file
+        :param fsync: if True, also make sure the data is on disk
+        """
+        with self._lock:
+            self._flush(fsync)
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._flush(fsync=True)
+            self._file.close()
+
+    def _flush(self, fsync=False):
+        if self._file.closed:
+            return
+        if self._buffer:
+            self._file.write("\n".join(self._buffer) + "\n")
+            self._buffer = []
+        self._file.flush()
+        now = time.time()
+        self._last_flush = now
+        if fsync or now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+
+
+def read_records(filenames):
+    """
+    Yields the records of one or more NDJSON files one by one (memory use does not depend on the file size).
+    Incomplete or corrupt lines are skipped.
+    :param filenames: filename or list of filenames
+    """
+    if isinstance(filenames, basestring):
+        filenames = [filenames]
+    for filename in filenames:
+        with open(filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict):
+                    yield record
+
+
+def load_arrays(filenames, fields=None):
+    """
+    Loads the scalar fields of all records into one array per field
+    :param filenames: filename or list of filenames (e.g. the logs of a day)
+    :param fields: list of field names to load. If None, all fields with scalar values are loaded
+    :return: dict field --> array with one element per record. Numeric fields are float arrays with NaN for records
+        without the field, other fields are object arrays with None for records without the field.
+
+    >>> import tempfile
+    >>> filename = tempfile.mktemp(suffix=".ndjson")
+    >>> writer = NavMetricsWriter(filename)
+    >>> writer.write({"duration": 10.0, "result": "succeeded", "plans": [{"planning_time": 0.1}]})
+    >>> writer.write({"duration": 4.0, "result": "blocked"})
+    >>> writer.close()
+    >>> arrays = load_arrays(filename)
+    >>> sorted(arrays) == ["duration", "result"]
+    True
+    >>> arrays["duration"].tolist()
+    [10.0, 4.0]
+    >>> arrays["result"].tolist() == ["succeeded", "blocked"]
+    True
+    >>> os.remove(filename)
+    """
+    columns = {}
+    n = 0
+    for record in read_records(filenames):
+        for key, value in record.items():
+            if fields is not None and key not in fields:
+                continue
+            if isinstance(value, (dict, list)):
+                continue
+            columns.setdefault(key, {})[n] = value
+        n += 1
+
+    arrays = {}
+    for key in (columns if fields is None else fields):
+        values = columns.get(key, {})
+        if all(isinstance(v, (int, long, float)) and not isinstance(v, bool) for v in values.values()):
+            array = np.full(n, np.nan)
+        else:
+            array = np.empty(n, dtype=object)
+        for i, value in values.items():
+            array[i] = value
+        arrays[key] = array
+    return arrays
+
+
+def load_day(directory, fields=None):
+    """
+    Loads all navigation logs (*.ndjson) in a directory, e.g. the directory of a day written by NavAnalyzer, with
+    load_arrays
+    """
+    return load_arrays(sorted(glob.glob(os.path.join(directory, "*.ndjson"))), fields)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+"""
+Vectorized metrics and simplification of (global) plans.
+
+A plan (list of PoseStamped) is converted once to an (N, 2) NumPy array with path_to_array, all other functions
+operate on such arrays.
+"""
+
+import numpy as np
+
+
+def path_to_array(path):
+    """
+    Converts a plan (list of PoseStamped) to an (N, 2) array with the x, y coordinates of the poses
+    """
+    points = np.empty((len(path), 2))
+    for i, pose in enumerate(path):
+        points[i, 0] = pose.pose.position.x
+        points[i, 1] = pose.pose.position.y
+    return points
+
+
+def segment_lengths(points):
+    """
+    Returns the lengths of the N-1 segments of a path
+
+    >>> segment_lengths(np.array([[0.0, 0.0], [3.0, 4.0], [3.0, 5.0]])).tolist()
+    [5.0, 1.0]
+    """
+    if len(points) < 2:
+        return np.zeros(0)
+    d = np.diff(points, axis=0)
+    return np.hypot(d[:, 0], d[:, 1])
+
+
+def cumulative_lengths(points):
+    """
+    Returns for every point the distance along the path from the first point
+
+    >>> cumulative_lengths(np.array([[0.0, 0.0], [3.0, 4.0], [3.0, 5.0]])).tolist()
+    [0.0, 5.0, 6.0]
+    """
+    return np.concatenate(([0.0], np.cumsum(segment_lengths(points))))
+
+
+def path_length(points):
+    """
+    Returns the total length of a path
+
+    >>> path_length(np.array([[0.0, 0.0], [3.0, 4.0], [3.0, 5.0]]))
+    6.0
+    """
+    return float(np.sum(segment_lengths(points)))
+
+
+def curvature(points):
+    """
+    Returns the signed (Menger) curvature at every point of a path: the inverse radius of the circle through the point
+    and its neighbours, positive for left turns. The curvature of the first and the last point is zero.
+
+    >>> curvature(np.array([[0.0, 0.0], [2.0, 0.0], [2.0, 2.0], [0.0, 2.0]])).round(3).tolist()
+    [0.0, 0.707, 0.707, 0.0]
+    """
+    k = np.zeros(len(points))
+    if len(points) < 3:
+        return k
+
+    a, b, c = points[:-2], points[1:-1], points[2:]
+    ab = b - a
+    bc = c - b
+    cross = ab[:, 0] * bc[:, 1] - ab[:, 1] * bc[:, 0]
+    denominator = np.hypot(ab[:, 0], ab[:, 1]) * np.hypot(bc[:, 0], bc[:, 1]) * np.hypot(c[:, 0] - a[:, 0],
+                                                                                      c[:, 1] - a[:, 1])
+    valid = denominator > 0
+    k[1:-1][valid] = 2.0 * cross[valid] / denominator[valid]
+    return k
+
+
+def project_onto_path(points, position):
+    """
+    Projects a position onto the closest segment of a path
+    :param points: (N, 2) array
+    :param position: (x, y)
+    :return: tuple (segment index, distance along the path of the projection, distance of position to the path)
+
+    >>> project_onto_path(np.array([[0.0, 0.0], [2.0, 0.0], [2.0, 2.0]]), (2.5, 1.0))
+    (1, 3.0, 0.5)
+    """
+    position = np.asarray(position, dtype=float)
+    if len(points) < 2:
+        distance = float(np.hypot(*(position - points[0]))) if len(points) else 0.0
+        return 0, 0.0, distance
+
+    starts = points[:-1]
+    d = np.diff(points, axis=0)
+    lengths2 = np.sum(d * d, axis=1)
+    rel = position - starts
+    t = np.zeros(len(d))
+    nonzero = lengths2 > 0
+    t[nonzero] = np.clip(np.sum(rel[nonzero] * d[nonzero], axis=1) / lengths2[nonzero], 0.0, 1.0)
+    offsets = rel - t[:, None] * d
+    distances = np.hypot(offsets[:, 0], offsets[:, 1])
+
+    k = int(np.argmin(distances))
+    along = cumulative_lengths(points)[k] + t[k] * np.sqrt(lengths2[k])
+    return k, float(along), float(distances[k])
+
+
+def remaining_distance(points, position):
+    """
+    Returns the distance along the path from the projection of position to the end of the path
+
+    >>> remaining_distance(np.array([[0.0, 0.0], [2.0, 0.0], [2.0, 2.0]]), (1.0, 0.1))
+    3.0
+    """
+    _, along, _ = project_onto_path(points, position)
+    return path_length(points) - along
+
+
+def simplify(points, tolerance):
+    """
+    Douglas-Peucker simplification: returns the indices of the points to keep, such that no removed point lies further
+    than tolerance from the simplified path. The first and the last point are always kept.
+
+    >>> simplify(np.array([[0.0, 0.0], [1.0, 0.01], [2.0, 0.0], [2.0, 1.0], [2.0, 2.0]]), 0.05).tolist()
+    [0, 2, 4]
+    """
+    n = len(points)
+    if n < 3:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+
+        # Distances of the intermediate points to the segment i-j
+        d = points[j] - points[i]
+        rel = points[i + 1:j] - points[i]
+        length2 = np.dot(d, d)
+        if length2 > 0:
+            t = np.clip(np.dot(rel, d) / length2, 0.0, 1.0)
+            rel = rel - t[:, None] * d
+        distances = np.hypot(rel[:, 0], rel[:, 1])
+
+        k = int(np.argmax(distances))
+        if distances[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+
+    return np.flatnonzero(keep)
+
+
+def simplify_plan(plan, tolerance):
+    """
+    Returns the subset of the poses of plan (list of PoseStamped) that is kept by Douglas-Peucker simplification
+    """
+    return [plan[i] for i in simplify(path_to_array(plan), tolerance)]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
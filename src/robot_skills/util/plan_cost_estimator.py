@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+"""
+Cheap estimate of the global plan cost (path length) between two positions, without calling the global planner.
+
+The estimate is the straight-line distance times a correction factor (path length / straight-line distance) that is
+learned online from real plans. Correction factors are stored per cell of a coarse grid over the goal position, because
+the detour to a goal mainly depends on where the goal is (e.g. in a room with a single door). Goals in cells without
+data use the correction factor learned over all plans.
+"""
+
+import threading
+
+import numpy as np
+
+
+class PlanCostEstimator(object):
+    """
+    Learns and predicts path lengths
+
+    >>> e = PlanCostEstimator(cell_size=1.0, smoothing=0.5)
+    >>> e.estimate((0.0, 0.0), (3.0, 4.0))
+    5.0
+    >>> e.update((0.0, 0.0), (3.0, 4.0), 10.0)
+    >>> e.estimate((0.0, 0.0), (3.0, 4.0))
+    10.0
+    >>> e.estimate_many((0.0, 0.0), [(3.0, 4.0), (-3.0, -4.0)]).tolist()
+    [10.0, 7.5]
+    >>> e.rank((0.0, 0.0), [(3.0, 4.0), (1.0, 0.0)])
+    [1, 0]
+    """
+    def __init__(self, cell_size=2.0, smoothing=0.3, initial_factor=1.0, max_factor=5.0, min_distance=0.2):
+        """
+        :param cell_size: size (in meters) of the grid cells over the goal position
+        :param smoothing: weight of a new observation in the exponential moving average of the correction factors
+        :param initial_factor: correction factor before anything has been learned
+        :param max_factor: observed correction factors are clipped to [1, max_factor]
+        :param min_distance: plans shorter than this (in straight-line distance) are not learned from
+        """
+        self.cell_size = cell_size
+        self.smoothing = smoothing
+        self.max_factor = max_factor
+        self.min_distance = min_distance
+
+        self.global_factor = initial_factor
+        self._factors = {}  # cell --> correction factor
+        self._counts = {}  # cell --> number of observations
+        self._lock = threading.Lock()
+
+    def cell(self, position):
+        """ Returns the grid cell (ix, iy) of a position (x, y) """
+        return int(np.floor(position[0] / self.cell_size)), int(np.floor(position[1] / self.cell_size))
+
+    def factor(self, goal):
+        """ Returns the correction factor for a goal position """
+        return self._factors.get(self.cell(goal), self.global_factor)
+
+    def update(self, start, goal, path_length):
+        """
+        Learns from a real plan
+        :param start: (x, y) of the first pose of the plan
+        :param goal: (x, y) of the last pose of the plan
+        :param path_length: length of the plan
+        """
+        distance = float(np.hypot(goal[0] - start[0], goal[1] - start[1]))
+        if distance < self.min_distance:
+            return
+
+        observed = min(max(path_length / distance, 1.0), self.max_factor)
+        cell = self.cell(goal)
+        with self._lock:
+            self.global_factor += self.smoothing * (observed - self.global_factor)
+            if cell in self._factors:
+                self._factors[cell] += self.smoothing * (observed - self._factors[cell])
+            else:
+                self._factors[cell] = observed
+            self._counts[cell] = self._counts.get(cell, 0) + 1
+
+    def estimate(self, start, goal):
+        """ Returns the estimated path length from start (x, y) to goal (x, y) """
+        return float(np.hypot(goal[0] - start[0], goal[1] - start[1])) * self.factor(goal)
+
+    def estimate_many(self, start, goals):
+        """ Returns an array with the estimated path lengths from start (x, y) to every goal (x, y) """
+        goals = np.asarray(goals, dtype=float).reshape(-1, 2)
+        distances = np.hypot(goals[:, 0] - start[0], goals[:, 1] - start[1])
+        factors = np.array([self.factor(goal) for goal in goals])
+        return distances * factors
+
+    def rank(self, start, goals):
+        """ Returns the indices of goals, sorted by estimated path length from start (cheapest first) """
+        return np.argsort(self.estimate_many(start, goals), kind="mergesort").tolist()
+
+    def clear(self):
+        with self._lock:
+            self._factors.clear()
+            self._counts.clear()
+
+    def get_statistics(self):
+        """ Returns a dict with the number of learned cells and observations and the global correction factor """
+        return {"cells": len(self._factors),
+                "observations": sum(self._counts.values()),
+                "global_factor": self.global_factor}
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+"""
+Cache of grasp_precompute outcomes, indexed by the quantized target pose, to predict whether a grasp target is
+reachable before spending up to the full timeout on a grasp_precompute goal.
+"""
+
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import rospy
+
+
+class ReachabilityCache(object):
+    """
+    Counts the successes and failures of targets per cell of a grid over (x, y, z, roll, pitch, yaw). The cells are
+    kept in least recently used order, the number of cells is bounded by max_entries.
+
+    >>> cache = ReachabilityCache()
+    >>> cache.record((0.5, 0.2, 0.8, 0.0, 0.0, 0.0), False)
+    >>> cache.record((0.51, 0.21, 0.8, 0.0, 0.0, 0.0), False)
+    >>> round(cache.reachability((0.5, 0.2, 0.8, 0.0, 0.0, 0.0)), 2)
+    0.25
+    >>> cache.likely_reachable((0.5, 0.2, 0.8, 0.0, 0.0, 0.0)), cache.likely_reachable((0.5, -0.2, 0.8, 0.0, 0.0, 0.0))
+    (False, True)
+    """
+    def __init__(self, position_resolution=0.05, angle_resolution=math.pi / 8, max_entries=10000, threshold=0.3,
+                 filename=None):
+        """
+        :param position_resolution: size (m) of the cells in x, y and z
+        :param angle_resolution: size (rad) of the cells in roll, pitch and yaw
+        :param max_entries: maximum number of cells
+        :param threshold: targets with a reachability below the threshold are not likely reachable
+        :param filename: if not None, the cache is loaded from and saved to this JSON file
+        """
+        self.position_resolution = position_resolution
+        self.angle_resolution = angle_resolution
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.filename = filename
+
+        self._cells = OrderedDict()  # key --> [successes, failures]
+        self._lock = threading.Lock()
+
+        if filename and os.path.exists(filename):
+            self.load(filename)
+
+    def key(self, pose, flags=()):
+        """
+        Returns the cell of a pose
+        :param pose: tuple (x, y, z, roll, pitch, yaw)
+        :param flags: tuple with additional hashable values the outcome depends on (e.g. pre grasp)
+        """
+        x, y, z, roll, pitch, yaw = pose
+        position = tuple(int(math.floor(v / self.position_resolution)) for v in (x, y, z))
+        orientation = tuple(int(math.floor(_wrap(a) / self.angle_resolution)) for a in (roll, pitch, yaw))
+        return position + orientation + tuple(flags)
+
+    def record(self, pose, reachable, flags=()):
+        """ Adds the outcome of a grasp_precompute goal """
+        key = self.key(pose, flags)
+        with self._lock:
+            counts = self._cells.pop(key, [0, 0])
+            counts[0 if reachable else 1] += 1
+            self._cells[key] = counts
+            while len(self._cells) > self.max_entries:
+                self._cells.popitem(last=False)
+
+    def reachability(self, pose, flags=()):
+        """
+        Returns the estimated probability that a pose is reachable: (successes + 1) / (outcomes + 2) of its cell, 0.5 if
+        there are no outcomes
+        """
+        key = self.key(pose, flags)
+        with self._lock:
+            counts = self._cells.pop(key, None)
+            if counts is None:
+                return 0.5
+            self._cells[key] = counts
+        return (counts[0] + 1.0) / (counts[0] + counts[1] + 2.0)
+
+    def likely_reachable(self, pose, flags=()):
+        """ Returns False if the outcomes of the cell of the pose show the pose is probably not reachable """
+        return self.reachability(pose, flags) >= self.threshold
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+
+    def __len__(self):
+        return len(self._cells)
+
+    def save(self, filename=None):
+        """
+        Writes the cells to a JSON file (atomically, via a temporary file)
+        :return: True if the cache is saved
+        """
+        filename = filename or self.filename
+        if not filename:
+            return False
+        with self._lock:
+            cells = [[list(key), counts[0], counts[1]] for key, counts in self._cells.items()]
+        data = {"position_resolution": self.position_resolution,
+                "angle_resolution": self.angle_resolution,
+                "cells": cells}
+        try:
+            with open(filename + ".tmp", "w") as f:
+                json.dump(data, f)
+            os.rename(filename + ".tmp", filename)
+        except (IOError, OSError) as e:
+            rospy.logwarn("Could not save reachability cache to {0}: {1}".format(filename, e))
+            return False
+        return True
+
+    def load(self, filename=None):
+        """
+        Reads the cells from a JSON file. Files with another resolution are ignored.
+        :return: True if the cache is loaded
+        """
+        filename = filename or self.filename
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            rospy.logwarn("Could not load reachability cache from {0}: {1}".format(filename, e))
+            return False
+        if (data.get("position_resolution") != self.position_resolution or
+                data.get("angle_resolution") != self.angle_resolution):
+            rospy.logwarn("Ignoring reachability cache {0}: different resolution".format(filename))
+            return False
+        with self._lock:
+            self._cells.clear()
+            for key, successes, failures in data.get("cells", [])[-self.max_entries:]:
+                self._cells[tuple(key)] = [successes, failures]
+        return True
+
+
+def _wrap(angle):
+    """ Wraps an angle to [-pi, pi) """
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
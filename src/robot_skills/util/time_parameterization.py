@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+"""
+Time parameterization of joint trajectories: assigns times and velocities to a sequence of joint positions such that
+the trajectory is as fast as possible within per-joint velocity and acceleration limits, optionally starting with the
+velocity of a trajectory that is being executed.
+
+Between waypoints the controller interpolates with cubic splines (positions and velocities given at both ends). The
+segment durations start at the velocity limited minimum and are scaled up iteratively until the velocity and the
+acceleration of every cubic segment are within the limits. All computations are vectorized over segments and joints.
+"""
+
+import numpy as np
+
+
+def waypoint_velocities(positions, durations, velocity_limits, acceleration_limits, start_velocity=None):
+    """
+    Returns the velocities at the waypoints: start_velocity (default zero) at the first and zero at the last waypoint,
+    the average of the velocities of the adjacent segments at interior waypoints (zero if the joint changes direction),
+    clipped to the limits and to the velocities that can be reached from the previous and next waypoint
+    """
+    n = len(positions)
+    velocities = np.zeros_like(positions)
+    if start_velocity is not None:
+        velocities[0] = start_velocity
+    if n > 2:
+        distances = np.abs(np.diff(positions, axis=0))
+        segment_velocities = np.diff(positions, axis=0) / durations[:, None]
+        before, after = segment_velocities[:-1], segment_velocities[1:]
+        velocities[1:-1] = np.where(before * after > 0, 0.5 * (before + after), 0.0)
+        velocities[1:-1] = np.clip(velocities[1:-1], -velocity_limits, velocity_limits)
+
+        # Forward and backward pass: the speed change over a segment is bounded by constant acceleration
+        for i in range(1, n - 1):
+            reachable = np.sqrt(velocities[i - 1] ** 2 + 2 * acceleration_limits * distances[i - 1])
+            velocities[i] = np.clip(velocities[i], -reachable, reachable)
+        for i in range(n - 2, 0, -1):
+            reachable = np.sqrt(velocities[i + 1] ** 2 + 2 * acceleration_limits * distances[i])
+            velocities[i] = np.clip(velocities[i], -reachable, reachable)
+    return velocities
+
+
+def time_parameterize(positions, velocity_limits, acceleration_limits, start_velocity=None, min_segment_duration=0.01,
+                      max_iterations=100, tolerance=1e-3):
+    """
+    Computes times and velocities for a sequence of joint positions, ending at rest
+    :param positions: (N, J) array-like with the joint positions of N waypoints (the first one is the start state)
+    :param velocity_limits: J velocity limits
+    :param acceleration_limits: J acceleration limits
+    :param start_velocity: J velocities in the start state (e.g. of a trajectory that is being executed), default zero
+    :param min_segment_duration: minimum duration (in seconds) between two waypoints
+    :param max_iterations: maximum number of scaling iterations
+    :param tolerance: relative violation of the limits that is accepted
+    :return: tuple (array with N times from start, (N, J) array with the velocities at the waypoints)
+
+    >>> times, velocities = time_parameterize([[0.0], [1.0]], [1.0], [1.0])
+    >>> times.round(3).tolist()
+    [0.0, 2.449]
+    >>> times, velocities = time_parameterize([[0.0, 0.0], [1.0, 0.1], [2.0, 0.2]], [1.0, 1.0], [1.0, 1.0])
+    >>> velocities[1].round(3).tolist()
+    [0.5, 0.05]
+    """
+    positions = np.asarray(positions, dtype=float)
+    velocity_limits = np.asarray(velocity_limits, dtype=float)
+    acceleration_limits = np.asarray(acceleration_limits, dtype=float)
+    if len(positions) < 2:
+        return np.zeros(len(positions)), np.zeros_like(positions)
+
+    if start_velocity is not None:
+        start_velocity = np.asarray(start_velocity, dtype=float)
+
+    distances = np.diff(positions, axis=0)
+    durations = np.maximum(np.max(np.abs(distances) / velocity_limits, axis=1), min_segment_duration)
+
+    for _ in range(max_iterations):
+        velocities = waypoint_velocities(positions, durations, velocity_limits, acceleration_limits, start_velocity)
+        v0, v1 = velocities[:-1], velocities[1:]
+        T = durations[:, None]
+
+        # Accelerations at the start and the end of the cubic segments (the maximum is at one of the ends)
+        a0 = (6 * distances - (4 * v0 + 2 * v1) * T) / T ** 2
+        a1 = (-6 * distances + (2 * v0 + 4 * v1) * T) / T ** 2
+        acceleration_ratio = np.maximum(np.abs(a0), np.abs(a1)) / acceleration_limits
+
+        # Peak velocity inside the segments, where the acceleration is zero
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_peak = np.where(a0 != a1, a0 * T / (a0 - a1), -1.0)
+        inside = (t_peak > 0) & (t_peak < T)
+        v_peak = np.where(inside, v0 + 0.5 * a0 * np.where(inside, t_peak, 0.0), 0.0)
+        velocity_ratio = np.abs(v_peak) / velocity_limits
+
+        # Accelerations scale with 1 / T^2, velocities with 1 / T
+        scale = np.maximum(np.sqrt(np.max(acceleration_ratio, axis=1)), np.max(velocity_ratio, axis=1))
+        if np.all(scale <= 1.0 + tolerance):
+            break
+        durations = durations * np.clip(scale, 1.0, 2.0)
+
+    velocities = waypoint_velocities(positions, durations, velocity_limits, acceleration_limits, start_velocity)
+    return np.concatenate(([0.0], np.cumsum(durations))), velocities
+
+
+def sample(positions, times, velocities, t):
+    """
+    Returns the position and the velocity at time t of the cubic spline through the waypoints
+    :param positions: (N, J) array with the joint positions of the waypoints
+    :param times: N times from start of the waypoints
+    :param velocities: (N, J) array with the velocities at the waypoints
+    :param t: time from start, clamped to [times[0], times[-1]]
+    :return: tuple (J positions, J velocities)
+
+    >>> times, velocities = time_parameterize([[0.0], [1.0]], [1.0], [1.0])
+    >>> [value.round(3).tolist() for value in sample([[0.0], [1.0]], times, velocities, times[-1] / 2)]
+    [[0.5], [0.612]]
+    """
+    positions = np.asarray(positions, dtype=float)
+    i = int(np.clip(np.searchsorted(times, t, side='right') - 1, 0, len(times) - 2))
+    T = times[i + 1] - times[i]
+    s = min(max(t - times[i], 0.0), T)
+
+    p0, v0, v1 = positions[i], velocities[i], velocities[i + 1]
+    d = positions[i + 1] - p0
+    a0 = (6 * d - (4 * v0 + 2 * v1) * T) / T ** 2
+    jerk = (6 * (v0 + v1) * T - 12 * d) / T ** 3  # (a1 - a0) / T
+    return p0 + v0 * s + a0 * s ** 2 / 2 + jerk * s ** 3 / 6, v0 + a0 * s + jerk * s ** 2 / 2
+
+
+def splice(positions, times, velocities, t, new_positions, velocity_limits, acceleration_limits):
+    """
+    Continues a timed trajectory from time t with its remaining waypoints followed by new waypoints. The faster of two
+    options is returned: blending (re-timing from the state at t, without stopping at the end of the trajectory) or
+    appending (keeping the timing of the trajectory and starting the new waypoints from rest at its end).
+    :param positions: (N, J) array with the joint positions of the waypoints of the trajectory
+    :param times: N times from start of the waypoints
+    :param velocities: (N, J) array with the velocities at the waypoints
+    :param t: time from start of the trajectory at which the new trajectory takes over, before times[-1]
+    :param new_positions: (M, J) array-like with the new waypoints
+    :return: tuple (positions, times from t, velocities) of the new trajectory, including the state at t
+
+    >>> times, velocities = time_parameterize([[0.0], [1.0]], [1.0], [1.0])
+    >>> positions, times, velocities = splice([[0.0], [1.0]], times, velocities, 1.0, [[2.0]], [1.0], [1.0])
+    >>> positions.round(3).tolist(), times.round(3).tolist()
+    ([[0.364], [1.0], [2.0]], [0.0, 1.019, 3.019])
+    """
+    positions = np.asarray(positions, dtype=float)
+    new_positions = np.asarray(new_positions, dtype=float)
+    position, velocity = sample(positions, times, velocities, t)
+    remaining = times > t
+
+    blended_positions = np.vstack([position, positions[remaining], new_positions])
+    blended_times, blended_velocities = time_parameterize(blended_positions, velocity_limits, acceleration_limits,
+                                                          start_velocity=velocity)
+
+    new_times, new_velocities = time_parameterize(np.vstack([positions[-1], new_positions]), velocity_limits,
+                                                  acceleration_limits)
+    if blended_times[-1] <= times[-1] - t + new_times[-1]:
+        return blended_positions, blended_times, blended_velocities
+
+    appended_times = np.concatenate(([0.0], times[remaining] - t, times[-1] - t + new_times[1:]))
+    appended_velocities = np.vstack([velocity, velocities[remaining], new_velocities[1:]])
+    return blended_positions, appended_times, appended_velocities
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
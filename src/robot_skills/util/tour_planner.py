@@ -0,0 +1,198 @@
+#! /usr/bin/env python
+"""
+Visiting order optimization for tasks that visit several waypoints (e.g. "inspect all rooms").
+
+The global planner can only plan from the current robot pose, so the costs from the robot to every waypoint are real
+path lengths (planned in parallel with GlobalPlanner.getPlans), while the costs between waypoints come from a pair cost
+function (straight-line distance by default). The order is found with a nearest neighbour tour improved by 2-opt and
+Or-opt.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+def euclidean_cost_matrix(positions):
+    """
+    Returns the (N, N) matrix with straight-line distances between positions
+
+    >>> euclidean_cost_matrix([(0.0, 0.0), (3.0, 4.0)]).tolist()
+    [[0.0, 5.0], [5.0, 0.0]]
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    d = positions[:, None, :] - positions[None, :, :]
+    return np.hypot(d[:, :, 0], d[:, :, 1])
+
+
+def tour_cost(start_costs, cost, order):
+    """
+    Returns the cost of visiting the waypoints in order, starting at the robot
+
+    >>> tour_cost([1.0, 2.0], np.array([[0.0, 5.0], [5.0, 0.0]]), [1, 0])
+    7.0
+    """
+    if len(order) == 0:
+        return 0.0
+    order = np.asarray(order)
+    return float(start_costs[order[0]] + np.sum(cost[order[:-1], order[1:]]))
+
+
+def solve_tour(start_costs, cost):
+    """
+    Finds a short order to visit all waypoints, starting at the robot (the robot does not return)
+    :param start_costs: array with the cost from the robot to every waypoint
+    :param cost: (N, N) array with the (symmetric) costs between the waypoints
+    :return: list with waypoint indices in visiting order
+
+    >>> solve_tour([0.0, 3.0, 1.0, 2.0], euclidean_cost_matrix([(0, 0), (3, 0), (1, 0), (2, 0)]))
+    [0, 2, 3, 1]
+    """
+    start_costs = np.asarray(start_costs, dtype=float)
+    n = len(start_costs)
+    if n < 2:
+        return list(range(n))
+
+    # Node 0 is the robot, nodes 1..n the waypoints and node n+1 a dummy end node at zero cost from every waypoint,
+    # which turns the open path into a closed tour with fixed first and last node.
+    D = np.zeros((n + 2, n + 2))
+    D[1:n + 1, 1:n + 1] = cost
+    D[0, 1:n + 1] = D[1:n + 1, 0] = start_costs
+    D[0, n + 1] = D[n + 1, 0] = np.inf
+
+    # Nearest neighbour construction
+    tour = np.zeros(n + 2, dtype=int)
+    visited = np.zeros(n + 2, dtype=bool)
+    visited[0] = visited[n + 1] = True
+    for k in range(1, n + 1):
+        candidates = np.where(visited, np.inf, D[tour[k - 1]])
+        tour[k] = int(np.argmin(candidates))
+        visited[tour[k]] = True
+    tour[n + 1] = n + 1
+
+    improved = True
+    while improved:
+        improved = _two_opt(D, tour) | _or_opt(D, tour)
+
+    return [int(node) - 1 for node in tour[1:n + 1]]
+
+
+def _two_opt(D, tour):
+    """
+    2-opt: reverses tour[i:j+1] if that shortens the tour, evaluating all j for a given i at once. The first and the
+    last node of the tour stay in place.
+    :return: True if the tour was improved
+    """
+    n = len(tour) - 2
+    improved = False
+    for i in range(1, n):
+        js = np.arange(i + 1, n + 1)
+        a, pi = tour[i - 1], tour[i]
+        pj, b = tour[js], tour[js + 1]
+        delta = D[a, pj] + D[pi, b] - D[a, pi] - D[pj, b]
+        k = int(np.argmin(delta))
+        if delta[k] < -1e-9:
+            j = js[k]
+            tour[i:j + 1] = tour[i:j + 1][::-1].copy()
+            improved = True
+    return improved
+
+
+def _or_opt(D, tour, max_segment_length=3):
+    """
+    Or-opt: moves a segment of up to max_segment_length nodes (possibly reversed) to the best other place in the tour,
+    evaluating all insertion places at once. The first and the last node of the tour stay in place.
+    :return: True if the tour was improved
+    """
+    n = len(tour) - 2
+    improved = False
+    for length in range(1, max_segment_length + 1):
+        i = 1
+        while i + length <= n + 1:
+            segment = tour[i:i + length].copy()
+            before, after = tour[i - 1], tour[i + length]
+            removal_gain = D[before, segment[0]] + D[segment[-1], after] - D[before, after]
+
+            rest = np.concatenate((tour[:i], tour[i + length:]))
+            a, b = rest[:-1], rest[1:]
+            forward = D[a, segment[0]] + D[segment[-1], b] - D[a, b]
+            backward = D[a, segment[-1]] + D[segment[0], b] - D[a, b]
+            insertion_cost = np.minimum(forward, backward)
+            k = int(np.argmin(insertion_cost))
+            if insertion_cost[k] < removal_gain - 1e-9:
+                if backward[k] < forward[k]:
+                    segment = segment[::-1]
+                tour[:] = np.concatenate((rest[:k + 1], segment, rest[k + 1:]))
+                improved = True
+            i += 1
+    return improved
+
+
+class TourPlanner(object):
+    """
+    Determines the order in which to visit a set of waypoints. Pair costs between waypoints are cached.
+    """
+    def __init__(self, global_planner, pair_cost=None, resolution=0.1, max_cache_size=10000):
+        """
+        :param global_planner: GlobalPlanner, used for the costs from the robot to the waypoints
+        :param pair_cost: callable (position_a, position_b) --> cost between two waypoints, e.g.
+            global_planner.cost_estimator.estimate. If None, the straight-line distance is used
+        :param resolution: quantization step (in meters) of the positions for the pair cost cache
+        :param max_cache_size: maximum number of cached pair costs, the least recently used costs are evicted first
+        """
+        self._global_planner = global_planner
+        self._pair_cost = pair_cost
+        self.resolution = resolution
+        self.max_cache_size = max_cache_size
+        self._pair_costs = OrderedDict()
+
+    def cost_matrix(self, positions):
+        """
+        Returns the (N, N) matrix with pair costs between positions
+        """
+        if self._pair_cost is None:
+            return euclidean_cost_matrix(positions)
+
+        n = len(positions)
+        keys = [self._key(p) for p in positions]
+        cost = np.zeros((n, n))
+        for i in range(n):
+            for j in range(i + 1, n):
+                pair = (keys[i], keys[j]) if keys[i] <= keys[j] else (keys[j], keys[i])
+                c = self._pair_costs.pop(pair, None)
+                if c is None:
+                    c = self._pair_cost(positions[i], positions[j])
+                self._pair_costs[pair] = c  # (Re-)insert as most recently used
+                while len(self._pair_costs) > self.max_cache_size:
+                    self._pair_costs.popitem(last=False)
+                cost[i, j] = cost[j, i] = c
+        return cost
+
+    def plan_order(self, position_constraints, positions, timeout=None):
+        """
+        Determines the order in which to visit the waypoints
+        :param position_constraints: list with a PositionConstraint per waypoint
+        :param positions: list with an (x, y) position (in map) per waypoint, used for the pair costs
+        :param timeout: maximum time (in seconds) for planning from the robot to the waypoints
+        :return: tuple (list with waypoint indices in visiting order, estimated total cost). Waypoints that cannot be
+            reached from the current robot pose are left out.
+        """
+        candidates = self._global_planner.getPlans(position_constraints, use_cache=True, timeout=timeout)
+        start_costs = {c.index: c.length for c in candidates}
+
+        reachable = sorted(start_costs)
+        if not reachable:
+            return [], 0.0
+
+        cost = self.cost_matrix([positions[i] for i in reachable])
+        start = np.array([start_costs[i] for i in reachable])
+        order = solve_tour(start, cost)
+        return [reachable[k] for k in order], tour_cost(start, cost, order)
+
+    def _key(self, position):
+        return int(round(position[0] / self.resolution)), int(round(position[1] / self.resolution))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
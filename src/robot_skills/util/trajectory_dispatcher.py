@@ -0,0 +1,274 @@
+#! /usr/bin/env python
+"""
+Central dispatcher for the body joint trajectory action server, which is shared by the arms and the torso.
+
+The hardware action server only has a queue size of 1 and runs at 1000 Hz: if two goals are sent at approximately the
+same time (e.g. an arm goal and a torso goal), one of them is lost. The dispatcher sends all goals from a single worker
+thread with a minimum spacing between goals, so callers never block, and merges goals that are queued at the same time
+into a single goal if they control disjoint joints and have the same timing or are all time parameterized (e.g. an arm
+goal and a torso goal that are timed with the limits of their own joints).
+"""
+
+import threading
+import time
+
+import numpy as np
+import rospy
+from actionlib.action_client import ActionClient, CommState
+from actionlib_msgs.msg import GoalStatus
+from control_msgs.msg import FollowJointTrajectoryAction, FollowJointTrajectoryGoal
+from trajectory_msgs.msg import JointTrajectoryPoint
+
+import time_parameterization
+
+_dispatchers = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_dispatcher(robot_name):
+    """
+    Returns the (single) JointTrajectoryDispatcher of a robot
+    """
+    with _dispatchers_lock:
+        if robot_name not in _dispatchers:
+            _dispatchers[robot_name] = JointTrajectoryDispatcher(robot_name)
+        return _dispatchers[robot_name]
+
+
+class DispatchedGoal(object):
+    """
+    Ticket for a goal that is handed to the dispatcher, with the SimpleActionClient style interface the skills use
+    """
+    def __init__(self, goal, timing=None):
+        self.goal = goal
+        self.timing = timing
+        self.joint_names = frozenset(goal.trajectory.joint_names)
+        self.merged = False  # True if the goal has been sent as part of a merged goal
+        self._goal_handle = None
+        self._state = GoalStatus.PENDING
+        self._result = None
+        self._cancelled = False
+        self._done = threading.Event()
+
+    def wait_for_result(self, timeout=rospy.Duration()):
+        """
+        Waits until the goal is finished
+        :param timeout: rospy.Duration, zero waits forever
+        :return: True if the goal finished within the timeout
+        """
+        seconds = timeout.to_sec()
+        return self._done.wait(seconds if seconds > 0 else None)
+
+    def get_state(self):
+        """ Returns the GoalStatus of the goal """
+        return self._state
+
+    def get_result(self):
+        return self._result
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        """
+        Cancels the goal. A goal that has been merged with goals for other joints (see merged) cancels the merged goal,
+        so the motion of the other joints is cancelled as well. A goal that is still queued is cancelled on its own.
+        """
+        self._cancelled = True
+        goal_handle = self._goal_handle
+        if goal_handle is not None:
+            goal_handle.cancel()
+
+    def _set_goal_handle(self, goal_handle):
+        self._goal_handle = goal_handle
+        if self._cancelled:
+            goal_handle.cancel()
+
+    def _finish(self, state, result=None):
+        self._state = state
+        self._result = result
+        self._done.set()
+
+
+class JointTrajectoryDispatcher(object):
+    """
+    Serializes FollowJointTrajectory goals to /<robot_name>/body/joint_trajectory_action
+    """
+    def __init__(self, robot_name, min_interval=0.002):
+        """
+        :param robot_name: name of the robot
+        :param min_interval: minimum time (in seconds) between two goals that are sent to the action server
+        """
+        self.min_interval = min_interval
+        self._client = ActionClient("/" + robot_name + "/body/joint_trajectory_action", FollowJointTrajectoryAction)
+
+        self._queue = []
+        self._condition = threading.Condition()
+        self._last_send_time = 0.0
+
+        self.goals_sent = 0
+        self.goals_merged = 0
+
+        self._thread = threading.Thread(target=self._run, name="joint_trajectory_dispatcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait_for_server(self, timeout=rospy.Duration()):
+        return self._client.wait_for_server(timeout)
+
+    def send_goal(self, goal, timing=None):
+        """
+        Queues a goal, returns immediately
+        :param goal: FollowJointTrajectoryGoal
+        :param timing: optional tuple (positions, times, velocities) of the time parameterization of the goal, including
+            the start state (see time_parameterization). Timed goals can be merged with goals with another timing.
+        :return: DispatchedGoal
+        """
+        ticket = DispatchedGoal(goal, timing)
+        with self._condition:
+            self._queue.append(ticket)
+            self._condition.notify()
+        return ticket
+
+    def cancel_all_goals(self):
+        """
+        Cancels all queued goals and all goals on the action server
+        """
+        with self._condition:
+            queued, self._queue = self._queue, []
+        for ticket in queued:
+            ticket._finish(GoalStatus.RECALLED)
+        self._client.cancel_all_goals()
+
+    def _run(self):
+        while not rospy.is_shutdown():
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+
+            # Spacing between goals, goals queued in the mean time can be merged
+            remaining = self._last_send_time + self.min_interval - time.time()
+            if remaining > 0:
+                time.sleep(remaining)
+
+            with self._condition:
+                queue, self._queue = self._queue, []
+
+            for tickets in self._merge([ticket for ticket in queue if not ticket._cancelled]):
+                self._send(tickets)
+            for ticket in queue:
+                if ticket._cancelled and ticket._goal_handle is None:
+                    ticket._finish(GoalStatus.RECALLED)
+
+    def _merge(self, tickets):
+        """
+        Groups tickets into goals: a ticket is added to a group if it controls other joints than the group and its
+        trajectory has the same timing, or if it and the group are timed and start at the same time. Otherwise it
+        starts a new group.
+        :return: list of lists of tickets
+        """
+        groups = []
+        for ticket in tickets:
+            for group in groups:
+                if all(not (ticket.joint_names & other.joint_names) and _can_merge(ticket, other) for other in group):
+                    group.append(ticket)
+                    break
+            else:
+                groups.append([ticket])
+        return groups
+
+    def _send(self, tickets):
+        remaining = self._last_send_time + self.min_interval - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+
+        if len(tickets) == 1:
+            goal = tickets[0].goal
+        elif all(_same_timing(tickets[0].goal, ticket.goal) for ticket in tickets[1:]):
+            goal = _merge_goals([ticket.goal for ticket in tickets])
+        else:
+            goal = _merge_timed_goals(tickets)
+        for ticket in tickets:
+            ticket.merged = len(tickets) > 1
+
+        def transition_cb(goal_handle):
+            if goal_handle.get_comm_state() == CommState.DONE:
+                state = goal_handle.get_goal_status()
+                result = goal_handle.get_result()
+                for ticket in tickets:
+                    ticket._finish(state, result)
+
+        goal_handle = self._client.send_goal(goal, transition_cb=transition_cb)
+        for ticket in tickets:
+            ticket._set_goal_handle(goal_handle)
+
+        self._last_send_time = time.time()
+        self.goals_sent += 1
+        self.goals_merged += len(tickets) - 1
+        if len(tickets) > 1:
+            rospy.logdebug("Merged {0} joint trajectory goals into one goal".format(len(tickets)))
+
+
+def _can_merge(ticket_a, ticket_b):
+    if _same_timing(ticket_a.goal, ticket_b.goal):
+        return True
+    # Timed goals can be resampled to a common timing if they start at the same time
+    return (ticket_a.timing is not None and ticket_b.timing is not None and
+            ticket_a.goal.trajectory.header.stamp == ticket_b.goal.trajectory.header.stamp)
+
+
+def _same_timing(goal_a, goal_b):
+    points_a, points_b = goal_a.trajectory.points, goal_b.trajectory.points
+    if goal_a.trajectory.header.stamp != goal_b.trajectory.header.stamp:
+        return False
+    return len(points_a) == len(points_b) and all(a.time_from_start == b.time_from_start
+                                                  for a, b in zip(points_a, points_b))
+
+
+def _merge_goals(goals):
+    """
+    Merges goals for disjoint joints with the same timing into a single goal
+    """
+    merged = _merge_headers(goals)
+    for i, point in enumerate(goals[0].trajectory.points):
+        points = [goal.trajectory.points[i] for goal in goals]
+        merged_point = JointTrajectoryPoint(time_from_start=point.time_from_start)
+        for field in ["positions", "velocities", "accelerations"]:
+            # Velocities and accelerations can only be merged if all goals specify them
+            if all(len(getattr(p, field)) for p in points):
+                setattr(merged_point, field, [value for p in points for value in getattr(p, field)])
+        merged.trajectory.points.append(merged_point)
+    return merged
+
+
+def _merge_timed_goals(tickets):
+    """
+    Merges timed goals for disjoint joints with a different timing into a single goal: every trajectory is sampled at
+    the union of the times of all points, with positions and velocities. The controller interpolates between the points
+    with the same cubic splines as the time parameterization, so every joint still follows its own trajectory. After its
+    last point, a trajectory holds its final position.
+    """
+    merged = _merge_headers([ticket.goal for ticket in tickets])
+    times = np.unique(np.concatenate([ticket.timing[1][1:] for ticket in tickets]))
+    for t in times:
+        point = JointTrajectoryPoint(time_from_start=rospy.Duration(float(t)))
+        for ticket in tickets:
+            positions, velocities = time_parameterization.sample(*(ticket.timing + (t,)))
+            point.positions += positions.tolist()
+            point.velocities += velocities.tolist()
+        merged.trajectory.points.append(point)
+    return merged
+
+
+def _merge_headers(goals):
+    """
+    Returns a goal with the header, joint names and tolerances of goals, without points
+    """
+    merged = FollowJointTrajectoryGoal()
+    merged.trajectory.header = goals[0].trajectory.header
+    for goal in goals:
+        merged.trajectory.joint_names += list(goal.trajectory.joint_names)
+        merged.path_tolerance += list(goal.path_tolerance)
+        merged.goal_tolerance += list(goal.goal_tolerance)
+        merged.goal_time_tolerance = max(merged.goal_time_tolerance, goal.goal_time_tolerance)
+    return merged
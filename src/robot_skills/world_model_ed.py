@@ -24,7 +24,7 @@ import os
 
 import yaml
 
-from .classification_result import ClassificationResult
+from .classification_result import ClassificationResult, ClassificationMatrix
 
 
 class Navigation:
@@ -44,6 +44,89 @@ class Navigation:
 
         return PositionConstraint(constraint=res.position_constraint_map_frame, frame="/map")
 
+
+class KinectUpdateCache(object):
+    """
+    Remembers the result of the last kinect update per area description, together with the (quantized) viewpoint of
+    the robot at the moment of that update. If the same area is updated again from the same viewpoint within max_age
+    seconds, the previous result can be returned instead of segmenting again.
+    """
+    def __init__(self, position_tolerance=0.02, angle_tolerance=0.02, joint_tolerance=0.01, max_age=10.0):
+        """
+        :param position_tolerance: quantization step for the base position and the head target (in meters)
+        :param angle_tolerance: quantization step for the base orientation (in radians)
+        :param joint_tolerance: quantization step for the torso joint positions
+        :param max_age: maximum age (in seconds) of a cached result
+        """
+        self.position_tolerance = position_tolerance
+        self.angle_tolerance = angle_tolerance
+        self.joint_tolerance = joint_tolerance
+        self.max_age = max_age
+
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # area_key --> (viewpoint_key, stamp, result)
+
+    def viewpoint_key(self, base_pose=None, torso_position=None, head_target=None):
+        """
+        Quantizes a viewpoint to a hashable key. Parts that are unknown (None) are kept as None
+        :param base_pose: PoseStamped of the base in map frame
+        :param torso_position: list with torso joint positions
+        :param head_target: PointStamped of the current head goal
+        """
+        base_key = None
+        if base_pose is not None:
+            p = base_pose.pose.position
+            base_key = (base_pose.header.frame_id,
+                        self._quantize(p.x, self.position_tolerance),
+                        self._quantize(p.y, self.position_tolerance),
+                        self._quantize(transformations.euler_z_from_quaternion(base_pose.pose.orientation),
+                                       self.angle_tolerance))
+
+        torso_key = None
+        if torso_position is not None:
+            torso_key = tuple(self._quantize(q, self.joint_tolerance) for q in torso_position)
+
+        head_key = None
+        if head_target is not None:
+            p = head_target.point
+            head_key = (head_target.header.frame_id,
+                        self._quantize(p.x, self.position_tolerance),
+                        self._quantize(p.y, self.position_tolerance),
+                        self._quantize(p.z, self.position_tolerance))
+
+        return base_key, torso_key, head_key
+
+    def lookup(self, area_key, viewpoint_key):
+        """
+        Returns the cached result for area_key if it was obtained from the same viewpoint, otherwise None
+        """
+        entry = self._entries.get(area_key)
+        if entry is not None:
+            key, stamp, result = entry
+            if key == viewpoint_key and None not in key and (rospy.Time.now() - stamp).to_sec() <= self.max_age:
+                self.hits += 1
+                return result
+
+        self.misses += 1
+        return None
+
+    def store(self, area_key, viewpoint_key, result):
+        self._entries[area_key] = (viewpoint_key, rospy.Time.now(), result)
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    @staticmethod
+    def _quantize(value, step):
+        return int(round(value / step))
+
+
 class ED:
 
     def __init__(self, robot_name, tf_listener, wait_service=False):
@@ -65,6 +148,11 @@ class ED:
 
         self._marker_publisher = rospy.Publisher("/" + robot_name + "/ed/simple_query",  visualization_msgs.msg.Marker, queue_size=10)
 
+        # Kinect update cache (opt-in per call of update_kinect). get_viewpoint should be a callable returning a tuple
+        # (base_pose, torso_position, head_target) and is set by the robot
+        self.kinect_cache = KinectUpdateCache()
+        self.get_viewpoint = None
+
     # ----------------------------------------------------------------------------------------------------
     #                                             QUERYING
     # ----------------------------------------------------------------------------------------------------
@@ -153,6 +241,8 @@ class ED:
         except rospy.ServiceException, e:
             rospy.logerr("Could not reset ED: {0}".format(e))
 
+        self.kinect_cache.clear()
+
         rospy.sleep(.2)
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -263,25 +353,42 @@ class ED:
     #                                  KINECT INTEGRATION AND PERCEPTION
     # ----------------------------------------------------------------------------------------------------
 
-    def update_kinect(self, area_description="", background_padding=0):
+    def update_kinect(self, area_description="", background_padding=0, use_cache=False):
         """
         Update ED based on kinect (depth) images
 
         :param area_description An entity id or area description, e.g. "a08d537e-e051-11e5-a34e-6cc217ec9f41" or "on_top_of cabinet-11"
         :param background_padding The maximum distance to which kinect data points are associated to existing objects (in meters).
                Or, in other words: the padding that is added to existing objects before they are removed from the point cloud
+        :param use_cache If True, the previous result for the same area description is returned when the base, torso
+               and head have not moved since that update (see KinectUpdateCache)
         :returns Update result
         """
         # Check the area description
         if area_description == "":
             rospy.logwarn("No area_description provided for 'update_kinect'. This is probably a bad idea.")
 
+        cache_key = None
+        if use_cache:
+            if self.get_viewpoint is None:
+                rospy.logwarn("No viewpoint available for the kinect update cache, performing a full update")
+            else:
+                cache_key = (area_description, background_padding)
+                viewpoint_key = self.kinect_cache.viewpoint_key(*self.get_viewpoint())
+                res = self.kinect_cache.lookup(cache_key, viewpoint_key)
+                if res is not None:
+                    rospy.loginfo("Viewpoint unchanged, reusing previous kinect update of '{0}' ({1} hits, {2} misses)"
+                                  .format(area_description, self.kinect_cache.hits, self.kinect_cache.misses))
+                    return res
+
         # Save the image (logging)
         self.save_image(path_suffix=area_description.replace(" ", "_"))
 
         res = self._ed_kinect_update_srv(area_description = area_description, background_padding = background_padding)
         if res.error_msg:
             rospy.logerr("Could not segment objects: %s" % res.error_msg)
+        elif cache_key is not None:
+            self.kinect_cache.store(cache_key, viewpoint_key, res)
 
         return res
 
@@ -310,6 +417,32 @@ class ED:
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+    def classify_matrix(self, ids, types=None, labels=None):
+        """ Classifies the entities with the given IDs and returns the posteriors in dense form
+        Args:
+            ids: list with IDs
+            types: list with types to identify
+            labels: optional fixed label vocabulary (columns). If None, all labels in the posteriors are used
+
+        Returns: ClassificationMatrix with one row per entity. Use to_results() to get a list of ClassificationResults
+
+        """
+        res = self._ed_classify_srv(ids=ids)
+        if res.error_msg:
+            rospy.logerr("While classifying entities: %s" % res.error_msg)
+
+        matrix = ClassificationMatrix.from_posteriors(res.ids,
+                                                      [(distr.values, distr.probabilities) for distr in res.posteriors],
+                                                      labels=labels,
+                                                      expected_values=res.expected_values,
+                                                      expected_value_probabilities=res.expected_value_probabilities)
+        if types is not None:
+            matrix = matrix.filter_types(types)
+
+        return matrix
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
     def save_image(self, path = "", path_suffix = "", filename = ""):
         import os
         import time
@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+"""
+Micro-benchmark of the per-call overhead of sending named joint goals. Needs the ROS messages, but no running robot:
+the arm is created without its constructor and the goals are handed to a dispatcher that does not send them.
+
+Compares building the goal for every call (_send_joint_trajectory) with the cached goal templates of send_joint_goal and
+send_joint_trajectory, which only fill in the header and the timing, with and without time parameterization. With
+limits, most of the time is spent in the time parameterization, which depends on the measured start state and is done
+for every call either way.
+"""
+import time
+
+import rospy
+from sensor_msgs.msg import JointState
+
+from robot_skills.arms import Arm
+
+
+class NullDispatcher(object):
+    def send_goal(self, goal, timing=None):
+        return None
+
+
+class ReadyServer(object):
+    def wait(self, timeout=None):
+        return True
+
+
+def make_arm(with_limits):
+    arm = Arm.__new__(Arm)
+    arm.side = "left"
+    arm.joint_names = ["shoulder_yaw_joint_left", "shoulder_pitch_joint_left", "shoulder_roll_joint_left",
+                       "elbow_pitch_joint_left", "elbow_roll_joint_left", "wrist_pitch_joint_left",
+                       "wrist_yaw_joint_left"]
+    arm.torso_joint_names = ["torso_joint"]
+    arm.default_configurations = {"reset": [-0.1, -0.2, 0.2, 0.8, 0.0, 0.0, 0.0]}
+    arm.default_trajectories = {"wave": [[-0.2, 0.4, 0.7, 1.4, -1.75, 0.3, 0.0],
+                                         [-0.2, 0.4, 0.7, 1.6, -1.75, 0.3, 0.0],
+                                         [-0.2, 0.4, 0.7, 1.3, -1.75, 0.3, 0.0],
+                                         [-0.2, 0.4, 0.7, 1.4, -1.75, 0.3, 0.0]]}
+    arm._compiled_references = {}
+    arm._joint_traj_dispatcher = NullDispatcher()
+    arm._joint_traj_goal = None
+    arm._joint_traj_server = ReadyServer()
+    arm.joint_limits = {name: (1.0, 2.0) for name in arm.joint_names} if with_limits else {}
+    arm._joint_state = JointState(name=arm.joint_names, position=[0.0] * len(arm.joint_names))
+    return arm
+
+
+def per_call(function, calls=2000):
+    t = time.time()
+    for _ in range(calls):
+        function()
+    return 1e6 * (time.time() - t) / calls
+
+
+if __name__ == "__main__":
+    no_wait = rospy.Duration(0)
+
+    print "{:>12} {:>10} {:>14} {:>14}".format("goal", "timing", "build [us]", "template [us]")
+    for with_limits in [False, True]:
+        arm = make_arm(with_limits)
+        timing = "limits" if with_limits else "none"
+
+        before = per_call(lambda: arm._send_joint_trajectory([arm.default_configurations["reset"]], timeout=no_wait))
+        after = per_call(lambda: arm.send_joint_goal("reset", timeout=0.0))
+        print "{:>12} {:>10} {:>14.1f} {:>14.1f}".format("reset", timing, before, after)
+
+        before = per_call(lambda: arm._send_joint_trajectory(arm.default_trajectories["wave"], timeout=no_wait))
+        after = per_call(lambda: arm.send_joint_trajectory("wave", timeout=0.0))
+        print "{:>12} {:>10} {:>14.1f} {:>14.1f}".format("wave", timing, before, after)
@@ -0,0 +1,45 @@
+#! /usr/bin/env python
+"""
+Benchmark of the visiting order optimization on synthetic waypoint sets. Does not need ROS.
+
+Compares the total cost of visiting random waypoints (robot at the origin) in the given order, in nearest neighbour
+order and in the optimized order, and reports the time needed to find the optimized order.
+"""
+import time
+
+import numpy as np
+
+from robot_skills.util.tour_planner import euclidean_cost_matrix, solve_tour, tour_cost
+
+
+def nearest_neighbour_order(start_costs, cost):
+    order = [int(np.argmin(start_costs))]
+    remaining = set(range(len(start_costs))) - set(order)
+    while remaining:
+        order.append(min(remaining, key=lambda j: cost[order[-1], j]))
+        remaining.remove(order[-1])
+    return order
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(42)
+    trials = 20
+
+    print "{:>6} {:>10} {:>10} {:>10} {:>12}".format("points", "given", "nn", "optimized", "solve [ms]")
+    for n in [5, 10, 20, 50]:
+        given, nn, optimized, solve_times = [], [], [], []
+        for _ in range(trials):
+            positions = rng.uniform(-10.0, 10.0, (n, 2))
+            start_costs = np.hypot(positions[:, 0], positions[:, 1])
+            cost = euclidean_cost_matrix(positions)
+
+            given.append(tour_cost(start_costs, cost, range(n)))
+            nn.append(tour_cost(start_costs, cost, nearest_neighbour_order(start_costs, cost)))
+
+            t = time.time()
+            order = solve_tour(start_costs, cost)
+            solve_times.append(time.time() - t)
+            optimized.append(tour_cost(start_costs, cost, order))
+
+        print "{:>6} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.2f}".format(n, np.mean(given), np.mean(nn),
+                                                                    np.mean(optimized), 1000 * np.mean(solve_times))
@@ -0,0 +1,86 @@
+#! /usr/bin/env python
+"""
+Benchmark of the total execution time of chained arm motions (grasp approach, lift, retract). Does not need ROS.
+
+Compares executing the motions one after another (waiting for each motion to finish, so the arm stops in between)
+with queueing each motion while the previous one is executing, the way Arm.queue_joint_trajectory does: the trajectory
+is spliced SPLICE_LOOKAHEAD seconds after queueing, so the remaining points of the executing trajectory are followed by
+the new points without stopping in between.
+"""
+import numpy as np
+
+from robot_skills.util.time_parameterization import splice, time_parameterize
+
+SPLICE_LOOKAHEAD = 0.1  # As in robot_skills.arms
+
+
+def sequential(start, motions, velocity_limits, acceleration_limits):
+    """ Total time if every motion starts after the previous one finished """
+    total = 0.0
+    for motion in motions:
+        times, _ = time_parameterize(np.vstack([start, motion]), velocity_limits, acceleration_limits)
+        total += times[-1]
+        start = motion[-1]
+    return total
+
+
+def queued(start, motions, velocity_limits, acceleration_limits, queue_fraction):
+    """
+    Total time if every motion is queued when queue_fraction of the executing trajectory has passed
+    """
+    positions = np.vstack([start, motions[0]])
+    times, velocities = time_parameterize(positions, velocity_limits, acceleration_limits)
+    elapsed = 0.0  # Start time of the executing trajectory
+    for motion in motions[1:]:
+        t = min(queue_fraction * times[-1] + SPLICE_LOOKAHEAD, times[-1])
+        if t < times[-1]:
+            positions, times, velocities = splice(positions, times, velocities, t, motion, velocity_limits,
+                                                  acceleration_limits)
+        else:
+            positions = np.vstack([positions[-1], motion])
+            times, velocities = time_parameterize(positions, velocity_limits, acceleration_limits)
+        elapsed += t
+    return elapsed + times[-1]
+
+def make_motions(rng, start, joints, continuing):
+    """
+    Grasp approach (pre-grasp and grasp pose), lift and retract. If continuing, every motion continues in the direction
+    of the previous one, otherwise the directions are random.
+    """
+    direction = rng.uniform(-1.0, 1.0, joints)
+    steps = []
+    for size in [0.6, 0.2, 0.2, 0.6]:
+        step = rng.uniform(0.0, size, joints) * np.sign(direction) if continuing else rng.uniform(-size, size, joints)
+        steps.append(step)
+    pre_grasp = start + steps[0]
+    grasp = pre_grasp + steps[1]
+    lift = grasp + steps[2]
+    retract = lift + steps[3]
+    return [np.array([pre_grasp, grasp]), np.array([lift]), np.array([retract])]
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(42)
+    trials = 50
+    joints = 7
+    names = ["sequential", "queued at 0%", "queued at 50%", "queued at 90%"]
+
+    print "{:>12} {:>15} {:>12} {:>10}".format("motions", "", "total [s]", "speedup")
+    for continuing in [False, True]:
+        results = {name: [] for name in names}
+        for _ in range(trials):
+            velocity_limits = rng.uniform(0.5, 1.5, joints)
+            acceleration_limits = rng.uniform(1.0, 3.0, joints)
+            start = rng.uniform(-0.5, 0.5, joints)
+            motions = make_motions(rng, start, joints, continuing)
+
+            results["sequential"].append(sequential(start, motions, velocity_limits, acceleration_limits))
+            for fraction in [0.0, 0.5, 0.9]:
+                results["queued at {0:.0%}".format(fraction)].append(
+                    queued(start, motions, velocity_limits, acceleration_limits, fraction))
+
+        reference = np.mean(results["sequential"])
+        for name in names:
+            print "{:>12} {:>15} {:>12.2f} {:>10.2f}".format("continuing" if continuing else "random", name,
+                                                             np.mean(results[name]),
+                                                             reference / np.mean(results[name]))
@@ -0,0 +1,212 @@
+#! /usr/bin/env python
+"""
+Tests of the goals that the arms and the torso hand to the joint trajectory dispatcher, without ROS: the ROS modules
+are replaced by mocks, with small stand-ins for the time types and the messages that are built.
+"""
+import os
+import sys
+import types
+import unittest
+
+import mock
+import numpy  # Before sys.modules is patched: restoring it would drop numpy, which can not be imported twice
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+ROS_MODULES = ["actionlib", "actionlib.action_client", "actionlib_msgs", "actionlib_msgs.msg", "diagnostic_msgs",
+               "diagnostic_msgs.msg", "std_msgs", "std_msgs.msg", "tf_server", "tue_manipulation_msgs",
+               "tue_manipulation_msgs.msg", "tue_msgs", "tue_msgs.msg", "visualization_msgs", "visualization_msgs.msg"]
+
+
+class Duration(object):
+    def __init__(self, secs=0.0):
+        self.secs = float(secs)
+
+    def to_sec(self):
+        return self.secs
+
+    def __add__(self, other):
+        return Duration(self.secs + other.secs)
+
+    def __mul__(self, factor):
+        return Duration(self.secs * factor)
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.secs == other.secs
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class Time(Duration):
+    clock = 100.0
+
+    @classmethod
+    def now(cls):
+        return cls(cls.clock)
+
+    def is_zero(self):
+        return self.secs == 0.0
+
+    def __add__(self, duration):
+        return Time(self.secs + duration.secs)
+
+    def __sub__(self, other):
+        return (Duration if isinstance(other, Time) else Time)(self.secs - other.secs)
+
+
+class Message(object):
+    fields = {}
+
+    def __init__(self, **kwargs):
+        for name, default in self.fields.items():
+            setattr(self, name, kwargs.get(name, default()))
+
+
+class Header(Message):
+    fields = {"stamp": Time}
+
+
+class JointTrajectoryPoint(Message):
+    fields = {"positions": list, "velocities": list, "accelerations": list, "time_from_start": Duration}
+
+
+class JointTrajectory(Message):
+    fields = {"header": Header, "joint_names": list, "points": list}
+
+
+class FollowJointTrajectoryGoal(Message):
+    fields = {"trajectory": JointTrajectory, "path_tolerance": list, "goal_tolerance": list,
+              "goal_time_tolerance": Duration}
+
+
+class JointTolerance(Message):
+    fields = {"name": str, "position": float}
+
+
+class JointState(Message):
+    fields = {"name": list, "position": list}
+
+
+def message_module(**classes):
+    module = types.ModuleType("msg")
+    module.__dict__.update(classes)
+    return module
+
+
+def fake_modules():
+    modules = {name: mock.MagicMock() for name in ROS_MODULES}
+    rospy = mock.MagicMock(Duration=Duration, Time=Time)
+    rospy.is_shutdown.return_value = True  # The worker thread of the dispatcher stops, the test sends the goals
+    modules["rospy"] = rospy
+    modules["control_msgs.msg"] = message_module(FollowJointTrajectoryGoal=FollowJointTrajectoryGoal,
+                                                 FollowJointTrajectoryAction=mock.MagicMock(),
+                                                 JointTolerance=JointTolerance)
+    modules["trajectory_msgs.msg"] = message_module(JointTrajectory=JointTrajectory,
+                                                    JointTrajectoryPoint=JointTrajectoryPoint)
+    modules["sensor_msgs.msg"] = message_module(JointState=JointState)
+    for package in ["control_msgs", "trajectory_msgs", "sensor_msgs"]:
+        modules[package] = message_module(msg=modules[package + ".msg"])
+    return modules
+
+
+class ReadyServer(object):
+    def wait(self, timeout=None):
+        return True
+
+
+ARM_JOINTS = ["shoulder_yaw_joint_left", "shoulder_pitch_joint_left", "shoulder_roll_joint_left",
+              "elbow_pitch_joint_left", "elbow_roll_joint_left", "wrist_pitch_joint_left", "wrist_yaw_joint_left"]
+
+
+class TestJointTrajectoryMerge(unittest.TestCase):
+    def setUp(self):
+        # Restores sys.modules (including the imported robot_skills modules) after the test
+        self.modules = mock.patch.dict(sys.modules, fake_modules())
+        self.modules.start()
+        sys.path.insert(0, SRC)
+
+        from robot_skills.util import trajectory_dispatcher
+        self.dispatcher = trajectory_dispatcher.JointTrajectoryDispatcher("amigo")
+        self.dispatcher._thread.join()
+        self.arm = self.make_arm()
+        self.torso = self.make_torso()
+
+    def tearDown(self):
+        sys.path.remove(SRC)
+        self.modules.stop()
+
+    def make_arm(self):
+        from robot_skills.arms import Arm
+        arm = Arm.__new__(Arm)
+        arm.side = "left"
+        arm.joint_names = ARM_JOINTS
+        arm.torso_joint_names = ["torso_joint"]
+        arm.default_configurations = {"reset": [-0.1, -0.2, 0.2, 0.8, 0.0, 0.0, 0.0]}
+        arm._compiled_references = {}
+        arm._joint_traj_dispatcher = self.dispatcher
+        arm._joint_traj_goal = None
+        arm._active_trajectory = None
+        arm._joint_traj_server = ReadyServer()
+        arm.joint_limits = {name: (1.0, 2.0) for name in ARM_JOINTS}
+        arm._joint_state = JointState(name=ARM_JOINTS, position=[0.0] * len(ARM_JOINTS))
+        return arm
+
+    def make_torso(self):
+        from robot_skills.torso import Torso
+        torso = Torso.__new__(Torso)
+        torso.joint_names = ["torso_joint"]
+        torso.default_tolerance = [0.01]
+        torso.lower_limit = [0.09]
+        torso.upper_limit = [0.4]
+        torso.velocity_limits = [0.05]
+        torso.acceleration_limits = [0.1]
+        torso.current_position = JointState(name=["torso_joint"], position=[0.35])
+        torso._dispatcher = self.dispatcher
+        torso._server = ReadyServer()
+        torso._goal = None
+        return torso
+
+    def send_queued(self):
+        """ Sends the queued goals like the worker thread of the dispatcher, returns the goals sent to the server """
+        queue, self.dispatcher._queue = self.dispatcher._queue, []
+        for tickets in self.dispatcher._merge(queue):
+            self.dispatcher._send(tickets)
+        return [call[0][0] for call in self.dispatcher._client.send_goal.call_args_list]
+
+    def test_arm_and_torso_goals_merge(self):
+        self.arm.send_joint_goal("reset", timeout=0.0)
+        self.torso.low()
+
+        goals = self.send_queued()
+        self.assertEqual(len(goals), 1)
+        self.assertTrue(self.arm._joint_traj_goal.merged and self.torso._goal.merged)
+
+        trajectory = goals[0].trajectory
+        self.assertEqual(trajectory.joint_names, ARM_JOINTS + ["torso_joint"])
+        arm_end = self.arm._active_trajectory.times[-1]
+        torso_end = self.torso._goal.timing[1][-1]
+        # The arm is faster than the torso: it reaches its goal at its own time and holds it until the torso arrives
+        self.assertLess(arm_end, torso_end)
+        self.assertEqual([point.time_from_start.to_sec() for point in trajectory.points], [arm_end, torso_end])
+        for point in trajectory.points:
+            self.assertEqual(len(point.positions), len(ARM_JOINTS) + 1)
+            self.assertEqual(len(point.velocities), len(ARM_JOINTS) + 1)
+        reset = self.arm.default_configurations["reset"]
+        numpy.testing.assert_allclose(trajectory.points[0].positions[:-1], reset, atol=1e-9)
+        numpy.testing.assert_allclose(trajectory.points[-1].positions, reset + [0.09], atol=1e-9)
+        self.assertTrue(0.09 < trajectory.points[0].positions[-1] < 0.35)
+
+    def test_queued_goal_for_other_joints_does_not_preempt(self):
+        self.arm.send_joint_goal("reset", timeout=0.0)
+        active = self.arm._joint_traj_goal
+
+        # References for the torso and the arm can not be spliced into the executing arm trajectory
+        references = [[0.3] + self.arm.default_configurations["reset"]]
+        self.assertFalse(self.arm.queue_joint_trajectory(references, timeout=0.05))
+        self.assertIs(self.arm._joint_traj_goal, active)
+        self.assertEqual(len(self.dispatcher._queue), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+#! /usr/bin/env python
+"""
+Smoke test of robot_skills.base that does not need ROS: the ROS modules are replaced by mocks, so this only checks that
+the module imports and that a LocalPlanner can be constructed.
+"""
+import os
+import sys
+import unittest
+
+import mock
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+ROS_MODULES = ["actionlib", "cb_planner_msgs_srvs", "cb_planner_msgs_srvs.msg", "cb_planner_msgs_srvs.srv",
+               "diagnostic_msgs", "diagnostic_msgs.msg", "geometry_msgs", "geometry_msgs.msg", "nav_msgs",
+               "nav_msgs.msg", "rosbag", "rospy", "tf"]
+
+
+class TestLocalPlanner(unittest.TestCase):
+    def setUp(self):
+        # Restores sys.modules (including the imported robot_skills modules) after the test
+        self.modules = mock.patch.dict(sys.modules, {name: mock.MagicMock() for name in ROS_MODULES})
+        self.modules.start()
+        sys.path.insert(0, SRC)
+
+    def tearDown(self):
+        sys.path.remove(SRC)
+        self.modules.stop()
+
+    def test_construct(self):
+        from robot_skills import base
+        local_planner = base.LocalPlanner("amigo", mock.MagicMock(), mock.MagicMock())
+        self.assertEqual(local_planner.getStatus(), "idle")
+
+
+if __name__ == "__main__":
+    unittest.main()